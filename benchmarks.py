@@ -0,0 +1,923 @@
+"""
+Микробенчмарки бота без сети.
+
+Каждый бенчмарк сравнивает текущую реализацию с тем, как было раньше
+(старый вариант воспроизведен прямо здесь), и печатает результаты.
+
+    python benchmarks.py classifier --links 100000
+    python benchmarks.py db --users 300
+    python benchmarks.py history --rows 1000000
+    python benchmarks.py session --requests 2000
+    python benchmarks.py scrape --latency 0.1
+    python benchmarks.py extractors --rounds 20
+    python benchmarks.py users --users 10000,100000,1000000
+    python benchmarks.py record --records 100000
+    python benchmarks.py workers --workers 1,2,4
+    python benchmarks.py metrics --updates 20000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+import typing as tp
+from copy import deepcopy
+
+# movie_finder требует ключ Кинопоиска, а translators при импорте
+# определяет регион по сети
+os.environ.setdefault("KINOPOISK_API", "bench")
+os.environ.setdefault("translators_default_region", "EN")
+
+# сохраненные страницы выдачи Google: <slug>_<номер страницы>.html
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "fixtures", "google")
+CORPUS_QUERIES = {"Матрица": "matrix", "Сталкер": "stalker", "Неизвестный фильм": "unknown"}
+HOSTS = [
+    "lordfilm.lu", "rezka.men", "baksino.example", "gidonline.fun", "www.ivi.ru",
+    "www.kinopoisk.ru", "ru.wikipedia.org", "www.imdb.com", "okko.tv", "wink.ru",
+    "hd.kinogo.biz", "www.youtube.com", "kino.mail.ru", "www.film.ru", "kinonews.ru",
+]
+REDIRECT_FORMS = [
+    "/url?q=https://{host}/film/{n}&sa=U&ved=2ahUKE{n}&usg=AOvVaw{n}",
+    "/url?esrc=s&q=&rct=j&sa=U&url=https://{host}/film/{n}&ved=2ahUKE{n}",
+    "/url?q=https%3A%2F%2F{host}%2Ffilm%2F{n}&sa=U",
+    "https://{host}/watch/{n}?ref=prime",
+]
+
+
+def timed(fn: tp.Callable[[], tp.Any], repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def percentiles(values: tp.List[float]) -> str:
+    values = sorted(values)
+    pick = lambda q: 1000 * values[min(len(values) - 1, int(q / 100 * len(values)))]
+    return f"p50={pick(50):7.2f} ms  p99={pick(99):7.2f} ms"
+
+
+def google_links(count: int, seed: int = 1) -> tp.List[str]:
+    """
+    Ссылки из выдачи Google: разные хосты, формы редиректа и страницы.
+    """
+    rnd = random.Random(seed)
+    return [
+        rnd.choice(REDIRECT_FORMS).format(host=rnd.choice(HOSTS), n=rnd.randrange(count))
+        for _ in range(count)
+    ]
+
+
+def load_corpus() -> tp.Dict[str, str]:
+    """
+    Страницы выдачи из CORPUS_DIR по имени файла без расширения.
+    """
+    corpus = {}
+    for filename in sorted(os.listdir(CORPUS_DIR)):
+        with open(os.path.join(CORPUS_DIR, filename), encoding="utf-8") as f:
+            corpus[os.path.splitext(filename)[0]] = f.read()
+    return corpus
+
+
+def bench_classifier(args: argparse.Namespace) -> None:
+    import movie_finder
+    from movie_finder import (
+        SiteClassifier,
+        banned_sites,
+        good_sites,
+        good_sites_with_priorities,
+    )
+
+    # так ссылки ранжировались до SiteClassifier: поиск подстрок по всей ссылке
+    def old_priority(url: str) -> int:
+        for site_name in banned_sites:
+            if site_name in url:
+                return 0
+        for site_name in good_sites:
+            if site_name in url:
+                return good_sites_with_priorities[site_name]
+        return 1000
+
+    def old_select(links: tp.List[str], top: int) -> tp.List[str]:
+        links_with_priority = set((link, old_priority(link)) for link in links)
+        for link, priority in deepcopy(links_with_priority):
+            if priority == 0:
+                links_with_priority.remove((link, priority))
+        sorted_links = sorted(links_with_priority, key=lambda x: x[1])
+        return [movie[0] for movie in sorted_links[:top]]
+
+    links = google_links(args.links)
+    print(f"{len(links)} links, {len(set(links))} unique, {len(HOSTS)} hosts")
+
+    def new_cold() -> None:
+        movie_finder.site_classifier = SiteClassifier(banned_sites, good_sites_with_priorities)
+        for link in links:
+            movie_finder.get_priority(link)
+
+    # страница выдачи: раньше ссылка классифицировалась в good_link и еще
+    # раз в LinkRanker.add, теперь приоритет приходит вместе со ссылкой
+    def page_twice() -> None:
+        kept = [link for link in links if movie_finder.good_link(link)]
+        [movie_finder.get_priority(link) for link in kept]
+
+    def page_once() -> None:
+        [(link, priority) for link in links if (priority := movie_finder.get_priority(link))]
+
+    rows = [
+        ("priority, substring scan (old)", timed(lambda: [old_priority(link) for link in links])),
+        ("priority, classifier, cold cache", timed(new_cold)),
+        ("priority, classifier, warm cache", timed(lambda: [movie_finder.get_priority(link) for link in links])),
+        ("page, classified twice (old)", timed(page_twice)),
+        ("page, classified once", timed(page_once)),
+        ("top-3 select (old, deepcopy+sort)", timed(lambda: old_select(links, 3))),
+        ("top-3 select (heap)", timed(lambda: movie_finder.select_most_relevant_link(links, 3))),
+    ]
+    for name, elapsed in rows:
+        print(f"  {name:<36} {1000 * elapsed:8.1f} ms  {1e9 * elapsed / len(links):7.0f} ns/link")
+    changed = sum(
+        1 for link in links if (old_priority(link) == 0) != (movie_finder.get_priority(link) == 0)
+    )
+    print(f"  links banned differently than before: {changed} (old rules matched query strings)")
+
+
+async def _db_searches(
+    search: tp.Callable[[int, int], tp.Awaitable[None]], users: int, searches: int
+) -> tp.Tuple[float, tp.List[float], int]:
+    """
+    users пользователей одновременно делают по searches поисков; возвращает
+    общее время, задержку каждого поиска и число поисков, упавших с
+    "database is locked".
+    """
+    latencies: tp.List[float] = []
+    failed = 0
+
+    async def user(user_id: int) -> None:
+        nonlocal failed
+        for n in range(searches):
+            started = time.perf_counter()
+            try:
+                await search(user_id, n)
+            except sqlite3.OperationalError:
+                failed += 1
+            latencies.append(time.perf_counter() - started)
+
+    began = time.perf_counter()
+    await asyncio.gather(*[user(user_id) for user_id in range(users)])
+    return time.perf_counter() - began, latencies, failed
+
+
+async def _bench_db(args: argparse.Namespace) -> None:
+    import aiosqlite
+    import db_helper
+
+    workdir = tempfile.mkdtemp(prefix="cinemabot-bench-")
+    old_path = os.path.join(workdir, "old.db")
+    async with aiosqlite.connect(old_path) as conn:
+        await conn.executescript(db_helper.MIGRATIONS[0])
+
+    # так работали функции db_helper до пула: новое соединение (и новый
+    # поток aiosqlite) на каждый запрос, журнал по умолчанию
+    async def old_search(user_id: int, n: int) -> None:
+        movie_name = f"Фильм {n % 50}"
+        async with aiosqlite.connect(old_path) as conn:
+            await conn.execute(
+                "INSERT INTO search_history (user_id, query, movie_name) VALUES (?, ?, ?)",
+                (user_id, movie_name.lower(), movie_name),
+            )
+            await conn.commit()
+        async with aiosqlite.connect(old_path) as conn:
+            cursor = await conn.execute(
+                "SELECT count FROM movie_stats WHERE user_id = ? AND movie_name = ?",
+                (user_id, movie_name),
+            )
+            if await cursor.fetchone():
+                await conn.execute(
+                    "UPDATE movie_stats SET count = count + 1 WHERE user_id = ? AND movie_name = ?",
+                    (user_id, movie_name),
+                )
+            else:
+                await conn.execute(
+                    "INSERT INTO movie_stats (user_id, movie_name, count) VALUES (?, ?, 1)",
+                    (user_id, movie_name),
+                )
+            await conn.commit()
+        async with aiosqlite.connect(old_path) as conn:
+            cursor = await conn.execute(
+                "SELECT link FROM movie_links WHERE movie_name = ?", (movie_name,)
+            )
+            await cursor.fetchone()
+
+    # пул соединений, но каждая строка истории и счетчик - своя транзакция
+    async def pooled_search(user_id: int, n: int) -> None:
+        movie_name = f"Фильм {n % 50}"
+        async with db_helper._pool.writer() as conn:
+            await conn.execute(
+                "INSERT INTO search_history (user_id, query, movie_name) VALUES (?, ?, ?)",
+                (user_id, movie_name.lower(), movie_name),
+            )
+        async with db_helper._pool.writer() as conn:
+            await conn.execute(
+                "INSERT INTO movie_stats (user_id, movie_name, count) VALUES (?, ?, 1)"
+                " ON CONFLICT (user_id, movie_name) DO UPDATE SET count = count + 1",
+                (user_id, movie_name),
+            )
+        await db_helper.get_movie_info_from_db(movie_name, "ru")
+
+    async def buffered_search(user_id: int, n: int) -> None:
+        movie_name = f"Фильм {n % 50}"
+        await db_helper.record_search(user_id, movie_name.lower(), movie_name)
+        await db_helper.get_movie_info_from_db(movie_name, "ru")
+
+    print(f"{args.users} concurrent users x {args.searches} searches")
+    variants = [
+        ("connection per call (old)", old_search),
+        ("pooled connections", pooled_search),
+        ("pool + write-behind buffer", buffered_search),
+    ]
+    for name, search in variants:
+        db_helper._pool.path = os.path.join(workdir, f"{name.split()[0]}.db")
+        await db_helper.init_db()
+        try:
+            elapsed, latencies, failed = await _db_searches(search, args.users, args.searches)
+        finally:
+            await db_helper.close_db()
+        print(
+            f"  {name:<28} {len(latencies) / elapsed:7.0f} searches/s  {percentiles(latencies)}"
+            f"  failed={failed}"
+        )
+
+
+def bench_db(args: argparse.Namespace) -> None:
+    asyncio.run(_bench_db(args))
+
+
+HISTORY_SQL = (
+    "SELECT query, movie_name, timestamp FROM search_history"
+    " WHERE user_id = ? ORDER BY timestamp DESC LIMIT 10"
+)
+STATS_SQL = "SELECT movie_name, count FROM movie_stats WHERE user_id = ? ORDER BY count DESC"
+
+
+def _fill_history(path: str, rows: int, users: int) -> None:
+    """
+    База в схеме до индексов (первая миграция) с rows поисками users
+    пользователей и статистикой по ним.
+    """
+    import db_helper
+
+    rnd = random.Random(1)
+    conn = sqlite3.connect(path)
+    conn.executescript(db_helper.MIGRATIONS[0])
+    searches = [
+        (rnd.randrange(users), f"фильм {n % 5000}", f"Фильм {n % 5000}", f"2024-01-01 00:00:{n:09d}")
+        for n in range(rows)
+    ]
+    conn.executemany(
+        "INSERT INTO search_history (user_id, query, movie_name, timestamp) VALUES (?, ?, ?, ?)",
+        searches,
+    )
+    conn.execute(
+        "INSERT INTO movie_stats (user_id, movie_name, count)"
+        " SELECT user_id, movie_name, COUNT(*) FROM search_history GROUP BY user_id, movie_name"
+    )
+    conn.commit()
+    conn.close()
+
+
+def bench_history(args: argparse.Namespace) -> None:
+    import aiosqlite
+    import db_helper
+
+    async def migrate(path: str) -> None:
+        async with aiosqlite.connect(path) as conn:
+            await db_helper.migrate(conn)
+
+    workdir = tempfile.mkdtemp(prefix="cinemabot-bench-")
+    before = os.path.join(workdir, "before.db")
+    after = os.path.join(workdir, "after.db")
+    try:
+        _fill_history(before, args.rows, args.users)
+        shutil.copy(before, after)
+        asyncio.run(migrate(after))
+        _time_history(before, after, args)
+    finally:
+        shutil.rmtree(workdir)
+
+
+def _time_history(before: str, after: str, args: argparse.Namespace) -> None:
+    print(f"{args.rows} history rows, {args.users} users")
+    sample = random.Random(2).sample(range(args.users), min(args.queries, args.users))
+    for name, sql in [("/history", HISTORY_SQL), ("/stats", STATS_SQL)]:
+        for label, path in [("before indexes", before), ("after indexes", after)]:
+            conn = sqlite3.connect(path)
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", (0,)).fetchall()
+            latencies = []
+            for user_id in sample:
+                begin = time.perf_counter()
+                conn.execute(sql, (user_id,)).fetchall()
+                latencies.append(time.perf_counter() - begin)
+            conn.close()
+            print(f"  {name:<9} {label:<15} {percentiles(latencies)}  plan: {plan[0][-1]}")
+
+
+async def _bench_session(args: argparse.Namespace) -> None:
+    import aiohttp
+    from aiohttp import web
+
+    import movie_finder
+
+    peers: tp.Set[tp.Any] = set()
+
+    async def page(request: web.Request) -> web.Response:
+        peers.add(request.transport.get_extra_info("peername"))
+        await asyncio.sleep(args.latency)
+        return web.Response(text="<html>" + "x" * 20000 + "</html>", content_type="text/html")
+
+    app = web.Application()
+    app.add_routes([web.get("/search", page)])
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "localhost", 0).start()
+    url = f"http://localhost:{runner.addresses[0][1]}/search"
+
+    # так ходили в сеть до общей сессии: своя сессия и свой пул соединений
+    # на каждый запрос
+    async def per_request() -> None:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as response:
+                await response.text()
+
+    async def shared() -> None:
+        async with movie_finder.get_http_session().get(url) as response:
+            await response.text()
+
+    print(
+        f"{args.requests} requests, {args.concurrency} concurrent,"
+        f" server latency {1000 * args.latency:.0f} ms"
+    )
+    try:
+        for name, fetch in [("session per request (old)", per_request), ("shared session", shared)]:
+            peers.clear()
+            latencies: tp.List[float] = []
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def one() -> None:
+                async with semaphore:
+                    started = time.perf_counter()
+                    await fetch()
+                    latencies.append(time.perf_counter() - started)
+
+            began = time.perf_counter()
+            await asyncio.gather(*[one() for _ in range(args.requests)])
+            elapsed = time.perf_counter() - began
+            print(
+                f"  {name:<26} {args.requests / elapsed:7.0f} req/s  {percentiles(latencies)}"
+                f"  connections={len(peers)}"
+            )
+    finally:
+        await movie_finder.close_http_session()
+        await runner.cleanup()
+
+
+def bench_session(args: argparse.Namespace) -> None:
+    asyncio.run(_bench_session(args))
+
+
+async def _bench_scrape(args: argparse.Namespace) -> None:
+    from collections import Counter
+
+    from aiohttp import web
+
+    import movie_finder
+
+    corpus = load_corpus()
+    rnd = random.Random(1)
+    requests: tp.Counter[str] = Counter()
+
+    async def search(request: web.Request) -> web.Response:
+        query = request.query.get("q", "")
+        slug = next(slug for title, slug in CORPUS_QUERIES.items() if title in query)
+        page = int(request.query.get("start", "0").strip() or 0) // movie_finder.NUM_LINKS_ON_PAGE
+        requests[slug] += 1
+        await asyncio.sleep(args.latency * rnd.uniform(0.5, 2.0))
+        return web.Response(text=corpus[f"{slug}_{page}"], content_type="text/html")
+
+    app = web.Application()
+    app.add_routes([web.get("/search", search)])
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    movie_finder.GOOGLE_URL = f"http://127.0.0.1:{runner.addresses[0][1]}"
+    google = movie_finder.GOOGLE
+    google.bucket.rate = google.bucket.burst = 10 ** 6
+
+    # так искали ссылку до постраничного поиска: все страницы сразу,
+    # ответ - после самой медленной
+    async def fetch_all(title: str) -> tp.Optional[str]:
+        session = movie_finder.get_http_session()
+        pages = await asyncio.gather(
+            *[
+                movie_finder.find_all_links_on_page(
+                    session, movie_finder.create_search_url(title, page_num, "ru")
+                )
+                for page_num in range(movie_finder.NUM_PAGES_TO_SCRAPE)
+            ]
+        )
+        ranker = movie_finder.LinkRanker()
+        for page_num, links in enumerate(pages):
+            ranker.add(page_num, links)
+        best = ranker.best(1)
+        return best[0] if best else None
+
+    async def progressive(title: str) -> tp.Optional[str]:
+        return await movie_finder.find_movie_urls(title, top=1, lang="ru")
+
+    print(
+        f"{len(corpus)} saved pages, page latency {1000 * args.latency:.0f} ms x0.5-2,"
+        f" {args.repeats} searches per query"
+    )
+    try:
+        for title, slug in CORPUS_QUERIES.items():
+            links = {}
+            for name, find in [("fetch all (old)", fetch_all), ("progressive", progressive)]:
+                requests.clear()
+                latencies = []
+                for _ in range(args.repeats):
+                    started = time.perf_counter()
+                    links[name] = await find(title)
+                    latencies.append(time.perf_counter() - started)
+                print(
+                    f"  {slug:<8} {name:<16} {requests[slug] / args.repeats:4.1f} requests/search"
+                    f"  time to link {percentiles(latencies)}"
+                )
+            print(f"  {slug:<8} same link: {len(set(links.values())) == 1} ({links['progressive']})")
+    finally:
+        await movie_finder.close_http_session()
+        await runner.cleanup()
+
+
+def bench_scrape(args: argparse.Namespace) -> None:
+    asyncio.run(_bench_scrape(args))
+
+
+def bench_extractors(args: argparse.Namespace) -> None:
+    from link_extractor import EXTRACTORS, available_extractors
+
+    pages = list(load_corpus().values()) * args.rounds
+    print(f"{len(pages)} pages ({sum(map(len, pages)) // len(pages)} chars each)")
+    expected = None
+    for name in available_extractors():
+        extractor = EXTRACTORS[name]()
+        # пик памяти на разбор одной страницы
+        links, peak = [], 0
+        tracemalloc.start()
+        for html in pages:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            links.append(extractor.extract(html))
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+        elapsed = timed(lambda: [extractor.extract(html) for html in pages])
+        expected = expected or links
+        print(
+            f"  {name:<11} {len(pages) / elapsed:8.0f} pages/s  peak {peak / 1024:6.0f} KiB/page"
+            f"  same links: {links == expected}"
+        )
+
+
+def bench_record(args: argparse.Namespace) -> None:
+    import db_helper
+    from movie_info import MovieInfo, caption_cache
+
+    # так MovieInfo был устроен до NamedTuple: слоты и запрет __setattr__
+    class SlottedMovieInfo:
+        __slots__ = MovieInfo._fields
+
+        def __init__(self, *values: tp.Any) -> None:
+            for name, value in zip(self.__slots__, values):
+                object.__setattr__(self, name, value)
+
+        def __setattr__(self, name: str, value: tp.Any) -> None:
+            raise AttributeError(f"MovieInfo is immutable, cannot set {name}")
+
+    rows = [
+        (
+            f"Фильм {n}", f"https://lordfilm.lu/{n}", f"Фильм {n}", f"Film {n}",
+            f"Описание фильма номер {n}.", f"Description of film {n}.",
+            "драма, комедия", "drama, comedy", 7.5, 1950 + n % 70, n,
+            f"https://posters.example/{n}.jpg", None,
+        )
+        for n in range(args.records)
+    ]
+    # значения полей в порядке MovieInfo: так сравнивается только сам объект
+    fields = [tuple(db_helper.movie_from_row(row)[1]) for row in rows]
+    print(f"{len(rows)} records")
+
+    def per_record(elapsed: float, count: int = len(rows)) -> str:
+        return f"{1e9 * elapsed / count:7.0f} ns/record"
+
+    for name, build in [
+        ("slotted class (old)", lambda values: SlottedMovieInfo(*values)),
+        ("NamedTuple", lambda values: MovieInfo(*values)),
+    ]:
+        # память на 10000 записей; строки и жанры общие с values
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        kept = [build(values) for values in fields[:10000]]
+        size = (tracemalloc.get_traced_memory()[0] - before) / len(kept)
+        tracemalloc.stop()
+        del kept
+        elapsed = timed(lambda: [build(values) for values in fields])
+        print(f"  construct, {name:<24} {per_record(elapsed)}  {size:6.0f} B/record")
+    elapsed = timed(lambda: [db_helper.movie_from_row(row) for row in rows])
+    print(f"  {'movie_from_row (with genres split)':<35} {per_record(elapsed)}")
+
+    movies = [db_helper.movie_from_row(row)[1] for row in rows]
+    warm = movies[: caption_cache.maxsize]
+
+    def render_cold() -> None:
+        caption_cache.clear()
+        for movie in movies:
+            movie.caption("ru")
+
+    [movie.caption("ru") for movie in warm]
+    data = [movie.to_json() for movie in movies]
+    for name, elapsed, count in [
+        ("caption, render", timed(render_cold), len(movies)),
+        ("caption, cache hit", timed(lambda: [movie.caption("ru") for movie in warm]), len(warm)),
+        ("to_json", timed(lambda: [movie.to_json() for movie in movies]), len(movies)),
+        ("from_json", timed(lambda: [MovieInfo.from_json(item) for item in data]), len(data)),
+    ]:
+        print(f"  {name:<35} {per_record(elapsed, count)}")
+    print(f"  json round trip keeps records: {[MovieInfo.from_json(item) for item in data] == movies}")
+
+
+def _fill_users(path: str, users: int) -> None:
+    """
+    Новая база в текущей схеме с users пользователями.
+    """
+    import aiosqlite
+    import db_helper
+
+    async def migrate() -> None:
+        async with aiosqlite.connect(path) as conn:
+            await db_helper.migrate(conn)
+
+    asyncio.run(migrate())
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO users (user_id, user_lang) VALUES (?, ?)",
+        ((user_id, "en" if user_id % 3 == 0 else "ru") for user_id in range(users)),
+    )
+    conn.commit()
+    conn.close()
+
+
+async def _startup(path: str, lazy: bool) -> tp.Tuple[float, int, tp.Any]:
+    """
+    Время запуска (соединения с базой и языки пользователей) и сколько
+    памяти после него занято; возвращает и то, через что бот читает язык.
+    """
+    import db_helper
+    from state_store import SqliteStateStore, UserProfileCache
+
+    db_helper._pool.path = path
+    tracemalloc.start()
+    started = time.perf_counter()
+    await db_helper.init_db()
+    if lazy:
+        languages: tp.Any = UserProfileCache(SqliteStateStore())
+    else:
+        # так было до UserProfileCache: вся таблица users в словарь при запуске
+        with sqlite3.connect(path) as conn:
+            languages = dict(conn.execute("SELECT * from users").fetchall())
+    elapsed = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return elapsed, memory, languages
+
+
+async def _bench_users(paths: tp.Dict[int, str]) -> None:
+    for users, path in paths.items():
+        for name, lazy in [("bulk load (old)", False), ("lazy profile cache", True)]:
+            await _time_startup(path, users, name, lazy)
+
+
+async def _time_startup(path: str, users: int, name: str, lazy: bool) -> None:
+    import db_helper
+
+    elapsed, memory, languages = await _startup(path, lazy)
+    try:
+        if lazy:
+            first = [time.perf_counter()]
+            await languages.get_language(users - 1)
+            first.append(time.perf_counter())
+            await languages.get_language(users - 1)
+            first.append(time.perf_counter())
+            lookups = (
+                f"  first lookup {1000 * (first[1] - first[0]):.2f} ms,"
+                f" cached {1e6 * (first[2] - first[1]):.1f} us"
+            )
+        else:
+            lookups = ""
+        print(
+            f"  {users:>8} users  {name:<19} startup {1000 * elapsed:8.1f} ms"
+            f"  +{memory / 2 ** 20:6.1f} MiB{lookups}"
+        )
+    finally:
+        del languages
+        await db_helper.close_db()
+
+
+def bench_users(args: argparse.Namespace) -> None:
+    workdir = tempfile.mkdtemp(prefix="cinemabot-bench-")
+    try:
+        paths = {users: os.path.join(workdir, f"users-{users}.db") for users in args.users}
+        for users, path in paths.items():
+            _fill_users(path, users)
+        # все замеры в одном event loop: пул соединений db_helper привязан к нему
+        asyncio.run(_bench_users(paths))
+    finally:
+        shutil.rmtree(workdir)
+
+
+async def _bench_metrics(args: argparse.Namespace) -> None:
+    from aiogram import Bot, Dispatcher
+    from aiogram.types import Update
+
+    import loadtest
+    from metrics import HandlerMetricsMiddleware, Registry
+
+    bot = Bot(token=loadtest.FAKE_TOKEN)
+    user = {"id": 1, "is_bot": False, "first_name": "bench"}
+    updates = [
+        Update.model_validate(
+            {
+                "update_id": n,
+                "message": {
+                    "message_id": n,
+                    "date": 0,
+                    "chat": {"id": n, "type": "private"},
+                    "from": user,
+                    "text": "/help",
+                },
+            },
+            context={"bot": bot},
+        )
+        for n in range(args.updates)
+    ]
+
+    def dispatcher(with_metrics: bool) -> Dispatcher:
+        # обработчик ничего не делает: замеряется только путь обновления
+        dp = Dispatcher()
+
+        @dp.message()
+        async def noop(message: tp.Any) -> None:
+            pass
+
+        if with_metrics:
+            dp.message.middleware(HandlerMetricsMiddleware(Registry()))
+        return dp
+
+    async def feed_all(dp: Dispatcher) -> float:
+        started = time.perf_counter()
+        for update in updates:
+            await dp.feed_update(bot, update)
+        return time.perf_counter() - started
+
+    variants = {"without middleware": dispatcher(False), "with middleware": dispatcher(True)}
+    results = dict.fromkeys(variants, float("inf"))
+    # прогоны чередуются, чтобы шум машины поровну попадал в оба варианта
+    for _ in range(args.rounds):
+        for name, dp in variants.items():
+            results[name] = min(results[name], await feed_all(dp) / len(updates))
+    for name, elapsed in results.items():
+        print(f"  feed_update, {name:<22} {1e6 * elapsed:7.1f} us/update")
+    overhead = results["with middleware"] - results["without middleware"]
+    print(f"  middleware overhead                  {1e6 * overhead:7.1f} us/update")
+
+    registry = Registry()
+
+    def timers() -> None:
+        for _ in range(args.updates):
+            with registry.timer("cinemabot_stage", stage="db_lookup"):
+                pass
+
+    print(f"  timer() alone                        {1e6 * timed(timers) / args.updates:7.1f} us/call")
+    await bot.session.close()
+
+
+def bench_metrics(args: argparse.Namespace) -> None:
+    asyncio.run(_bench_metrics(args))
+
+
+def _migrate_worker_db() -> None:
+    import bot
+
+    asyncio.run(bot.migrate_db())
+
+
+def _run_bench_worker(worker: int, unthrottled: bool) -> None:
+    # bot.main включает INFO-логи, а здесь нужен только итог бенчмарка
+    logging.basicConfig(level=logging.WARNING)
+    import bot
+    import movie_finder
+
+    if unthrottled:
+        # как loadtest --unthrottled; лимиты у каждого процесса свои
+        for upstream in (movie_finder.KINOPOISK, movie_finder.GOOGLE):
+            upstream.bucket.rate = upstream.bucket.burst = 10 ** 6
+            upstream._semaphore = asyncio.Semaphore(10 ** 6)
+    bot.run_worker(worker)
+
+
+async def _start_workers(
+    context: tp.Any, workers: int, env: tp.Dict[str, str], stand_ins: tp.Any, unthrottled: bool
+) -> tp.List[tp.Any]:
+    """
+    Запускает workers процессов бота в режиме webhook (как bot.run_workers)
+    и ждет, пока каждый зарегистрирует команды в заглушке Bot API.
+    """
+    loop = asyncio.get_running_loop()
+    # дочерние процессы импортируют bot заново с этим окружением
+    os.environ.update(env)
+    migrate = context.Process(target=_migrate_worker_db)
+    migrate.start()
+    await loop.run_in_executor(None, migrate.join)
+    telegram_calls = stand_ins.calls["telegram"]
+    processes = [
+        context.Process(target=_run_bench_worker, args=(worker, unthrottled))
+        for worker in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    # на старте каждый процесс дважды вызывает setMyCommands, первый еще и setWebhook
+    while stand_ins.calls["telegram"] - telegram_calls < 2 * workers + 1:
+        if not all(process.is_alive() for process in processes):
+            raise RuntimeError("bot worker exited on startup")
+        await asyncio.sleep(0.05)
+    return processes
+
+
+async def _stop_workers(processes: tp.List[tp.Any]) -> None:
+    loop = asyncio.get_running_loop()
+    for process in processes:
+        os.kill(process.pid, signal.SIGINT)
+    for process in processes:
+        await loop.run_in_executor(None, process.join, 10)
+        if process.is_alive():
+            process.terminate()
+
+
+async def _bench_workers(args: argparse.Namespace) -> None:
+    import multiprocessing
+
+    import aiohttp
+    import loadtest
+
+    load_args = loadtest.parse_args(["--updates", str(args.updates), "--seed", "1"])
+    for name in ("kinopoisk", "google", "translate", "telegram", "poster_fetch"):
+        setattr(load_args, f"{name}_latency", args.latency)
+    stand_ins = loadtest.StandIns(load_args)
+    await stand_ins.start()
+    workload = [update for _, update in loadtest.make_workload(load_args)]
+    # первый ответ на обновление: как loadtest.reply_key, но по JSON
+    reply_keys = {
+        f"callback_query_id:{update['callback_query']['id']}"
+        if "callback_query" in update
+        else f"chat_id:{update['message']['chat']['id']}"
+        for update in workload
+    }
+    context = multiprocessing.get_context("spawn")
+    print(
+        f"{len(workload)} updates, upstream latency {1000 * args.latency:.0f} ms,"
+        f" {'no' if args.unthrottled else 'per-process'} upstream limits, {os.cpu_count()} CPUs"
+    )
+    try:
+        for workers in args.workers:
+            with socket.socket() as probe:
+                probe.bind(("127.0.0.1", 0))
+                port = probe.getsockname()[1]
+            workdir = tempfile.mkdtemp(prefix="cinemabot-bench-")
+            env = stand_ins.environ(os.path.join(workdir, "movie.db"))
+            env.update(
+                BOT_MODE="webhook",
+                WEBHOOK_URL=f"http://127.0.0.1:{port}",
+                WEBAPP_HOST="127.0.0.1",
+                WEBAPP_PORT=str(port),
+                BOT_WORKERS=str(workers),
+                METRICS_PORT="",
+            )
+            processes = await _start_workers(context, workers, env, stand_ins, args.unthrottled)
+            try:
+                stand_ins.first_reply.clear()
+                # как Telegram: не больше 40 соединений к webhook
+                connector = aiohttp.TCPConnector(limit=40, force_close=True)
+                async with aiohttp.ClientSession(connector=connector) as session:
+
+                    async def post(update: tp.Dict[str, tp.Any]) -> None:
+                        url = f"http://127.0.0.1:{port}/webhook"
+                        async with session.post(url, json=update) as response:
+                            response.raise_for_status()
+
+                    began = time.perf_counter()
+                    await asyncio.gather(*[post(update) for update in workload])
+                    # webhook подтверждает сразу, ответы бота приходят позже
+                    while not reply_keys <= stand_ins.first_reply.keys():
+                        if time.perf_counter() - began > args.timeout:
+                            break
+                        await asyncio.sleep(0.01)
+                    elapsed = time.perf_counter() - began
+                replied = len(reply_keys & stand_ins.first_reply.keys())
+                print(
+                    f"  {workers:>2} workers  {replied / elapsed:8.1f} updates/s"
+                    f"  ({replied}/{len(workload)} answered in {elapsed:.1f}s)"
+                )
+            finally:
+                await _stop_workers(processes)
+                shutil.rmtree(workdir)
+    finally:
+        await stand_ins.stop()
+
+
+def bench_workers(args: argparse.Namespace) -> None:
+    asyncio.run(_bench_workers(args))
+
+
+BENCHMARKS: tp.Dict[str, tp.Tuple[tp.Callable[[argparse.Namespace], None], str]] = {
+    "classifier": (bench_classifier, "ранжирование ссылок выдачи Google"),
+    "db": (bench_db, "задержка запросов к базе при одновременных пользователях"),
+    "history": (bench_history, "/history и /stats на большой истории до и после индексов"),
+    "session": (bench_session, "общая HTTP-сессия против новой сессии на каждый запрос"),
+    "scrape": (bench_scrape, "постраничный поиск ссылки по сохраненным страницам выдачи"),
+    "extractors": (bench_extractors, "бэкенды link_extractor на сохраненных страницах выдачи"),
+    "users": (bench_users, "время запуска и память при 10k-1M пользователей"),
+    "record": (bench_record, "создание MovieInfo, подписи, JSON и память на запись"),
+    "workers": (bench_workers, "пропускная способность webhook при 1..N процессах бота"),
+    "metrics": (bench_metrics, "цена HandlerMetricsMiddleware и timer() на одно обновление"),
+}
+
+
+def parse_args(argv: tp.Optional[tp.List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="benchmark", required=True)
+    classifier = commands.add_parser("classifier", help=BENCHMARKS["classifier"][1])
+    classifier.add_argument("--links", type=int, default=100000, help="сколько ссылок ранжировать")
+    db = commands.add_parser("db", help=BENCHMARKS["db"][1])
+    db.add_argument("--users", type=int, default=300, help="одновременных пользователей")
+    db.add_argument("--searches", type=int, default=3, help="поисков на пользователя")
+    history = commands.add_parser("history", help=BENCHMARKS["history"][1])
+    history.add_argument("--rows", type=int, default=1000000, help="строк в истории поиска")
+    history.add_argument("--users", type=int, default=10000, help="пользователей")
+    history.add_argument("--queries", type=int, default=200, help="замеров на запрос")
+    session = commands.add_parser("session", help=BENCHMARKS["session"][1])
+    session.add_argument("--requests", type=int, default=2000, help="всего запросов")
+    session.add_argument("--concurrency", type=int, default=50, help="одновременных запросов")
+    session.add_argument("--latency", type=float, default=0.005, help="задержка сервера, секунды")
+    scrape = commands.add_parser("scrape", help=BENCHMARKS["scrape"][1])
+    scrape.add_argument("--latency", type=float, default=0.1, help="задержка страницы выдачи, секунды")
+    scrape.add_argument("--repeats", type=int, default=10, help="поисков на запрос")
+    extractors = commands.add_parser("extractors", help=BENCHMARKS["extractors"][1])
+    extractors.add_argument("--rounds", type=int, default=20, help="сколько раз пройти по страницам")
+    users = commands.add_parser("users", help=BENCHMARKS["users"][1])
+    users.add_argument(
+        "--users",
+        type=lambda value: [int(n) for n in value.split(",")],
+        default=[10000, 100000, 1000000],
+        help="размеры таблицы users через запятую",
+    )
+    record = commands.add_parser("record", help=BENCHMARKS["record"][1])
+    record.add_argument("--records", type=int, default=100000, help="сколько записей создать")
+    workers = commands.add_parser("workers", help=BENCHMARKS["workers"][1])
+    workers.add_argument(
+        "--workers",
+        type=lambda value: [int(n) for n in value.split(",")],
+        default=[1, 2, 4],
+        help="числа процессов через запятую",
+    )
+    workers.add_argument("--updates", type=int, default=2000, help="обновлений на прогон")
+    workers.add_argument("--latency", type=float, default=0.0, help="задержка внешних сервисов, секунды")
+    workers.add_argument("--timeout", type=float, default=120.0, help="сколько ждать ответов, секунды")
+    workers.add_argument("--unthrottled", action="store_true", help="снять ограничения частоты запросов к Кинопоиску и Google")
+    metrics = commands.add_parser("metrics", help=BENCHMARKS["metrics"][1])
+    metrics.add_argument("--updates", type=int, default=20000, help="обновлений на прогон")
+    metrics.add_argument("--rounds", type=int, default=7, help="прогонов каждого варианта")
+    return parser.parse_args(argv)
+
+
+def main() -> None:
+    args = parse_args()
+    BENCHMARKS[args.benchmark][0](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,14 @@ import asyncio
 import logging
 import sys
 import os
-import random
+import multiprocessing
+import typing as tp
 
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import CommandStart, Command
 from aiogram.filters.callback_data import CallbackData, CallbackQuery
 from aiogram.types import (
@@ -15,26 +19,43 @@ from aiogram.types import (
     InlineKeyboardButton,
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
 from movie_finder import (
     get_movie_info,
-    MovieInfo,
-    find_movie_urls,
+    find_local_movie,
+    local_search_stats,
+    link_cache,
     get_random_movie_from_top250,
+    close_http_session,
+    normalize_query,
+    site_classifier,
+    FALLBACK_MATCH_THRESHOLD,
+    KINOPOISK,
+    GOOGLE,
 )
+from movie_info import MovieInfo, caption_cache
+from translate import warm_up_translations, translation_cache_stats
 from db_helper import (
     get_movie_stats,
     get_search_history,
-    save_request_to_db,
     init_db,
-    increment_movie_count,
-    get_users_languages,
-    change_language,
-    add_user,
+    close_db,
     get_movie_info_from_db,
+    get_film_id_by_query,
+    get_movie_info_by_film_id,
+    save_query_alias,
+    query_alias_stats,
+    record_search,
     save_movie_link,
     save_rating_to_db,
+    save_poster_file_id,
 )
+from singleflight import SingleFlight
+from throttle import UpstreamError
+from state_store import get_state_store, UserProfileCache
+from metrics import REGISTRY, HandlerMetricsMiddleware, start_metrics_server, timer
 
 from phrasebook import (
     start_message,
@@ -51,7 +72,8 @@ from phrasebook import (
     history_message_2,
     hello_message,
     choose_genre_message,
-    set_rating_message
+    set_rating_message,
+    commands_description,
 )
 
 load_dotenv()
@@ -61,42 +83,106 @@ STICKERS = {
     "happy_rat": "CAACAgIAAxkBAAENWOVnYuhiwXOwqEi5M1_gfjge50mwzwAC4BwAAj06EUhEul5mn-zHqTYE",
     "it_dog": "CAACAgIAAxkBAAENWOdnYuhtTG4qflu5X9sQ4kbrKniF8QACug0AAtTaoEu7BNkHkbaXRTYE",
 }
-USER_LANG = get_users_languages()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
+# свой сервер Bot API или заглушка для нагрузочного прогона
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# режим получения обновлений: polling или webhook (по умолчанию webhook,
+# если задан WEBHOOK_URL)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+BOT_MODE = os.getenv("BOT_MODE", "webhook" if WEBHOOK_URL else "polling")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+WEBHOOK_MAX_TASKS = int(os.getenv("WEBHOOK_MAX_TASKS", "64"))
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "1000"))
+# несколько процессов-обработчиков на одном порту, только в режиме webhook
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+# язык пользователей, см. state_store
+STATE = get_state_store()
+PROFILES = UserProfileCache(STATE)
+# порт для метрик в формате Prometheus; у процесса номер i - METRICS_PORT + i
+METRICS_PORT = os.getenv("METRICS_PORT")
+bot = Bot(
+    token=BOT_TOKEN,
+    session=(
+        AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+        if TELEGRAM_API_URL
+        else None
+    ),
+)
+# FSM боту не нужен, а MemoryStorage по умолчанию хранит запись для каждой
+# пары (чат, пользователь) и никогда их не удаляет
+dp = Dispatcher(disable_fsm=True)
+dp.message.middleware(HandlerMetricsMiddleware())
+dp.callback_query.middleware(HandlerMetricsMiddleware())
+
+
+def stage_timer(stage: str):
+    """
+    замер одного этапа поиска фильма: db_lookup, kinopoisk, link_search, db_write
+    """
+    return timer("cinemabot_stage", stage=stage)
 
 
 class StatsCallback(CallbackData, prefix="stats"):
     action: str
 
 
-async def set_commands() -> None:
-    commands = [BotCommand(command="/start"), BotCommand(command="/help")]
-    await bot.set_my_commands(commands)
+async def get_user_lang(user_id: int) -> str:
+    """
+    язык пользователя; для тех, кто еще не нажимал /start, - русский
+    """
+    return await PROFILES.get_language(user_id) or "ru"
+
+
+async def set_commands(bot: Bot) -> None:
+    """
+    меню команд; русское - для всех, английское - для клиентов на английском
+    """
+    for lang, language_code in (("ru", None), ("en", "en")):
+        commands = [
+            BotCommand(command=command, description=text)
+            for command, text in commands_description[lang].items()
+        ]
+        await bot.set_my_commands(commands, language_code=language_code)
+
+
+# выполняется при запуске и в режиме polling, и в режиме webhook
+dp.startup.register(set_commands)
+
+
+def check_config() -> None:
+    """
+    Проверяет настройки запуска до того, как бот начнет принимать обновления.
+    """
+    if BOT_MODE not in ("polling", "webhook"):
+        raise RuntimeError(f"unknown BOT_MODE {BOT_MODE}, expected polling or webhook")
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        raise RuntimeError("BOT_MODE=webhook requires WEBHOOK_URL")
 
 
 @dp.message(CommandStart())
 async def send_welcome(message: Message) -> None:
     user_id = message.from_user.id
     logging.info(user_id)
-    if user_id not in USER_LANG:
+    if await PROFILES.get_language(user_id) is None:
         logging.info(f"NEW USER!!!!!!!!!!!!{user_id}!!!!!!!!!!!!!")
-        USER_LANG[user_id] = "ru"
-        user_lang = USER_LANG[user_id]
-        await add_user(user_id)
+        # set_language и добавляет пользователя в хранилище
+        await PROFILES.set_language(user_id, "ru")
+        user_lang = "ru"
         await message.answer(
             hello_message(message.from_user.first_name)[user_lang]
         )
         await message.answer_sticker(STICKERS["happy_rat"])
-    user_lang = USER_LANG[user_id]
+    user_lang = await get_user_lang(user_id)
     await message.answer(start_message[user_lang])
 
 
 @dp.message(Command(commands=["help"]))
 async def show_help(message: Message) -> None:
     user_id = message.from_user.id
-    user_lang = USER_LANG[user_id]
+    user_lang = await get_user_lang(user_id)
     await message.answer(help_message[user_lang])
 
 
@@ -104,7 +190,7 @@ async def show_help(message: Message) -> None:
 async def show_history(message: Message) -> None:
     """Shows the search history for the user."""
     user_id = message.from_user.id
-    user_lang = USER_LANG[user_id]
+    user_lang = await get_user_lang(user_id)
     history = await get_search_history(user_id)
 
     if history:
@@ -122,7 +208,7 @@ async def show_history(message: Message) -> None:
 async def show_stats(message: Message) -> None:
     """Shows movie stats for the user."""
     user_id = message.from_user.id
-    user_lang = USER_LANG[user_id]
+    user_lang = await get_user_lang(user_id)
     stats = await get_movie_stats(user_id)
 
     if stats:
@@ -137,7 +223,7 @@ async def show_stats(message: Message) -> None:
 @dp.message(Command(commands=["language"]))
 async def choose_language(message: Message) -> None:
     user_id = message.from_user.id
-    user_lang = USER_LANG[user_id]
+    user_lang = await get_user_lang(user_id)
     keyboard = get_language_keyboard()
     await message.answer(lang_choose_message[user_lang], reply_markup=keyboard)
 
@@ -177,12 +263,18 @@ def get_genre_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+# в кнопках оценки только id фильма на Кинопоиске: callback_data
+# не больше 64 байт, а название находится по id в movie_links
+class OpenRatingCallback(CallbackData, prefix="open_rating"):
+    film_id: int
+
+
 class RatingCallback(CallbackData, prefix="rating"):
     rating: int
-    movie_name: str
+    film_id: int
 
 
-def get_rating_keyboard(movie_name) -> InlineKeyboardMarkup:
+def get_rating_keyboard(film_id: int) -> InlineKeyboardMarkup:
     """
     клавиатура с кнопками для выcтавления рейтинга
     """
@@ -191,17 +283,72 @@ def get_rating_keyboard(movie_name) -> InlineKeyboardMarkup:
         builder.add(
             InlineKeyboardButton(
                 text=str(rating),
-                callback_data=RatingCallback(rating=rating, movie_name=movie_name).pack(),
+                callback_data=RatingCallback(rating=rating, film_id=film_id).pack(),
             )
         )
     builder.adjust(5)
     return builder.as_markup()
 
-@dp.callback_query(lambda callback_query: callback_query.data.startswith("open_rating_keyboard"))
-async def open_rating_keyboard(callback_query: CallbackQuery) -> None:
-    movie_name = callback_query.data.split(":")[1]
+
+def get_movie_keyboard(link: str, film_id, user_lang: str) -> InlineKeyboardMarkup:
+    """
+    кнопки под найденным фильмом: ссылка на просмотр и оценка
+    (если известен id фильма на Кинопоиске)
+    """
+    buttons = [
+        InlineKeyboardButton(
+            text=watch_message[user_lang],
+            url=site_classifier.target_url(link),
+        )
+    ]
+    if isinstance(film_id, int):
+        buttons.append(
+            InlineKeyboardButton(
+                text=set_rating_message[user_lang],
+                callback_data=OpenRatingCallback(film_id=film_id).pack(),
+            )
+        )
+    return InlineKeyboardMarkup(inline_keyboard=[buttons])
+
+
+async def send_movie(
+    message: Message,
+    movie_info: MovieInfo,
+    lang: str,
+    reply_markup: tp.Optional[InlineKeyboardMarkup] = None,
+) -> None:
+    """
+    Отправляет описание фильма с постером. Постер, который Telegram уже
+    видел, отправляется по file_id, иначе по URL, после чего file_id
+    запоминается. Без постера отправляется просто текст.
+    """
+    caption = movie_info.caption(lang)
+    if movie_info.poster_file_id:
+        try:
+            await message.answer_photo(
+                photo=movie_info.poster_file_id,
+                caption=caption,
+                reply_markup=reply_markup,
+            )
+            return
+        except TelegramBadRequest as e:
+            logging.warning(f"cached poster rejected, sending by url: {e}")
+    if not movie_info.poster_url:
+        await message.answer(caption, reply_markup=reply_markup)
+        return
+    sent = await message.answer_photo(
+        photo=movie_info.poster_url, caption=caption, reply_markup=reply_markup
+    )
+    if sent.photo and isinstance(movie_info.movie_id, int):
+        await save_poster_file_id(movie_info.movie_id, sent.photo[-1].file_id)
+
+
+@dp.callback_query(OpenRatingCallback.filter())
+async def open_rating_keyboard(
+    callback_query: CallbackQuery, callback_data: OpenRatingCallback
+) -> None:
     await callback_query.message.edit_reply_markup(
-        reply_markup=get_rating_keyboard(movie_name)
+        reply_markup=get_rating_keyboard(callback_data.film_id)
     )
     await callback_query.answer()
 
@@ -211,12 +358,15 @@ async def rating_callback_handler(
 ) -> None:
     """Нажатие на кнопку выбора рейтинга"""
     user_id = callback_query.from_user.id
-    user_lang = USER_LANG[user_id]
+    user_lang = await get_user_lang(user_id)
     rating = callback_data.rating
-    movie_name = callback_data.movie_name
-    print(movie_name, ENCODED_TITLES)
-
-    await save_rating_to_db(user_id=user_id, movie_name=ENCODED_TITLES[int(movie_name)], rating=rating)
+    movie = await get_movie_info_by_film_id(callback_data.film_id)
+    # язык мог смениться после поиска, поэтому ищем строку по обоим названиям
+    if movie is None or not await save_rating_to_db(
+        user_id, rating, movie.title_ru, movie.title_en
+    ):
+        await callback_query.answer(film_not_found_message[user_lang])
+        return
     await callback_query.answer(f"Вы поставили оценку {rating}!")
 
 @dp.callback_query(GenreCallback.filter())
@@ -227,34 +377,17 @@ async def genre_callback_handler(
     нажатие на кнопку жанра
     """
     user_id = callback_query.from_user.id
-    user_lang = USER_LANG[user_id]
+    user_lang = await get_user_lang(user_id)
     try:
         genre_name = callback_data.genre_name
-        movie = await get_random_movie_from_top250(
-            genre_name=genre_name, lang=user_lang
-        )
+        pick = await get_random_movie_from_top250(genre_name=genre_name)
 
-        movie_info, link, title = await process_finding(user_id=user_id, movie_name=movie.title_ru, user_lang=user_lang)
+        movie_info, link, title = await process_finding(
+            user_id=user_id, movie_name=pick[0].title_ru, user_lang=user_lang, pick=pick
+        )
         if link:
-            keyboard = InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [
-                        InlineKeyboardButton(
-                            text=watch_message[user_lang],
-                            url="http" + link.split("http")[1].split("&")[0],
-                        ),
-                        InlineKeyboardButton(
-                            text=set_rating_message[user_lang],
-                            callback_data=f"open_rating_keyboard:{title}",
-                        ),
-                    ]
-                ]
-            )
-            await callback_query.message.answer_photo(
-                photo=movie_info.poster_url,
-                caption=str(movie_info),
-                reply_markup=keyboard,
-            )
+            keyboard = get_movie_keyboard(link, movie_info.movie_id, user_lang)
+            await send_movie(callback_query.message, movie_info, user_lang, keyboard)
             await callback_query.answer(film_found_message[user_lang])
         else:
             await callback_query.answer(film_link_not_found_message[user_lang])
@@ -265,115 +398,182 @@ async def genre_callback_handler(
         await callback_query.answer(film_not_found_message[user_lang])
 
 
-async def process_finding(user_id, movie_name, user_lang):
-    try:
-        movie_info_from_db = await get_movie_info_from_db(
-            movie_name, user_lang
-        )
-        logging.info("movie info found")
+async def resolve_movie(movie_name, user_lang):
+    """
+    Находит фильм и ссылку на него по запросу. Одинаковые одновременные
+    запросы выполняются один раз (см. process_finding).
+    """
+    query_key = normalize_query(movie_name)
+    movie_info_from_db = None
+    source = "alias"
+    with stage_timer("db_lookup"):
+        film_id = await get_film_id_by_query(query_key)
+        if film_id is not None:
+            movie_info_from_db = await get_movie_info_by_film_id(film_id)
         if movie_info_from_db:
-            logging.info("movie info found in db")
-            movie_info = MovieInfo(
-                movie_id=None,
-                title_ru=movie_info_from_db["title_ru"],
-                title_en=movie_info_from_db["title_en"],
-                year=movie_info_from_db["year"],
-                length=None,
-                description=movie_info_from_db["description_ru"],
-                description_en=movie_info_from_db["description_en"],
-                genres=movie_info_from_db["genres_ru"].split(", "),
-                genres_en=movie_info_from_db["genres_en"].split(", "),
-                rating=movie_info_from_db["rating"],
-                poster_url=None,
-                lang=user_lang,
-            )
-            movie_true_name = movie_info_from_db["title_ru"]
-            link = movie_info_from_db["link"]
+            query_alias_stats.hits += 1
         else:
-            logging.info("movie info not found in db")
-            movie_info: MovieInfo = await get_movie_info(movie_name, user_lang)
-            movie_true_name = (
-                movie_info.title_ru
-                if user_lang == "ru"
-                else movie_info.title_en
+            query_alias_stats.misses += 1
+            source = "name"
+            movie_info_from_db = await get_movie_info_from_db(
+                movie_name, user_lang
             )
-            logging.info("started looking for link")
-            link = await find_movie_urls(movie_name=movie_true_name, top=1)
-            logging.info("finished looking for link")
+    if not movie_info_from_db and query_key:
+        source = "fts"
+        with stage_timer("local_search"):
+            movie_info_from_db = await find_local_movie(query_key)
+        if movie_info_from_db:
+            with stage_timer("db_write"):
+                await save_query_alias(query_key, movie_info_from_db.movie_id)
+    movie_info = movie_info_from_db
+    if movie_info_from_db:
+        logging.info("movie info found in db")
+    else:
+        logging.info("movie info not found in db")
+        try:
+            with stage_timer("kinopoisk"):
+                movie_info = await get_movie_info(movie_name)
+            source = "kinopoisk"
+        except UpstreamError as e:
+            logging.warning(f"Error: {e} from kinopoisk, looking for a similar stored movie")
+            with stage_timer("local_search"):
+                movie_info = query_key and await find_local_movie(
+                    query_key, threshold=FALLBACK_MATCH_THRESHOLD
+                )
+            if not movie_info:
+                raise
+            # похожий фильм не запоминается алиасом: когда Кинопоиск
+            # вернется, запрос найдет точный ответ
+            source = "fallback"
+    local_search_stats.add(source)
+    movie_true_name = movie_info.title(user_lang)
+    with stage_timer("link_search"):
+        link = await link_cache.get_link(movie_true_name, user_lang)
+    if source == "kinopoisk":
+        await save_found_movie(movie_info, link, query_key)
+    return movie_info, link, movie_true_name
+
+
+async def resolve_picked_movie(movie_info, stored, user_lang):
+    """
+    Находит ссылку на фильм, выбранный из топ-250. Фильм, которого еще нет
+    в базе (stored=False), сохраняется вместе с алиасом его названия.
+    """
+    local_search_stats.add("top250")
+    movie_true_name = movie_info.title(user_lang)
+    with stage_timer("link_search"):
+        link = await link_cache.get_link(movie_true_name, user_lang)
+    if not stored:
+        await save_found_movie(movie_info, link, normalize_query(movie_info.title_ru))
+    return movie_info, link, movie_true_name
 
-        await save_request_to_db(
-            user_id=user_id, query=movie_name, movie_name=movie_true_name
-        )
-        await increment_movie_count(
-            user_id=user_id, movie_name=movie_true_name
+
+async def save_found_movie(movie_info, link, query_key):
+    """
+    Сохраняет фильм, найденный не в базе, и алиас запроса на него.
+    """
+    # фильм сохраняется и без ссылки: на него указывает алиас запроса, и
+    # повторный поиск должен найти его в базе, а не идти в Кинопоиск
+    if not isinstance(movie_info.movie_id, int):
+        return
+    with stage_timer("db_write"):
+        await save_movie_link(
+            movie_name=movie_info.title_ru,
+            link=link,
+            title_ru=movie_info.title_ru,
+            title_en=movie_info.title_en,
+            description_ru=movie_info.description,
+            description_en=movie_info.description_en,
+            genres_ru=", ".join(movie_info.genres),
+            genres_en=", ".join(movie_info.genres_en),
+            rating=movie_info.rating,
+            year=movie_info.year,
+            film_id=movie_info.movie_id,
+            poster_url=movie_info.poster_url,
         )
+        if query_key:
+            await save_query_alias(query_key, movie_info.movie_id)
 
-        if link:
-            await save_movie_link(
-                movie_name=movie_info.title_ru,
-                link=link,
-                title_ru=movie_info.title_ru,
-                title_en=movie_info.title_en,
-                description_ru=movie_info.description,
-                description_en=movie_info.description_en,
-                genres_ru=", ".join(movie_info.genres),
-                genres_en=", ".join(movie_info.genres_en),
-                rating=movie_info.rating,
-                year=movie_info.year,
+
+SEARCHES = SingleFlight()
+
+
+def register_metrics() -> None:
+    """
+    счетчики кешей, поиска и внешних сервисов для /metrics
+    """
+    REGISTRY.add_stats("cinemabot_cache", translation_cache_stats, cache="translation")
+    REGISTRY.add_stats("cinemabot_cache", link_cache.stats, cache="link")
+    REGISTRY.add_stats("cinemabot_cache", query_alias_stats.as_dict, cache="query_alias")
+    REGISTRY.add_stats("cinemabot_cache", PROFILES.stats, cache="user_profile")
+    REGISTRY.add_stats("cinemabot_cache", caption_cache.stats, cache="caption")
+    REGISTRY.add_stats("cinemabot_resolved", local_search_stats.as_dict)
+    REGISTRY.add_stats(
+        "cinemabot_searches",
+        lambda: {
+            "leaders": SEARCHES.leaders,
+            "followers": SEARCHES.followers,
+            "in_flight": SEARCHES.in_flight,
+        },
+    )
+    for upstream in (KINOPOISK, GOOGLE):
+        REGISTRY.add_stats("cinemabot_upstream", upstream.stats, upstream=upstream.name)
+
+
+async def process_finding(user_id, movie_name, user_lang, pick=None):
+    """
+    Ищет фильм для пользователя. Пока такой же запрос (с точностью до
+    normalize_query) на том же языке уже выполняется, новый запрос ждет
+    его результат; историю и статистику каждый пользователь получает свои.
+    Если фильм уже выбран (pick — результат get_random_movie_from_top250,
+    movie_name — его название), ищется только ссылка на него.
+    """
+    if pick is not None:
+        resolve = lambda: resolve_picked_movie(*pick, user_lang)
+    else:
+        resolve = lambda: resolve_movie(movie_name, user_lang)
+    try:
+        movie_info, link, movie_true_name = await SEARCHES.do(
+            (normalize_query(movie_name), user_lang), resolve
+        )
+        with stage_timer("db_write"):
+            await record_search(
+                user_id=user_id,
+                query=movie_name,
+                movie_name=movie_true_name,
             )
-        return movie_info, link, movie_info.title_ru if user_lang == "ru" else movie_info.title_en
+        return movie_info, link, movie_true_name
     except Exception as e:
+        REGISTRY.inc("cinemabot_search_errors_total", error=type(e).__name__)
         return e
 
 
 @dp.message(Command(commands=["random_movie_genre"]))
 async def random_movie_genre_command(message: Message) -> None:
     user_id = message.from_user.id
-    user_lang = USER_LANG[user_id]
+    user_lang = await get_user_lang(user_id)
     await message.answer(
         reply_markup=get_genre_keyboard(), text=choose_genre_message[user_lang]
     )
 
-ENCODED_TITLES = {}
+
 @dp.message()
 async def provide_links_and_description(message: Message) -> None:
     """Handles all text messages (movie name requests)"""
     user_id = message.from_user.id
-    user_lang = USER_LANG[user_id]
+    user_lang = await get_user_lang(user_id)
     movie_name = message.text
     logging.info(f"user {user_id} wanted to find {message.text}")
 
     try:
         movie_info, link, title = await process_finding(user_id=user_id, movie_name=movie_name, user_lang=user_lang)
-        title_num = random.randint(1, 1000000000)
-        ENCODED_TITLES[title_num] = title
-        print(ENCODED_TITLES)
         if link:
             logging.info(f"link found {link}")
-            keyboard = InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [
-                        InlineKeyboardButton(
-                            text=watch_message[user_lang],
-                            url="http" + link.split("http")[1].split("&")[0],
-                        ),
-                        InlineKeyboardButton(
-                            text=set_rating_message[user_lang],
-                            callback_data=f"open_rating_keyboard:{title_num}",
-                        ),
-                    ]
-                ]
-            )
-            await message.answer_photo(
-                photo=movie_info.poster_url,
-                caption=str(movie_info),
-                reply_markup=keyboard,
-            )
+            keyboard = get_movie_keyboard(link, movie_info.movie_id, user_lang)
+            await send_movie(message, movie_info, user_lang, keyboard)
         else:
             logging.info(f"link not found {title}")
-            await message.answer_photo(
-                photo=movie_info.poster_url, caption=str(movie_info)
-            )
+            await send_movie(message, movie_info, user_lang)
             await message.answer(film_link_not_found_message[user_lang])
             await message.answer_sticker(STICKERS["sad_dog"])
     except Exception as e:
@@ -409,22 +609,137 @@ async def language_callback_handler(
     """нажатие на кнопку выбора языка."""
     user_id = callback_query.from_user.id
     language = callback_data.language
-    USER_LANG[user_id] = language
-    change_language(user_id, language)
+    await PROFILES.set_language(user_id, language)
     await callback_query.message.edit_text(
         lang_message[language] + f" {language}"
     )
     await callback_query.answer()
 
 
-async def main() -> None:
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик webhook: сразу отвечает Telegram 200, а обновления
+    обрабатывает в фоне, не больше max_tasks одновременно. Если в очереди
+    уже max_pending обновлений, отвечает 503, и Telegram пришлет их позже.
+    """
+
+    def __init__(self, dispatcher, bot, max_tasks, max_pending, **kwargs):
+        super().__init__(
+            dispatcher=dispatcher, bot=bot, handle_in_background=True, **kwargs
+        )
+        self.max_pending = max_pending
+        self._slots = asyncio.Semaphore(max_tasks)
+
+    async def _background_feed_update(self, bot, update) -> None:
+        async with self._slots:
+            await super()._background_feed_update(bot, update)
+
+    async def _handle_request_background(self, bot, request) -> web.Response:
+        if len(self._background_feed_update_tasks) >= self.max_pending:
+            return web.Response(status=503)
+        return await super()._handle_request_background(bot, request)
+
+
+def create_webhook_app() -> web.Application:
+    """
+    aiohttp-приложение, которое принимает обновления от Telegram на WEBHOOK_PATH.
+    """
+    app = web.Application()
+    BoundedRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        max_tasks=WEBHOOK_MAX_TASKS,
+        max_pending=WEBHOOK_MAX_PENDING,
+        secret_token=WEBHOOK_SECRET,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(worker: int = 0) -> None:
+    app = create_webhook_app()
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(
+        runner, WEBAPP_HOST, WEBAPP_PORT, reuse_port=BOT_WORKERS > 1
+    ).start()
+    try:
+        # webhook один на всех, его регистрирует первый процесс
+        if worker == 0:
+            await bot.set_webhook(
+                WEBHOOK_URL + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                drop_pending_updates=True,
+            )
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def main(worker: int = 0) -> None:
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    check_config()
     await init_db()
+    await STATE.open()
+    await warm_up_translations(GENRES)
+    metrics_runner = None
+    if METRICS_PORT:
+        register_metrics()
+        metrics_runner = await start_metrics_server(int(METRICS_PORT) + worker)
     try:
-        await dp.start_polling(bot, skip_updates=True, on_startup=set_commands)
+        if BOT_MODE == "webhook":
+            await run_webhook(worker)
+        else:
+            await dp.start_polling(bot, skip_updates=True)
     finally:
         await bot.session.close()
+        await link_cache.stop()
+        await close_http_session()
+        await STATE.close()
+        await close_db()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+
+async def migrate_db() -> None:
+    await init_db()
+    await close_db()
+
+
+def run_worker(worker: int) -> None:
+    try:
+        asyncio.run(main(worker))
+    except KeyboardInterrupt:
+        pass
+
+
+def run_workers(workers: int) -> None:
+    """
+    Запускает workers процессов, которые принимают webhook на одном порту
+    (SO_REUSEPORT) и делят состояние через STATE.
+    """
+    check_config()
+    if BOT_MODE != "webhook":
+        raise RuntimeError("BOT_WORKERS > 1 requires webhook mode")
+    if not STATE.shared:
+        raise RuntimeError(f"state backend {STATE.name} is not shared between processes")
+    asyncio.run(migrate_db())
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(worker,))
+        for worker in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if BOT_WORKERS > 1:
+        run_workers(BOT_WORKERS)
+    else:
+        asyncio.run(main())
@@ -1,119 +1,507 @@
 import aiosqlite
 import sqlite3
-from datetime import datetime
+import json
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 import typing as tp
 import asyncio
+import os
+import time
 
-DATABASE_PATH = "movie.db"
+from movie_info import GENRES_SEPARATOR, MovieInfo, caption_cache
 
+DATABASE_PATH = os.getenv("DATABASE_PATH", "movie.db")
+READ_POOL_SIZE = 4
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "temp_store": "MEMORY",
+    "cache_size": -8000,
+    "mmap_size": 64 * 1024 * 1024,
+}
+FLUSH_INTERVAL_MS = 250
+FLUSH_MAX_ROWS = 500
+MOVIE_RECORD_CACHE_SIZE = 1024
+# кеш в памяти у каждого процесса свой: сохранение фильма в другом
+# процессе его не сбрасывает, поэтому записи перечитываются из базы
+MOVIE_RECORD_TTL = 60.0
+# сколько кандидатов полнотекстового поиска проверять на похожесть
+MOVIE_SEARCH_CANDIDATES = 10
 
-async def init_db():
+
+class ConnectionPool:
     """
-    Инициализация базы данных и создание таблиц.
+    Долгоживущие соединения с базой: одно соединение на запись
+    и небольшой пул соединений на чтение.
+
+    В режиме WAL читатели не блокируют писателя, поэтому чтения идут
+    параллельно, а записи сериализуются через один lock.
+
+    :param path: Путь к файлу базы данных.
+    :param readers: Количество соединений на чтение.
     """
-    async with aiosqlite.connect(DATABASE_PATH) as conn:
-        cursor = await conn.cursor()
-        await cursor.execute(
-            """
-        CREATE TABLE IF NOT EXISTS search_history (
-            user_id INTEGER,
-            query TEXT,
-            movie_name TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
+
+    def __init__(self, path: str, readers: int = READ_POOL_SIZE):
+        self.path = path
+        self.readers_num = readers
+        self._writer: tp.Optional[aiosqlite.Connection] = None
+        self._readers: tp.Optional[asyncio.Queue] = None
+        self._all_readers: tp.List[aiosqlite.Connection] = []
+        self._write_lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self, read_only: bool = False) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path)
+        for name, value in PRAGMAS.items():
+            await conn.execute(f"PRAGMA {name} = {value}")
+        if read_only:
+            await conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    async def open(self) -> None:
+        async with self._open_lock:
+            if self.is_open:
+                return
+            self._writer = await self._connect()
+            self._readers = asyncio.Queue()
+            for _ in range(self.readers_num):
+                conn = await self._connect(read_only=True)
+                self._all_readers.append(conn)
+                self._readers.put_nowait(conn)
+
+    async def close(self) -> None:
+        async with self._open_lock:
+            if not self.is_open:
+                return
+            async with self._write_lock:
+                await self._writer.close()
+                self._writer = None
+            for conn in self._all_readers:
+                await conn.close()
+            self._all_readers = []
+            self._readers = None
+
+    def _check_open(self) -> None:
+        # соединения открывает только init_db: если открыть их здесь, после
+        # close_db опоздавшая запись оставила бы потоки aiosqlite незакрытыми
+        if not self.is_open:
+            raise RuntimeError(f"database pool for {self.path} is closed")
+
+    @asynccontextmanager
+    async def writer(self) -> tp.AsyncIterator[aiosqlite.Connection]:
+        """
+        Соединение на запись; всё, что выполнено внутри блока,
+        коммитится одной транзакцией (или откатывается при ошибке).
+
+        :raises RuntimeError: Если пул не открыт или уже закрыт.
+        """
+        self._check_open()
+        async with self._write_lock:
+            self._check_open()
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            await self._writer.commit()
+
+    @asynccontextmanager
+    async def reader(self) -> tp.AsyncIterator[aiosqlite.Connection]:
+        self._check_open()
+        readers = self._readers
+        conn = await readers.get()
+        try:
+            yield conn
+        finally:
+            readers.put_nowait(conn)
+
+
+_pool = ConnectionPool(DATABASE_PATH)
+
+INSERT_HISTORY_AT_SQL = """
+    INSERT INTO search_history (user_id, query, movie_name, timestamp)
+    VALUES (?, ?, ?, ?)
+"""
+ADD_COUNT_SQL = """
+    INSERT INTO movie_stats (user_id, movie_name, count) VALUES (?, ?, ?)
+    ON CONFLICT (user_id, movie_name) DO UPDATE SET count = count + excluded.count
+"""
+UPSERT_MOVIE_LINK_SQL = """
+    INSERT INTO movie_links (
+        movie_name, link, title_ru, title_en, description_ru, description_en,
+        genres_ru, genres_en, rating, year, film_id, poster_url
+    ) VALUES (
+        :movie_name, :link, :title_ru, :title_en, :description_ru, :description_en,
+        :genres_ru, :genres_en, :rating, :year, :film_id, :poster_url
+    )
+    ON CONFLICT (movie_name) DO UPDATE SET
+        link = COALESCE(excluded.link, link),
+        title_ru = excluded.title_ru,
+        title_en = excluded.title_en,
+        description_ru = excluded.description_ru,
+        description_en = excluded.description_en,
+        genres_ru = excluded.genres_ru,
+        genres_en = excluded.genres_en,
+        rating = excluded.rating,
+        year = excluded.year,
+        film_id = COALESCE(excluded.film_id, film_id),
+        poster_file_id = CASE
+            WHEN excluded.poster_url IS NULL OR excluded.poster_url IS poster_url
+            THEN poster_file_id
+        END,
+        poster_url = COALESCE(excluded.poster_url, poster_url)
+"""
+MOVIE_RECORD_FIELDS = (
+    "movie_name",
+    "link",
+    "title_ru",
+    "title_en",
+    "description_ru",
+    "description_en",
+    "genres_ru",
+    "genres_en",
+    "rating",
+    "year",
+    "film_id",
+    "poster_url",
+    "poster_file_id",
+)
+MOVIE_RECORD_COLUMNS = ", ".join(MOVIE_RECORD_FIELDS)
+
+
+class WriteBehindBuffer:
     """
-        )
-        await cursor.execute(
-            """
-        CREATE TABLE IF NOT EXISTS movie_stats (
-            user_id INTEGER,
-            movie_name TEXT,
-            count INTEGER DEFAULT 0,
-            rating REAL DEFAULT 7.5,
-            PRIMARY KEY (user_id, movie_name)
-        )
+    Буфер отложенной записи истории поиска и статистики.
+
+    Строки копятся в памяти и сбрасываются одной транзакцией через
+    executemany раз в interval_ms миллисекунд или как только набралось
+    max_rows строк. Чтения истории и статистики пользователя сначала
+    сбрасывают буфер, если в нем есть строки этого пользователя.
+
+    :param pool: Пул соединений для записи.
+    :param interval_ms: Период сброса в миллисекундах.
+    :param max_rows: Размер буфера, при котором сброс происходит сразу.
     """
-        )
-        await cursor.execute(
-            """
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER,
-            user_lang TEXT DEFAULT 'ru'
-        )
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        interval_ms: int = FLUSH_INTERVAL_MS,
+        max_rows: int = FLUSH_MAX_ROWS,
+    ):
+        self.pool = pool
+        self.interval = interval_ms / 1000
+        self.max_rows = max_rows
+        self._history: tp.List[tp.Tuple[int, str, str, str]] = []
+        self._counts: tp.Dict[tp.Tuple[int, str], int] = {}
+        self._users: tp.Set[int] = set()
+        # пользователи, чьи строки записывает текущий сброс
+        self._flushing: tp.Set[int] = set()
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: tp.Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def pending(self) -> int:
+        return len(self._history)
+
+    def add_search(self, user_id: int, query: str, movie_name: str) -> None:
+        timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        self._history.append((user_id, query, movie_name, timestamp))
+        key = (user_id, movie_name)
+        self._counts[key] = self._counts.get(key, 0) + 1
+        self._users.add(user_id)
+        if len(self._history) >= self.max_rows:
+            self._wakeup.set()
+
+    async def flush(self, user_id: tp.Optional[int] = None) -> None:
+        """
+        Сбрасывает буфер в базу. Если передан user_id, сброс выполняется
+        только когда в буфере есть строки этого пользователя или они
+        как раз записываются другим сбросом - тогда вызов ждет его конца.
+        """
+        if (
+            user_id is not None
+            and user_id not in self._users
+            and user_id not in self._flushing
+        ):
+            return
+        async with self._flush_lock:
+            if user_id is not None and user_id not in self._users:
+                return
+            history, counts, users = self._history, self._counts, self._users
+            if not history and not counts:
+                return
+            self._history, self._counts, self._users = [], {}, set()
+            self._flushing = users
+            try:
+                async with self.pool.writer() as conn:
+                    await conn.executemany(INSERT_HISTORY_AT_SQL, history)
+                    await conn.executemany(
+                        ADD_COUNT_SQL,
+                        [(uid, name, n) for (uid, name), n in counts.items()],
+                    )
+            except BaseException:
+                self._history = history + self._history
+                for key, n in counts.items():
+                    self._counts[key] = self._counts.get(key, 0) + n
+                self._users |= users
+                raise
+            finally:
+                self._flushing = set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Error flushing search history: {e}")
+
+    def start(self) -> None:
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Останавливает фоновый сброс и дописывает все, что осталось в буфере.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+_buffer = WriteBehindBuffer(_pool)
+
+
+# Миграции схемы: i-й скрипт переводит базу на версию i + 1.
+# Текущая версия хранится в PRAGMA user_version, новые миграции
+# добавляются только в конец списка.
+MIGRATIONS = [
     """
-        )
-        await cursor.execute(
-            """
-        CREATE TABLE IF NOT EXISTS movie_links (
-            movie_name TEXT PRIMARY KEY,
-            link TEXT,
-            title_ru TEXT,
-            title_en TEXT,
-            description_ru TEXT,
-            description_en TEXT,
-            genres_ru TEXT,
-            genres_en TEXT,
-            rating REAL,
-            year INTEGER
-        )
+    CREATE TABLE IF NOT EXISTS search_history (
+        user_id INTEGER,
+        query TEXT,
+        movie_name TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS movie_stats (
+        user_id INTEGER,
+        movie_name TEXT,
+        count INTEGER DEFAULT 0,
+        rating REAL DEFAULT 7.5,
+        PRIMARY KEY (user_id, movie_name)
+    );
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER,
+        user_lang TEXT DEFAULT 'ru'
+    );
+    CREATE TABLE IF NOT EXISTS movie_links (
+        movie_name TEXT PRIMARY KEY,
+        link TEXT,
+        title_ru TEXT,
+        title_en TEXT,
+        description_ru TEXT,
+        description_en TEXT,
+        genres_ru TEXT,
+        genres_en TEXT,
+        rating REAL,
+        year INTEGER
+    );
+    """,
     """
-        )
-        await conn.commit()
+    CREATE INDEX IF NOT EXISTS search_history_user_time
+        ON search_history (user_id, timestamp DESC, query, movie_name);
+    CREATE INDEX IF NOT EXISTS movie_stats_user_count
+        ON movie_stats (user_id, count DESC, movie_name);
+    CREATE TABLE users_new (
+        user_id INTEGER PRIMARY KEY,
+        user_lang TEXT NOT NULL DEFAULT 'ru'
+    );
+    INSERT INTO users_new (user_id, user_lang)
+        SELECT user_id, COALESCE(user_lang, 'ru') FROM users
+        WHERE rowid IN (
+            SELECT MAX(rowid) FROM users
+            WHERE user_id IS NOT NULL
+            GROUP BY user_id
+        );
+    DROP TABLE users;
+    ALTER TABLE users_new RENAME TO users;
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS translations (
+        text_hash TEXT,
+        source_lang TEXT,
+        target_lang TEXT,
+        translation TEXT,
+        PRIMARY KEY (text_hash, source_lang, target_lang)
+    ) WITHOUT ROWID;
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS top250 (
+        film_id INTEGER PRIMARY KEY,
+        data TEXT NOT NULL,
+        fetched_at REAL NOT NULL
+    );
+    """,
+    """
+    ALTER TABLE movie_links ADD COLUMN film_id INTEGER;
+    CREATE INDEX IF NOT EXISTS movie_links_film_id ON movie_links (film_id);
+    CREATE TABLE IF NOT EXISTS query_aliases (
+        query TEXT PRIMARY KEY,
+        film_id INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS link_cache (
+        title TEXT,
+        lang TEXT,
+        link TEXT,
+        fetched_at REAL NOT NULL,
+        PRIMARY KEY (title, lang)
+    ) WITHOUT ROWID;
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS callback_payloads (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        value TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    """,
+    """
+    DROP TABLE IF EXISTS callback_payloads;
+    """,
+    """
+    ALTER TABLE movie_links ADD COLUMN poster_url TEXT;
+    ALTER TABLE movie_links ADD COLUMN poster_file_id TEXT;
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS movie_search USING fts5(
+        title_ru, title_en, description_ru, description_en,
+        tokenize = 'trigram'
+    );
+    INSERT OR REPLACE INTO movie_search
+        (rowid, title_ru, title_en, description_ru, description_en)
+        SELECT film_id, title_ru, title_en, description_ru, description_en
+        FROM movie_links WHERE film_id IS NOT NULL;
+    CREATE TRIGGER IF NOT EXISTS movie_links_search_insert
+        AFTER INSERT ON movie_links WHEN new.film_id IS NOT NULL
+    BEGIN
+        INSERT OR REPLACE INTO movie_search
+            (rowid, title_ru, title_en, description_ru, description_en)
+            VALUES (new.film_id, new.title_ru, new.title_en,
+                    new.description_ru, new.description_en);
+    END;
+    CREATE TRIGGER IF NOT EXISTS movie_links_search_update
+        AFTER UPDATE OF title_ru, title_en, description_ru, description_en, film_id
+        ON movie_links
+    BEGIN
+        DELETE FROM movie_search WHERE rowid = old.film_id;
+        INSERT OR REPLACE INTO movie_search
+            (rowid, title_ru, title_en, description_ru, description_en)
+            SELECT new.film_id, new.title_ru, new.title_en,
+                   new.description_ru, new.description_en
+            WHERE new.film_id IS NOT NULL;
+    END;
+    CREATE TRIGGER IF NOT EXISTS movie_links_search_delete
+        AFTER DELETE ON movie_links
+    BEGIN
+        DELETE FROM movie_search WHERE rowid = old.film_id;
+    END;
+    """,
+    """
+    INSERT OR IGNORE INTO link_cache (title, lang, link, fetched_at)
+        SELECT title_ru, 'ru', link, CAST(strftime('%s', 'now') AS REAL)
+        FROM movie_links
+        WHERE title_ru IS NOT NULL AND link IS NOT NULL;
+    """,
+]
 
 
-async def save_request_to_db(
-    user_id: int, query: str, movie_name: str
-) -> None:
+async def migrate(conn: aiosqlite.Connection) -> int:
     """
-    saves query to db
+    Применяет к базе недостающие миграции, каждую в своей транзакции.
+
+    :return: Версия схемы после миграции.
     """
-    async with aiosqlite.connect(DATABASE_PATH) as conn:
-        cursor = await conn.cursor()
-        await cursor.execute(
-            "INSERT INTO search_history (user_id, query, movie_name) VALUES (?, ?, ?)",
-            (user_id, query, movie_name),
-        )
-        await conn.commit()
+    cursor = await conn.execute("PRAGMA user_version")
+    (version,) = await cursor.fetchone()
+    for new_version, script in enumerate(MIGRATIONS, start=1):
+        if new_version <= version:
+            continue
+        try:
+            await conn.executescript(
+                f"BEGIN;\n{script}\nPRAGMA user_version = {new_version};\nCOMMIT;"
+            )
+        except sqlite3.Error:
+            if conn.in_transaction:
+                await conn.rollback()
+            raise
+        logging.info(f"database migrated to version {new_version}")
+        version = new_version
+    return version
 
 
-async def save_rating_to_db(
-    user_id: int, rating: int, movie_name: str
-) -> None:
+async def init_db():
     """
-    saves rating to db
+    Инициализация базы данных: открывает соединения и применяет миграции.
     """
-    async with aiosqlite.connect(DATABASE_PATH) as conn:
-        cursor = await conn.cursor()
-        await cursor.execute(
-            "UPDATE movie_stats SET rating = ? WHERE user_id = ? AND movie_name = ?",
-            (rating, user_id, movie_name),
-        )
-        await conn.commit()
+    await _pool.open()
+    async with _pool.writer() as conn:
+        await migrate(conn)
+    _buffer.start()
 
 
-async def increment_movie_count(user_id: int, movie_name: str) -> None:
+async def close_db() -> None:
     """
-    для статистики
+    Дописывает буфер отложенной записи и закрывает соединения с базой данных.
     """
-    async with aiosqlite.connect(DATABASE_PATH) as conn:
+    await _buffer.stop()
+    await _pool.close()
+
+
+async def save_rating_to_db(
+    user_id: int, rating: int, *movie_names: tp.Optional[str]
+) -> bool:
+    """
+    saves rating to db
+
+    Строка статистики называется так, как фильм назывался на языке
+    пользователя во время поиска, поэтому передаются все названия фильма.
+    Возвращает False, если пользователь этот фильм не искал.
+    """
+    names = [name for name in movie_names if name]
+    if not names:
+        return False
+    await _buffer.flush(user_id)
+    placeholders = ", ".join("?" * len(names))
+    async with _pool.writer() as conn:
         cursor = await conn.cursor()
         await cursor.execute(
-            "SELECT count FROM movie_stats WHERE user_id = ? AND movie_name = ?",
-            (user_id, movie_name),
+            f"UPDATE movie_stats SET rating = ? WHERE user_id = ? AND movie_name IN ({placeholders})",
+            (rating, user_id, *names),
         )
-        result = await cursor.fetchone()
-        if result:
-            count = result[0] + 1
-            await cursor.execute(
-                "UPDATE movie_stats SET count = ? WHERE user_id = ? AND movie_name = ?",
-                (count, user_id, movie_name),
-            )
-        else:
-            await cursor.execute(
-                "INSERT INTO movie_stats (user_id, movie_name, count) VALUES (?, ?, 1)",
-                (user_id, movie_name),
-            )
-        await conn.commit()
+        return cursor.rowcount > 0
 
 
 async def get_search_history(
@@ -122,7 +510,8 @@ async def get_search_history(
     """
     возвращает историю поиска для пользователя
     """
-    async with aiosqlite.connect(DATABASE_PATH) as conn:
+    await _buffer.flush(user_id)
+    async with _pool.reader() as conn:
         cursor = await conn.cursor()
         await cursor.execute(
             "SELECT query, movie_name, timestamp FROM search_history WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?",
@@ -136,7 +525,8 @@ async def get_movie_stats(user_id: int) -> list[tuple[str, int]]:
     """
     возвращает статистику по фильмам для пользователя
     """
-    async with aiosqlite.connect(DATABASE_PATH) as conn:
+    await _buffer.flush(user_id)
+    async with _pool.reader() as conn:
         cursor = await conn.cursor()
         await cursor.execute(
             "SELECT movie_name, count FROM movie_stats WHERE user_id = ? ORDER BY count DESC",
@@ -146,46 +536,139 @@ async def get_movie_stats(user_id: int) -> list[tuple[str, int]]:
     return stats
 
 
-def get_users_languages() -> tp.Dict[int, str]:
+async def get_user_language(user_id: int) -> tp.Optional[str]:
     """
-    для информации о языках
+    Возвращает язык пользователя или None, если пользователя еще нет.
     """
-    with sqlite3.connect(DATABASE_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * from users")
-        users = dict(cursor.fetchall())
-    return users
+    async with _pool.reader() as conn:
+        cursor = await conn.execute(
+            "SELECT user_lang FROM users WHERE user_id = ?", (user_id,)
+        )
+        result = await cursor.fetchone()
+    return result[0] if result else None
 
 
-async def add_user(user_id: int) -> None:
+async def set_user_language(user_id: int, user_lang: str) -> None:
     """
-    добавляет нового пользователя
+    Сохраняет язык пользователя, при необходимости добавляя пользователя.
     """
-    async with aiosqlite.connect(DATABASE_PATH) as conn:
-        cursor = await conn.cursor()
-        await cursor.execute(
-            "INSERT INTO users (user_id, user_lang) VALUES (?, ?)",
-            (user_id, "ru"),
+    async with _pool.writer() as conn:
+        await conn.execute(
+            """
+        INSERT INTO users (user_id, user_lang) VALUES (?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET user_lang = excluded.user_lang
+        """,
+            (user_id, user_lang),
         )
-        await conn.commit()
 
 
-async def change_language(user_id: int, new_lang: str) -> None:
+def movie_from_row(row: tp.Sequence) -> tp.Tuple[str, MovieInfo]:
     """
-    меняет язык интерфейса для пользователя
+    Ключ movie_name и MovieInfo из строки movie_links (столбцы MOVIE_RECORD_FIELDS).
     """
-    async with aiosqlite.connect(DATABASE_PATH) as conn:
-        cursor = await conn.cursor()
-        await cursor.execute(
-            "UPDATE users SET user_lang = ? WHERE user_id = ?",
-            (new_lang, user_id),
-        )
-        await conn.commit()
+    (
+        movie_name,
+        link,
+        title_ru,
+        title_en,
+        description_ru,
+        description_en,
+        genres_ru,
+        genres_en,
+        rating,
+        year,
+        film_id,
+        poster_url,
+        poster_file_id,
+    ) = row
+    return movie_name, MovieInfo(
+        movie_id=film_id,
+        title_ru=title_ru,
+        title_en=title_en,
+        year=year,
+        length=None,
+        description=description_ru,
+        description_en=description_en,
+        genres=tuple(genres_ru.split(GENRES_SEPARATOR)) if genres_ru else (),
+        genres_en=tuple(genres_en.split(GENRES_SEPARATOR)) if genres_en else (),
+        rating=rating,
+        poster_url=poster_url,
+        poster_file_id=poster_file_id,
+        link=link,
+    )
+
+
+class MovieRecordCache:
+    """
+    LRU-кеш фильмов из movie_links в памяти (MovieInfo вместе с ключом
+    movie_name строки). Записи ищутся по названию или по id фильма; при
+    сохранении фильма все его записи сбрасываются, и об этом узнают
+    подписчики add_listener (например, кеш подписей).
+
+    Сбрасываются только записи этого процесса: фильм, сохраненный другим
+    воркером, виден здесь не позже чем через ttl секунд.
+
+    :param maxsize: Максимальное количество записей.
+    :param ttl: Время жизни записи в секундах.
+    """
+
+    def __init__(self, maxsize: int = MOVIE_RECORD_CACHE_SIZE, ttl: float = MOVIE_RECORD_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items: tp.OrderedDict[tp.Tuple, tp.Tuple[str, MovieInfo, float]] = OrderedDict()
+        self._listeners: tp.List[tp.Callable[[int], None]] = []
+
+    def add_listener(self, listener: tp.Callable[[int], None]) -> None:
+        """
+        listener(film_id) вызывается для каждого фильма, чьи данные поменялись.
+        """
+        self._listeners.append(listener)
+
+    def get(self, key: tp.Tuple) -> tp.Optional[MovieInfo]:
+        entry = self._items.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[2] >= self.ttl:
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: tp.Tuple, movie_name: str, movie: MovieInfo) -> None:
+        self._items[key] = (movie_name, movie, time.monotonic())
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def invalidate(
+        self, movie_name: tp.Optional[str], film_id: tp.Optional[int] = None
+    ) -> None:
+        stale = [
+            key
+            for key, (name, movie, _) in self._items.items()
+            if name == movie_name
+            or (film_id is not None and movie.movie_id == film_id)
+        ]
+        film_ids = {self._items[key][1].movie_id for key in stale}
+        film_ids.add(film_id)
+        for key in stale:
+            del self._items[key]
+        for changed in film_ids:
+            if changed is not None:
+                for listener in self._listeners:
+                    listener(changed)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+
+movie_record_cache = MovieRecordCache()
+movie_record_cache.add_listener(caption_cache.invalidate)
 
 
 async def save_movie_link(
     movie_name: str,
-    link: str,
+    link: tp.Optional[str],
     title_ru: str,
     title_en: str,
     description_ru: str,
@@ -194,84 +677,296 @@ async def save_movie_link(
     genres_en: str,
     rating: float,
     year: int,
+    film_id: tp.Optional[int] = None,
+    poster_url: tp.Optional[str] = None,
 ) -> None:
     """
-    Сохраняет ссылку на фильм и дополнительную информацию в базе данных.
+    Сохраняет информацию о фильме и ссылку на него в базе данных. Если
+    ссылка не найдена (link=None), сохраненная ранее ссылка не стирается.
+    Загруженный в Telegram постер (poster_file_id) сохраняется, пока не
+    поменялся poster_url.
     """
-    async with aiosqlite.connect(DATABASE_PATH) as conn:
+    async with _pool.writer() as conn:
         cursor = await conn.cursor()
         await cursor.execute(
+            UPSERT_MOVIE_LINK_SQL,
+            {
+                "movie_name": movie_name,
+                "link": link,
+                "title_ru": title_ru,
+                "title_en": title_en,
+                "description_ru": description_ru,
+                "description_en": description_en,
+                "genres_ru": genres_ru,
+                "genres_en": genres_en,
+                "rating": rating,
+                "year": year,
+                "film_id": film_id,
+                "poster_url": poster_url,
+            },
+        )
+    movie_record_cache.invalidate(movie_name, film_id)
+
+
+async def save_poster_file_id(film_id: int, file_id: str) -> None:
+    """
+    Запоминает file_id постера, уже отправленного в Telegram: дальше постер
+    отправляется по нему, и Telegram не скачивает картинку заново.
+    """
+    async with _pool.writer() as conn:
+        await conn.execute(
+            "UPDATE movie_links SET poster_file_id = ? WHERE film_id = ?",
+            (file_id, film_id),
+        )
+    movie_record_cache.invalidate(None, film_id)
+
+
+async def record_search(user_id: int, query: str, movie_name: str) -> None:
+    """
+    Записывает результат поиска: строка истории и счетчик в статистике
+    попадают в буфер отложенной записи.
+    """
+    _buffer.add_search(user_id, query, movie_name)
+    if not _buffer.running:
+        await _buffer.flush()
+
+
+async def get_translations(
+    text_hashes: tp.List[str], source_lang: str, target_lang: str
+) -> tp.Dict[str, str]:
+    """
+    Возвращает сохраненные переводы по хешам исходных текстов.
+    """
+    if not text_hashes:
+        return {}
+    placeholders = ", ".join("?" * len(text_hashes))
+    async with _pool.reader() as conn:
+        cursor = await conn.execute(
+            f"""
+        SELECT text_hash, translation FROM translations
+        WHERE source_lang = ? AND target_lang = ? AND text_hash IN ({placeholders})
+        """,
+            (source_lang, target_lang, *text_hashes),
+        )
+        return dict(await cursor.fetchall())
+
+
+async def save_translations(
+    translations: tp.Dict[str, str], source_lang: str, target_lang: str
+) -> None:
+    """
+    Сохраняет переводы, ключ словаря - хеш исходного текста.
+    """
+    if not translations:
+        return
+    async with _pool.writer() as conn:
+        await conn.executemany(
             """
-        INSERT OR REPLACE INTO movie_links (
-            movie_name, link, title_ru, title_en, description_ru, description_en, genres_ru, genres_en, rating, year
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT OR REPLACE INTO translations (text_hash, source_lang, target_lang, translation)
+        VALUES (?, ?, ?, ?)
         """,
-            (
-                movie_name,
-                link,
-                title_ru,
-                title_en,
-                description_ru,
-                description_en,
-                genres_ru,
-                genres_en,
-                rating,
-                year,
-            ),
+            [
+                (text_hash, source_lang, target_lang, translation)
+                for text_hash, translation in translations.items()
+            ],
         )
-        await conn.commit()
 
 
-async def get_movie_link(movie_name: str) -> str:
+async def save_top250(films: tp.List[tp.Dict[str, tp.Any]], fetched_at: float) -> None:
     """
-    Возвращает ссылку на фильм по его названию.
+    Заменяет сохраненный топ-250 Кинопоиска новым списком фильмов.
     """
-    async with aiosqlite.connect(DATABASE_PATH) as conn:
-        cursor = await conn.cursor()
-        await cursor.execute(
-            "SELECT link FROM movie_links WHERE movie_name = ?", (movie_name,)
+    async with _pool.writer() as conn:
+        await conn.execute("DELETE FROM top250")
+        await conn.executemany(
+            "INSERT OR REPLACE INTO top250 (film_id, data, fetched_at) VALUES (?, ?, ?)",
+            [
+                (film.get("filmId"), json.dumps(film, ensure_ascii=False), fetched_at)
+                for film in films
+            ],
+        )
+
+
+async def load_top250() -> tp.Tuple[tp.List[tp.Dict[str, tp.Any]], tp.Optional[float]]:
+    """
+    Возвращает сохраненный топ-250 и время его загрузки (None, если топа нет).
+    """
+    async with _pool.reader() as conn:
+        cursor = await conn.execute("SELECT data, fetched_at FROM top250")
+        rows = await cursor.fetchall()
+    if not rows:
+        return [], None
+    return [json.loads(data) for data, _ in rows], min(row[1] for row in rows)
+
+
+class QueryAliasStats:
+    """
+    Счетчики кеша запросов: каждое попадание - это несостоявшийся
+    запрос к поиску Кинопоиска.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def as_dict(self) -> tp.Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "kinopoisk_calls_saved": self.hits,
+        }
+
+
+query_alias_stats = QueryAliasStats()
+
+
+async def get_film_id_by_query(query: str) -> tp.Optional[int]:
+    """
+    Возвращает id фильма Кинопоиска, найденного раньше по такому же
+    (нормализованному) запросу.
+    """
+    async with _pool.reader() as conn:
+        cursor = await conn.execute(
+            "SELECT film_id FROM query_aliases WHERE query = ?", (query,)
         )
         result = await cursor.fetchone()
-        return result[0] if result else None
+    return result[0] if result else None
 
 
-async def get_movie_info_from_db(movie_name: str, lang: str) -> dict:
+async def save_query_alias(query: str, film_id: int) -> None:
     """
-    Возвращает дополнительную информацию о фильме по его названию.
+    Запоминает, в какой фильм разрешился нормализованный запрос.
     """
-    title = "title_" + lang
-    description = "description_" + lang
-    genres = "genres_" + lang
-    async with aiosqlite.connect(DATABASE_PATH) as conn:
-        cursor = await conn.cursor()
-        await cursor.execute(
-            """
-        SELECT ?, ?, ?, rating, year
+    async with _pool.writer() as conn:
+        await conn.execute(
+            "INSERT OR REPLACE INTO query_aliases (query, film_id) VALUES (?, ?)",
+            (query, film_id),
+        )
+
+
+async def get_movie_info_by_film_id(film_id: int) -> tp.Optional[MovieInfo]:
+    """
+    Возвращает сохраненную информацию о фильме по его id на Кинопоиске.
+    """
+    key = ("film", film_id)
+    movie = movie_record_cache.get(key)
+    if movie is not None:
+        return movie
+    async with _pool.reader() as conn:
+        cursor = await conn.execute(
+            f"SELECT {MOVIE_RECORD_COLUMNS} FROM movie_links WHERE film_id = ?",
+            (film_id,),
+        )
+        result = await cursor.fetchone()
+    if result is None:
+        return None
+    movie_name, movie = movie_from_row(result)
+    movie_record_cache.put(key, movie_name, movie)
+    return movie
+
+
+def _trigram_query(query: str) -> str:
+    """
+    Выражение MATCH для FTS5 с токенизатором trigram: любая из троек
+    символов запроса, поэтому находятся и названия с опечатками.
+    """
+    trigrams = dict.fromkeys(query[i:i + 3] for i in range(len(query) - 2))
+    return " OR ".join('"' + trigram.replace('"', '""') + '"' for trigram in trigrams)
+
+
+async def search_movie_links(
+    query: str, limit: int = MOVIE_SEARCH_CANDIDATES
+) -> tp.List[MovieInfo]:
+    """
+    Полнотекстовый поиск по названиям и описаниям сохраненных фильмов
+    (таблица movie_search). Совпадения в названиях весят больше, чем в
+    описаниях. Возвращает до limit записей, лучшие первыми.
+    """
+    match = _trigram_query(query)
+    if not match:
+        return []
+    columns = ", ".join(f"movie_links.{field}" for field in MOVIE_RECORD_FIELDS)
+    async with _pool.reader() as conn:
+        cursor = await conn.execute(
+            f"""
+        SELECT {columns}
+        FROM movie_search
+        JOIN movie_links ON movie_links.film_id = movie_search.rowid
+        WHERE movie_search MATCH ?
+        ORDER BY bm25(movie_search, 5.0, 5.0, 1.0, 1.0)
+        LIMIT ?
+        """,
+            (match, limit),
+        )
+        rows = await cursor.fetchall()
+    return [movie_from_row(row)[1] for row in rows]
+
+
+async def get_link_cache_entry(
+    title: str, lang: str
+) -> tp.Optional[tp.Tuple[tp.Optional[str], float]]:
+    """
+    Возвращает закешированную ссылку (None, если ссылка не нашлась)
+    и время, когда ее искали.
+    """
+    async with _pool.reader() as conn:
+        cursor = await conn.execute(
+            "SELECT link, fetched_at FROM link_cache WHERE title = ? AND lang = ?",
+            (title, lang),
+        )
+        result = await cursor.fetchone()
+    return tuple(result) if result else None
+
+
+async def save_link_cache_entry(
+    title: str, lang: str, link: tp.Optional[str], fetched_at: float
+) -> None:
+    """
+    Сохраняет результат поиска ссылки, в том числе отрицательный.
+    """
+    async with _pool.writer() as conn:
+        await conn.execute(
+            "INSERT OR REPLACE INTO link_cache (title, lang, link, fetched_at) VALUES (?, ?, ?, ?)",
+            (title, lang, link, fetched_at),
+        )
+
+
+async def get_movie_info_from_db(
+    movie_name: str, lang: str
+) -> tp.Optional[MovieInfo]:
+    """
+    Возвращает дополнительную информацию о фильме по его названию:
+    по ключу movie_links или по названию на языке пользователя.
+    """
+    key = ("name", lang, movie_name)
+    movie = movie_record_cache.get(key)
+    if movie is not None:
+        return movie
+    title = "title_en" if lang == "en" else "title_ru"
+    async with _pool.reader() as conn:
+        cursor = await conn.execute(
+            f"""
+        SELECT {MOVIE_RECORD_COLUMNS}
         FROM movie_links
-        WHERE movie_name = ?
+        WHERE movie_name = ? OR {title} = ?
+        ORDER BY movie_name = ? DESC
+        LIMIT 1
         """,
-            (
-                title,
-                description,
-                genres,
-                movie_name,
-            ),
+            (movie_name, movie_name, movie_name),
         )
         result = await cursor.fetchone()
-        if result:
-            return {
-                "link": result[0],
-                "title": result[1],
-                "description": result[2],
-                "genres": result[3],
-                "rating": result[4],
-                "year": result[5],
-            }
+    if result is None:
         return None
+    movie_name, movie = movie_from_row(result)
+    movie_record_cache.put(key, movie_name, movie)
+    return movie
 
 
 async def main() -> None:
     await init_db()
+    await close_db()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,149 @@
+import os
+import typing as tp
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+try:
+    from selectolax.parser import HTMLParser as SelectolaxParser
+except ImportError:
+    SelectolaxParser = None
+
+# бэкенды в порядке предпочтения; можно переопределить через LINK_EXTRACTOR
+PREFERRED_EXTRACTORS = ["selectolax", "lxml", "htmlparser"]
+
+
+class LinkExtractor:
+    """
+    Достает значения href всех тегов <a> со страницы в порядке их появления.
+    """
+
+    name = ""
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return True
+
+    def extract(self, html: str) -> tp.List[str]:
+        raise NotImplementedError
+
+
+class _HrefCollector(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links: tp.List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            for name, value in attrs:
+                if name == "href":
+                    self.links.append(value or "")
+                    break
+
+    handle_startendtag = handle_starttag
+
+
+class HTMLParserExtractor(LinkExtractor):
+    """
+    Потоковый разбор стандартным html.parser без построения дерева.
+    """
+
+    name = "htmlparser"
+
+    def extract(self, html: str) -> tp.List[str]:
+        collector = _HrefCollector()
+        collector.feed(html)
+        collector.close()
+        return collector.links
+
+
+class _LxmlTarget:
+    def __init__(self):
+        self.links: tp.List[str] = []
+
+    def start(self, tag, attrib):
+        if tag == "a" and "href" in attrib:
+            self.links.append(attrib["href"])
+
+    def close(self):
+        return self.links
+
+
+class LxmlExtractor(LinkExtractor):
+    """
+    Разбор парсером libxml2 с target-объектом: дерево тоже не строится.
+    """
+
+    name = "lxml"
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return etree is not None
+
+    def extract(self, html: str) -> tp.List[str]:
+        if not html.strip():
+            return []
+        target = _LxmlTarget()
+        parser = etree.HTMLParser(target=target)
+        parser.feed(html)
+        return parser.close()
+
+
+class SelectolaxExtractor(LinkExtractor):
+    name = "selectolax"
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return SelectolaxParser is not None
+
+    def extract(self, html: str) -> tp.List[str]:
+        tree = SelectolaxParser(html)
+        return [node.attributes.get("href") or "" for node in tree.css("a[href]")]
+
+
+class SoupExtractor(LinkExtractor):
+    """
+    Прежний вариант через BeautifulSoup, оставлен как эталон для сравнения.
+    """
+
+    name = "soup"
+
+    def extract(self, html: str) -> tp.List[str]:
+        soup = BeautifulSoup(html, "html.parser")
+        return [link["href"] for link in soup.find_all("a", href=True)]
+
+
+EXTRACTORS: tp.Dict[str, tp.Type[LinkExtractor]] = {
+    extractor.name: extractor
+    for extractor in (
+        SelectolaxExtractor,
+        LxmlExtractor,
+        HTMLParserExtractor,
+        SoupExtractor,
+    )
+}
+
+
+def available_extractors() -> tp.List[str]:
+    return [name for name, cls in EXTRACTORS.items() if cls.is_available()]
+
+
+def get_extractor(name: tp.Optional[str] = None) -> LinkExtractor:
+    """
+    Возвращает экстрактор по имени, а без имени - самый быстрый из доступных.
+    """
+    name = name or os.getenv("LINK_EXTRACTOR")
+    if name:
+        extractor = EXTRACTORS[name]
+        if not extractor.is_available():
+            raise RuntimeError(f"link extractor {name} is not installed")
+        return extractor()
+    for name in PREFERRED_EXTRACTORS:
+        if EXTRACTORS[name].is_available():
+            return EXTRACTORS[name]()
+    return SoupExtractor()
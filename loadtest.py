@@ -0,0 +1,345 @@
+"""
+Нагрузочный прогон бота без сети.
+
+Настоящий Dispatcher из bot.py обрабатывает синтетические обновления
+Telegram, а Кинопоиск, Google, переводчик и Bot API заменены локальными
+aiohttp-заглушками с настраиваемой задержкой и долей ошибок. База - новый
+временный файл. В конце печатаются обновления в секунду, задержка до
+первого ответа бота (p50/p95/p99) и число внешних запросов на один поиск.
+
+    python loadtest.py --updates 2000 --concurrency 50 --films 300
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+import typing as tp
+import zlib
+from collections import Counter
+
+from aiohttp import web
+
+FAKE_TOKEN = "123456:ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghi"
+GENRES = ["комедия", "драма", "триллер", "фантастика", "ужасы"]
+# сайты, которые бот считает хорошими, и те, что он отбрасывает
+GOOD_HOSTS = ["lordfilm.example", "baksino.example", "rezka.men"]
+OTHER_HOSTS = ["kinopoisk.ru", "ivi.ru", "wikipedia.org", "imdb.com"]
+# тот же фильм, написанный иначе: по-английски и с опечатками
+VARIANTS = ["film {}", "филм {}", "фильмм {}", "Фильм {} ?"]
+
+
+def parse_args(argv: tp.Optional[tp.List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--updates", type=int, default=1000, help="сколько обновлений отправить")
+    parser.add_argument("--concurrency", type=int, default=50, help="обновлений одновременно")
+    parser.add_argument("--users", type=int, default=200, help="число разных пользователей")
+    parser.add_argument("--films", type=int, default=300, help="размер каталога фильмов")
+    parser.add_argument("--zipf", type=float, default=1.1, help="перекос популярности фильмов (0 - равномерно)")
+    parser.add_argument("--help-share", type=float, default=0.1, help="доля команд /help")
+    parser.add_argument("--genre-share", type=float, default=0.05, help="доля нажатий на жанр")
+    parser.add_argument("--variant-share", type=float, default=0.0, help="доля поисков с опечаткой или английским названием")
+    parser.add_argument("--kinopoisk-latency", type=float, default=0.15, help="секунды")
+    parser.add_argument("--google-latency", type=float, default=0.3, help="секунды")
+    parser.add_argument("--translate-latency", type=float, default=0.2, help="секунды")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="секунды")
+    parser.add_argument("--poster-fetch-latency", type=float, default=0.3, help="сколько Telegram скачивает постер по URL, секунды")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503 от внешних сервисов")
+    parser.add_argument("--link-hit", type=float, default=0.6, help="вероятность хорошей ссылки на странице Google")
+    parser.add_argument("--unthrottled", action="store_true", help="снять ограничения частоты запросов к Кинопоиску и Google")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args(argv)
+
+
+class StandIns:
+    """
+    Локальные заглушки внешних сервисов. Считают запросы к каждому сервису
+    и время первого ответа бота в каждый чат.
+    """
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.calls: tp.Counter[str] = Counter()
+        self.errors: tp.Counter[str] = Counter()
+        self.first_reply: tp.Dict[str, float] = {}
+        self._runners: tp.List[web.AppRunner] = []
+        self.urls: tp.Dict[str, str] = {}
+
+    async def _delay(self, service: str, latency: float) -> bool:
+        """
+        Ждет latency секунд (+-20%) и решает, ответить ли ошибкой.
+        """
+        self.calls[service] += 1
+        await asyncio.sleep(latency * self.random.uniform(0.8, 1.2))
+        if self.random.random() < self.args.error_rate:
+            self.errors[service] += 1
+            return False
+        return True
+
+    @staticmethod
+    def film(film_id: int) -> tp.Dict[str, tp.Any]:
+        return {
+            "filmId": film_id,
+            "nameRu": f"Фильм {film_id}",
+            "nameEn": f"Film {film_id}",
+            "year": 1950 + film_id % 70,
+            "filmLength": "1:40",
+            "description": f"Описание фильма номер {film_id}.",
+            "genres": [{"genre": GENRES[film_id % len(GENRES)]}],
+            "rating": str(5 + film_id % 5),
+            "posterUrl": f"https://posters.example/{film_id}.jpg",
+        }
+
+    async def kinopoisk_search(self, request: web.Request) -> web.Response:
+        if not await self._delay("kinopoisk", self.args.kinopoisk_latency):
+            return web.Response(status=503)
+        keyword = request.query.get("keyword", "")
+        digits = "".join(ch for ch in keyword if ch.isdigit())
+        film_id = int(digits) if digits else 1
+        return web.json_response({"films": [self.film(film_id)]})
+
+    async def kinopoisk_top(self, request: web.Request) -> web.Response:
+        if not await self._delay("kinopoisk", self.args.kinopoisk_latency):
+            return web.Response(status=503)
+        page = int(request.query.get("page", "1"))
+        films = [self.film(film_id) for film_id in range(page * 25 - 24, page * 25 + 1)]
+        return web.json_response({"films": films})
+
+    async def google_search(self, request: web.Request) -> web.Response:
+        if not await self._delay("google", self.args.google_latency):
+            return web.Response(status=503)
+        query = request.query.get("q", "")
+        page_random = random.Random(f"{query}|{request.query.get('start', '').strip()}")
+        hosts = [page_random.choice(OTHER_HOSTS) for _ in range(10)]
+        if page_random.random() < self.args.link_hit:
+            hosts[page_random.randrange(10)] = page_random.choice(GOOD_HOSTS)
+        links = "".join(
+            f'<a href="/url?q=https://{host}/film/{zlib.crc32(query.encode())}&sa=U">{host}</a>'
+            for host in hosts
+        )
+        return web.Response(text=f"<html><body>{links}</body></html>", content_type="text/html")
+
+    async def translate(self, request: web.Request) -> web.Response:
+        if not await self._delay("translate", self.args.translate_latency):
+            return web.Response(status=503)
+        data = await request.json()
+        translated = "\n".join(f"[en] {line}" for line in data["q"].split("\n"))
+        return web.json_response({"translatedText": translated})
+
+    async def telegram(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls["telegram"] += 1
+        data = await request.post()
+        latency = self.args.telegram_latency
+        photo = data.get("photo")
+        if isinstance(photo, str):
+            by_url = photo.startswith("http")
+            self.calls["photo_by_url" if by_url else "photo_by_file_id"] += 1
+            if by_url:
+                latency += self.args.poster_fetch_latency
+        await asyncio.sleep(latency)
+        for key in ("chat_id", "callback_query_id"):
+            if key in data:
+                self.first_reply.setdefault(f"{key}:{data[key]}", time.perf_counter())
+        if method.startswith("send"):
+            result: tp.Any = {
+                "message_id": 1,
+                "date": 0,
+                "chat": {"id": int(data.get("chat_id", 0)), "type": "private"},
+            }
+            if isinstance(photo, str):
+                file_id = photo if not photo.startswith("http") else f"file-{zlib.crc32(photo.encode())}"
+                result["photo"] = [
+                    {"file_id": file_id, "file_unique_id": file_id, "width": 600, "height": 900}
+                ]
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _serve(self, name: str, routes: tp.List[web.RouteDef]) -> None:
+        app = web.Application()
+        app.add_routes(routes)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        self._runners.append(runner)
+        self.urls[name] = f"http://127.0.0.1:{port}"
+
+    async def start(self) -> None:
+        await self._serve(
+            "kinopoisk",
+            [
+                web.get("/api/v2.1/films/search-by-keyword", self.kinopoisk_search),
+                web.get("/api/v2.2/films/top", self.kinopoisk_top),
+            ],
+        )
+        await self._serve("google", [web.get("/search", self.google_search)])
+        await self._serve("translate", [web.post("/translate", self.translate)])
+        await self._serve("telegram", [web.post("/bot{token}/{method}", self.telegram)])
+
+    async def stop(self) -> None:
+        for runner in self._runners:
+            await runner.cleanup()
+
+    def environ(self, database_path: str) -> tp.Dict[str, str]:
+        """
+        Переменные окружения, с которыми бот ходит в заглушки, а не в сеть.
+        Их нужно выставить до импорта bot и movie_finder.
+        """
+        return {
+            "BOT_TOKEN": FAKE_TOKEN,
+            "KINOPOISK_API": "load",
+            "KINOPOISK_API_URL": self.urls["kinopoisk"],
+            "GOOGLE_URL": self.urls["google"],
+            "TRANSLATE_API_URL": self.urls["translate"],
+            "TELEGRAM_API_URL": self.urls["telegram"],
+            "DATABASE_PATH": database_path,
+            "STATE_BACKEND": "sqlite",
+            # translators при импорте определяет регион по сети
+            "translators_default_region": os.getenv("translators_default_region", "EN"),
+        }
+
+
+def make_workload(args: argparse.Namespace) -> tp.List[tp.Tuple[str, tp.Dict[str, tp.Any]]]:
+    """
+    Список (вид, обновление): поиски фильмов с популярностью по Ципфу
+    (часть - с опечатками, вид variant), команды /help и нажатия на жанр. У каждого обновления свой чат,
+    чтобы по нему найти первый ответ бота.
+    """
+    rnd = random.Random(args.seed)
+    weights = [1 / (rank ** args.zipf) for rank in range(1, args.films + 1)]
+    workload = []
+    for i in range(args.updates):
+        user = {"id": 1 + i % args.users, "is_bot": False, "first_name": "load"}
+        chat = {"id": 10 ** 9 + i, "type": "private"}
+        message = {"message_id": i, "date": 0, "chat": chat, "from": user}
+        roll = rnd.random()
+        if roll < args.genre_share:
+            kind = "genre"
+            update = {
+                "update_id": i,
+                "callback_query": {
+                    "id": str(i),
+                    "from": user,
+                    "chat_instance": "load",
+                    "message": dict(message, text="genres"),
+                    "data": f"genre_name:{rnd.choice(GENRES)}",
+                },
+            }
+        elif roll < args.genre_share + args.help_share:
+            kind = "help"
+            update = {"update_id": i, "message": dict(message, text="/help")}
+        else:
+            kind = "search"
+            film_id = rnd.choices(range(1, args.films + 1), weights)[0]
+            text = f"фильм {film_id}"
+            if rnd.random() < args.variant_share:
+                kind = "variant"
+                text = rnd.choice(VARIANTS).format(film_id)
+            update = {"update_id": i, "message": dict(message, text=text)}
+        workload.append((kind, update))
+    return workload
+
+
+def reply_key(update: tp.Any) -> str:
+    """
+    Ключ, по которому заглушка Bot API узнает ответ на это обновление.
+    """
+    if update.callback_query:
+        return f"callback_query_id:{update.callback_query.id}"
+    return f"chat_id:{update.message.chat.id}"
+
+
+def percentile(values: tp.List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+async def run(args: argparse.Namespace) -> None:
+    stand_ins = StandIns(args)
+    await stand_ins.start()
+    workdir = tempfile.mkdtemp(prefix="cinemabot-load-")
+    os.environ.update(stand_ins.environ(os.path.join(workdir, "movie.db")))
+
+    import bot
+    import movie_finder
+    from aiogram.types import Update
+
+    if args.unthrottled:
+        for upstream in (movie_finder.KINOPOISK, movie_finder.GOOGLE):
+            upstream.bucket.rate = upstream.bucket.burst = 10 ** 6
+            upstream._semaphore = asyncio.Semaphore(10 ** 6)
+
+    await bot.init_db()
+    await bot.STATE.open()
+    workload = make_workload(args)
+    updates = [
+        (kind, Update.model_validate(update, context={"bot": bot.bot}))
+        for kind, update in workload
+    ]
+    started_at: tp.Dict[str, float] = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def feed(kind: str, update: Update) -> None:
+        async with semaphore:
+            started_at[reply_key(update)] = time.perf_counter()
+            await bot.dp.feed_update(bot.bot, update)
+
+    began = time.perf_counter()
+    try:
+        await asyncio.gather(*[feed(kind, update) for kind, update in updates])
+        elapsed = time.perf_counter() - began
+    finally:
+        await bot.bot.session.close()
+        await bot.close_http_session()
+        await bot.close_db()
+        await stand_ins.stop()
+
+    latencies: tp.Dict[str, tp.List[float]] = {}
+    for kind, update in updates:
+        key = reply_key(update)
+        if key in stand_ins.first_reply:
+            latencies.setdefault(kind, []).append(
+                stand_ins.first_reply[key] - started_at[key]
+            )
+    searches = sum(1 for kind, _ in workload if kind in ("search", "variant"))
+    everything = [value for values in latencies.values() for value in values]
+
+    print(f"updates: {len(updates)} in {elapsed:.2f}s -> {len(updates) / elapsed:.1f} updates/s")
+    print("first reply latency, ms:")
+    for kind, values in sorted(latencies.items()) + [("all", everything)]:
+        print(
+            f"  {kind:<7} n={len(values):<6} p50={1000 * percentile(values, 50):8.1f}"
+            f" p95={1000 * percentile(values, 95):8.1f} p99={1000 * percentile(values, 99):8.1f}"
+        )
+    print(f"outbound calls per search ({searches} searches):")
+    for service in ("kinopoisk", "google", "translate", "telegram"):
+        per_search = stand_ins.calls[service] / searches if searches else 0.0
+        print(
+            f"  {service:<9} {stand_ins.calls[service]:>7} total"
+            f"  {per_search:6.2f} per search  {stand_ins.errors[service]} errors"
+        )
+    print(
+        f"posters sent: {stand_ins.calls['photo_by_url']} by url,"
+        f" {stand_ins.calls['photo_by_file_id']} by file_id"
+    )
+    resolved = bot.local_search_stats.as_dict()
+    print(
+        "films resolved: "
+        + ", ".join(f"{source} {resolved[source]}" for source in bot.local_search_stats.SOURCES)
+        + f" -> {100 * resolved['local_rate']:.1f}% locally"
+    )
+
+
+def main() -> None:
+    asyncio.run(run(parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import os
+import time
+import typing as tp
+from bisect import bisect_left
+
+from aiogram import BaseMiddleware
+from aiohttp import web
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = tp.Tuple[tp.Tuple[str, str], ...]
+Collector = tp.Callable[[], tp.Iterable[tp.Tuple[str, tp.Dict[str, str], float]]]
+
+
+class Histogram:
+    """
+    Гистограмма в духе Prometheus: счетчики по корзинам, сумма и количество.
+    """
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tp.Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels: tp.Dict[str, str]) -> Labels:
+    if len(labels) == 1:
+        ((name, value),) = labels.items()
+        return ((name, str(value)),)
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Registry:
+    """
+    Метрики процесса: гистограммы, счетчики и сборщики, которые при каждом
+    запросе /metrics превращают stats() кешей и сервисов в gauge.
+    """
+
+    def __init__(self):
+        self.histograms: tp.Dict[str, tp.Dict[Labels, Histogram]] = {}
+        self.counters: tp.Dict[str, tp.Dict[Labels, float]] = {}
+        self._collectors: tp.List[Collector] = []
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        series = self.histograms.setdefault(name, {})
+        key = _labels(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        series = self.counters.setdefault(name, {})
+        key = _labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    def timer(self, name: str, **labels: str) -> "Timer":
+        """
+        Записывает время выполнения блока with в гистограмму name_seconds,
+        а исключения - в счетчик name_errors_total.
+        """
+        return Timer(self, name, labels)
+
+    def add_collector(self, collector: Collector) -> None:
+        self._collectors.append(collector)
+
+    def add_stats(
+        self, prefix: str, stats: tp.Callable[[], tp.Dict[str, tp.Any]], **labels: str
+    ) -> None:
+        """
+        Экспортирует числовые значения словаря stats() как gauge prefix_<ключ>.
+        """
+
+        def collect():
+            for key, value in stats().items():
+                if isinstance(value, (int, float)):
+                    yield f"{prefix}_{key}", labels, value
+
+        self.add_collector(collect)
+
+    def render(self) -> str:
+        """
+        Текст метрик в формате Prometheus.
+        """
+        lines = []
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    bucket_labels = _format_labels(labels + (("le", str(bound)),))
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                bucket_labels = _format_labels(labels + (("le", "+Inf"),))
+                lines.append(f"{name}_bucket{bucket_labels} {histogram.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum!r}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        for name, series in sorted(self.counters.items()):
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        gauges: tp.Dict[str, tp.List[str]] = {}
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                gauges.setdefault(name, []).append(
+                    f"{name}{_format_labels(_labels(labels))} {_format_value(value)}"
+                )
+        for name, samples in sorted(gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+class Timer:
+    __slots__ = ("registry", "name", "labels", "started")
+
+    def __init__(self, registry: Registry, name: str, labels: tp.Dict[str, str]):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        elapsed = time.perf_counter() - self.started
+        if exc_type is not None and issubclass(exc_type, Exception):
+            self.registry.inc(self.name + "_errors_total", **self.labels)
+        self.registry.observe(self.name + "_seconds", elapsed, **self.labels)
+
+
+REGISTRY = Registry()
+timer = REGISTRY.timer
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Время и ошибки каждого обработчика aiogram. Регистрируется как
+    внутренний middleware, чтобы знать, какой обработчик выбран.
+    """
+
+    def __init__(self, registry: Registry = REGISTRY):
+        self.registry = registry
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        with self.registry.timer("cinemabot_handler", handler=name):
+            return await handler(event, data)
+
+
+async def start_metrics_server(
+    port: int, host: str = METRICS_HOST, registry: Registry = REGISTRY
+) -> web.AppRunner:
+    """
+    Поднимает HTTP-сервер, который отдает метрики по /metrics.
+    """
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(
+            body=registry.render().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
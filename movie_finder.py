@@ -1,15 +1,32 @@
 import aiohttp
 import asyncio
-from bs4 import BeautifulSoup
+import difflib
+import functools
+import heapq
 import itertools
+import logging
+import re
+import time
 import typing as tp
 import os
-from copy import deepcopy
 from dotenv import load_dotenv
 import random
-
-from phrasebook import description
-from translate import translate_text
+import unicodedata
+from urllib.parse import unquote
+
+from movie_info import MovieInfo, caption_cache
+from link_extractor import get_extractor
+from metrics import Histogram
+from throttle import Upstream, UpstreamError
+from translate import translate_many
+from db_helper import (
+    save_top250,
+    load_top250,
+    get_link_cache_entry,
+    save_link_cache_entry,
+    search_movie_links,
+    get_movie_info_by_film_id,
+)
 
 load_dotenv()
 
@@ -48,6 +65,8 @@ banned_sites = [
 good_sites_with_priorities = {
     good_sites[i]: (i + 1) for i in range(len(good_sites))
 }
+# поиск ссылок останавливается, как только нашелся сайт с таким приоритетом
+EARLY_STOP_PRIORITY = max(good_sites_with_priorities.values())
 
 NUM_LINKS_ON_PAGE = 10
 NUM_PAGES_TO_SCRAPE = 7
@@ -56,74 +75,175 @@ HEADERS = {
             AppleWebKit/537.36 (KHTML, like Gecko) Cafari/537.36"
 }
 KINOPOISK_API = os.environ["KINOPOISK_API"]
+# адреса внешних сервисов можно заменить, например на локальные заглушки
+# для нагрузочного прогона (см. loadtest.py)
+KINOPOISK_API_URL = os.getenv("KINOPOISK_API_URL", "https://kinopoiskapiunofficial.tech")
+GOOGLE_URL = os.getenv("GOOGLE_URL", "https://www.google.com")
+KINOPOISK_SEARCH_URL = KINOPOISK_API_URL + "/api/v2.1/films/search-by-keyword"
+KINOPOISK_TOP250_URL = KINOPOISK_API_URL + "/api/v2.2/films/top"
+TOP250_PAGES = 10
+TOP250_TTL = 24 * 60 * 60
+LINK_TTL = 7 * 24 * 60 * 60
+LINK_NEGATIVE_TTL = 6 * 60 * 60
+# границы корзин гистограммы возраста отданных ссылок, секунды
+LINK_AGE_BUCKETS = (60 * 60, LINK_NEGATIVE_TTL, 24 * 60 * 60, LINK_TTL, 30 * 24 * 60 * 60)
+# похожесть запроса на название (difflib), начиная с которой фильм из
+# локального поиска отдается без запроса к Кинопоиску
+LOCAL_MATCH_THRESHOLD = 0.85
+# порог похожести, когда Кинопоиск недоступен: лучше похожий фильм
+# из базы, чем ошибка
+FALLBACK_MATCH_THRESHOLD = 0.6
+
+HTTP_LIMIT = 100
+HTTP_LIMIT_PER_HOST = 20
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 30
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=20, connect=5)
+
+# ограничения на исходящие запросы: у ключа KINOPOISK_API есть квота,
+# а Google начинает отвечать ошибками при слишком частых запросах
+KINOPOISK = Upstream("kinopoisk", rate=5, burst=10, concurrency=5)
+GOOGLE = Upstream("google", rate=10, burst=20, concurrency=14)
+
+_session: tp.Optional[aiohttp.ClientSession] = None
+link_extractor = get_extractor()
+
+
+def create_http_session() -> aiohttp.ClientSession:
+    """
+    Создает сессию с пулом соединений: keep-alive соединения и кеш DNS
+    переиспользуются между запросами к Google и Кинопоиску.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_LIMIT,
+        limit_per_host=HTTP_LIMIT_PER_HOST,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=HTTP_TIMEOUT)
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    Возвращает общую для всего приложения сессию, создавая ее при первом вызове.
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = create_http_session()
+    return _session
+
+
+async def close_http_session() -> None:
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
 
+UNKNOWN_SITE_PRIORITY = 1000
+# хост адреса в параметре q= или url= редиректа Google, адрес может быть
+# закодирован (https%3A%2F%2F...), а сам хост в %XX не кодируется
+_REDIRECT_HOST = re.compile(
+    r"[?&](?:q|url)=[a-zA-Z][a-zA-Z0-9+.-]*(?::|%3[aA])(?://|%2[fF]%2[fF])"
+    r"(?:[^/?#@&%]*(?:@|%40))?([^/?#:&%]+)"
+)
+_URL_HOST = re.compile(r"[a-zA-Z][a-zA-Z0-9+.-]*://(?:[^/?#@]*@)?([^/?#:]+)")
 
-class MovieInfo:
+
+def _compile_site_rules(
+    rules: tp.List[tp.Tuple[str, int]]
+) -> tp.Tuple[tp.Pattern, tp.Dict[str, int]]:
     """
-    Класс для хранения информации о фильме.
+    Собирает все правила в одно регулярное выражение по хосту.
 
-    :param movie_id: Идентификатор фильма.
-    :param title_ru: Название фильма на русском языке.
-    :param title_en: Название фильма на английском языке.
-    :param year: Год выпуска фильма.
-    :param length: Продолжительность фильма.
-    :param description: Описание или сюжет фильма.
-    :param genres: Список жанров фильма.
-    :param rating: Рейтинг фильма.
-    :param poster_url: URL постера фильма.
+    Правило с точкой (ok.ru) - это домен: совпадает с хостом или его
+    поддоменом. Правило без точки (lordfilm) - начало метки хоста: совпадает
+    с lordfilm.lu и hd.lordfilm-2024.net, но ivi не совпадает с archivi.com.
+    Каждое правило - именованная группа, по имени группы находится приоритет.
+    """
+    labels, domains, priorities = [], [], {}
+    for i, (site, priority) in enumerate(sorted(rules, key=lambda rule: rule[1])):
+        group = f"r{i}"
+        priorities[group] = priority
+        alternative = f"(?P<{group}>{re.escape(site)})"
+        (domains if "." in site else labels).append(alternative)
+    parts = []
+    if labels:
+        parts.append(rf"(?:^|[.-])(?:{'|'.join(labels)})")
+    if domains:
+        parts.append(rf"(?:^|\.)(?:{'|'.join(domains)})$")
+    # правила могут пересекаться (lordfilm и shrek-lordfilms.ru), поэтому
+    # выражение стоит в lookahead и finditer находит совпадения на каждой позиции
+    return re.compile(f"(?=(?:{'|'.join(parts) or '(?!)'}))"), priorities
+
+
+class SiteClassifier:
     """
+    Определяет приоритет ссылки по хосту сайта, на который она ведет.
 
-    def __init__(
-        self,
-        movie_id,
-        title_ru,
-        title_en,
-        year,
-        length,
-        description,
-        description_en,
-        genres,
-        genres_en,
-        rating,
-        poster_url,
-        lang="ru",
-    ):
-        self.movie_id = movie_id
-        self.title_ru = title_ru
-        self.title_en = title_en
-        self.year = year
-        self.length = length
-        self.description = description
-        self.description_en = description_en
-        self.genres = genres
-        self.genres_en = genres_en
-        self.rating = rating
-        self.poster_url = poster_url
-        self.lang = lang
-
-    def __str__(self):
+    Хост разбирается один раз (для редиректов Google /url?q=... берется
+    целевой адрес), все правила проверяются одним регулярным выражением,
+    а результат для каждого хоста кешируется.
+
+    :param banned: Сайты, ссылки на которые не выдаются (приоритет 0).
+    :param priorities: Хорошие сайты и их приоритеты (меньше - лучше).
+    """
+
+    def __init__(self, banned: tp.List[str], priorities: tp.Dict[str, int]):
+        self._rules, self._priorities = _compile_site_rules(
+            [(site, 0) for site in banned] + list(priorities.items())
+        )
+        self.host_priority = functools.lru_cache(maxsize=16384)(self._host_priority)
+
+    @staticmethod
+    def target_url(link: str) -> tp.Optional[str]:
         """
-        Возвращает строковое представление объекта MovieInfo.
+        Адрес, на который ведет ссылка: для редиректа Google /url?q=...
+        раскодированный адрес из параметра, для остальных ссылок сама ссылка.
         """
-        return description(
-            self.title_ru,
-            self.title_en,
-            self.year,
-            self.rating,
-            self.genres,
-            self.genres_en,
-            self.description,
-            self.description_en,
-        )[self.lang]
+        if not link.startswith("/url?"):
+            return link
+        for param in link[5:].split("&"):
+            name, _, value = param.partition("=")
+            if value and (name == "q" or name == "url"):
+                value = unquote(value)
+                if _URL_HOST.match(value):
+                    return value
+        return None
+
+    @staticmethod
+    def target_host(link: str) -> tp.Optional[str]:
+        host = SiteClassifier._match_host(link)
+        return host.group(1).lower() if host else None
+
+    @staticmethod
+    def _match_host(link: str) -> tp.Optional[tp.Match]:
+        if link.startswith("/url?"):
+            # у Google бывает и q=<адрес>, и пустой q= рядом с url=<адрес>:
+            # берется первый параметр, в котором есть адрес
+            return _REDIRECT_HOST.search(link, 4)
+        return _URL_HOST.match(link)
+
+    def _host_priority(self, host: str) -> int:
+        return min(
+            (
+                self._priorities[match.lastgroup]
+                for match in self._rules.finditer(host.lower())
+            ),
+            default=UNKNOWN_SITE_PRIORITY,
+        )
+
+    def priority(self, link: str) -> int:
+        # кеш по хосту как он есть, без lower() на каждый вызов
+        host = self._match_host(link)
+        return self.host_priority(host.group(1)) if host else 0
+
+
+site_classifier = SiteClassifier(banned_sites, good_sites_with_priorities)
 
 
 def good_link(link: str) -> bool:
-    if "http" in link:
-        for bad_site in banned_sites:
-            if bad_site in link:
-                return False
-        return True
-    return False
+    return "http" in link and get_priority(link) != 0
 
 
 def what_lang(text: str) -> str:
@@ -138,44 +258,110 @@ def what_lang(text: str) -> str:
     return "ru"
 
 
+def normalize_query(text: str) -> str:
+    """
+    Приводит запрос пользователя к каноничному виду: NFKC, casefold,
+    ё -> е, пунктуация заменяется пробелами, пробелы схлопываются.
+    """
+    text = unicodedata.normalize("NFKC", text).casefold().replace("ё", "е")
+    text = "".join(
+        " " if unicodedata.category(char)[0] in "PSZC" else char for char in text
+    )
+    return " ".join(text.split())
+
+
+def match_confidence(query: str, title: tp.Optional[str]) -> float:
+    """
+    Насколько нормализованный запрос похож на название фильма, от 0 до 1.
+    Числа должны совпадать полностью: "матрица 2" - это не "Матрица".
+    """
+    if not title:
+        return 0.0
+    title = normalize_query(title)
+    if re.findall(r"\d+", query) != re.findall(r"\d+", title):
+        return 0.0
+    return difflib.SequenceMatcher(None, query, title).ratio()
+
+
+class LocalSearchStats:
+    """
+    Откуда resolve_movie взял фильм: из базы (alias - по прошлому такому
+    же запросу, name - по точному названию, fts - полнотекстовым поиском,
+    fallback - с пониженным порогом, когда Кинопоиск недоступен), из топ-250
+    (top250 - выбор по жанру) или с Кинопоиска.
+    """
+
+    SOURCES = ("alias", "name", "fts", "fallback", "top250", "kinopoisk")
+
+    def __init__(self):
+        self.counts = dict.fromkeys(self.SOURCES, 0)
+
+    def add(self, source: str) -> None:
+        self.counts[source] += 1
+
+    def as_dict(self) -> tp.Dict[str, float]:
+        total = sum(self.counts.values())
+        local = total - self.counts["kinopoisk"]
+        return {**self.counts, "local_rate": local / total if total else 0.0}
+
+
+local_search_stats = LocalSearchStats()
+
+
+async def find_local_movie(
+    query: str, threshold: float = LOCAL_MATCH_THRESHOLD
+) -> tp.Optional[MovieInfo]:
+    """
+    Ищет фильм по нормализованному запросу среди сохраненных в movie_links.
+    Возвращает фильм (MovieInfo), только если его русское или
+    английское название похоже на запрос не меньше чем на threshold.
+    """
+    scored = [
+        (
+            max(
+                match_confidence(query, record.title_ru),
+                match_confidence(query, record.title_en),
+            ),
+            record,
+        )
+        for record in await search_movie_links(query)
+    ]
+    confidence, record = max(scored, key=lambda item: item[0], default=(0.0, None))
+    return record if confidence >= threshold else None
+
+
 def create_search_url(movie_name: str, page_num=0, lang='ru') -> str:
     query = movie_name.replace(" ", "+")
     if lang == 'ru' and what_lang(movie_name) == "ru":
-        return f"https://www.google.com/search?q={query}+смотреть+онлайн&start={page_num * NUM_LINKS_ON_PAGE}"
+        return f"{GOOGLE_URL}/search?q={query}+смотреть+онлайн&start={page_num * NUM_LINKS_ON_PAGE}"
     else:
-        return f"https://www.google.com/search?q={query}+watch+online+с+субтитрами+в+оригинале&start=\
+        return f"{GOOGLE_URL}/search?q={query}+watch+online+с+субтитрами+в+оригинале&start=\
             {page_num * NUM_LINKS_ON_PAGE}"
 
 
 async def find_all_links_on_page(
     session: aiohttp.ClientSession, search_url: str
-) -> tp.List[str]:
-
-    good_links: tp.List[str] = []
-    try:
-        async with session.get(search_url, headers=HEADERS) as response:
-            if response.status == 200:
-                html = await response.text()
-                soup = BeautifulSoup(html, "html.parser")
-                for link in soup.find_all("a", href=True):
-                    href = link["href"]
-                    if good_link(href):
-                        good_links.append(href)
-            else:
-                print(f"Error: Received status {response.status} from Google.")
-    except aiohttp.ClientError as e:
-        print(f"Error connecting to Google: {e}")
+) -> tp.List[tp.Tuple[str, int]]:
+
+    """
+    Ссылки на просмотр со страницы выдачи Google вместе с их приоритетом.
+
+    :raises UpstreamError: Если Google не отдал страницу: это не то же
+        самое, что пустая выдача, и кешировать такой результат нельзя.
+    """
+    good_links: tp.List[tp.Tuple[str, int]] = []
+    html = await GOOGLE.get(session, search_url, read="text", headers=HEADERS)
+    for href in link_extractor.extract(html):
+        if "http" not in href:
+            continue
+        priority = get_priority(href)
+        if priority != 0:
+            good_links.append((href, priority))
     return good_links
 
 
 def get_priority(url: str) -> int:
-    for site_name in banned_sites:
-        if site_name in url:
-            return 0
-    for site_name in good_sites:
-        if site_name in url:
-            return good_sites_with_priorities[site_name]
-    return 1000
+    return site_classifier.priority(url)
 
 
 def select_most_relevant_link(links: tp.List[str], top) -> str:
@@ -186,47 +372,229 @@ def select_most_relevant_link(links: tp.List[str], top) -> str:
     :param top: Количество ссылок для выбора.
     :return: Список наиболее релевантных ссылок.
     """
-    links_with_priority = set((link, get_priority(link)) for link in links)
-    for link, priority in deepcopy(links_with_priority):
-        if priority == 0:
-            links_with_priority.remove((link, priority))
-    sorted_links = sorted(links_with_priority, key=lambda x: x[1])
-    return [movie[0] for movie in sorted_links[:top]]
+    priorities: tp.Dict[str, int] = {}
+    for link in links:
+        if link not in priorities:
+            priorities[link] = get_priority(link)
+    return heapq.nsmallest(
+        top,
+        (link for link, priority in priorities.items() if priority != 0),
+        key=priorities.__getitem__,
+    )
 
 
-async def find_movie_urls(movie_name: str, top=3, lang='ru') -> str:
+class LinkRanker:
+    """
+    Инкрементально ранжирует ссылки по мере загрузки страниц выдачи.
+    При равном приоритете выше та ссылка, что раньше встретилась в выдаче.
+    """
+
+    def __init__(self):
+        self._ranked: tp.Dict[str, tp.Tuple[int, int, int]] = {}
+
+    def add(self, page_num: int, links: tp.List[tp.Tuple[str, int]]) -> None:
+        """
+        :param links: Ссылки страницы с приоритетами из find_all_links_on_page.
+        """
+        for position, (link, priority) in enumerate(links):
+            rank = (priority, page_num, position)
+            if link not in self._ranked or rank < self._ranked[link]:
+                self._ranked[link] = rank
+
+    @property
+    def found_priority_link(self) -> bool:
+        return any(
+            rank[0] <= EARLY_STOP_PRIORITY for rank in self._ranked.values()
+        )
+
+    def best(self, top: int) -> tp.List[str]:
+        return heapq.nsmallest(top, self._ranked, key=self._ranked.__getitem__)
+
+
+async def find_movie_urls(
+    movie_name: str,
+    top=3,
+    lang='ru',
+    session: tp.Optional[aiohttp.ClientSession] = None,
+) -> tp.Optional[str]:
     """
     Находит ссылки на фильм на основе его названия.
 
+    Сначала загружается первая страница выдачи; если на ней нет ссылки
+    с сайта из good_sites, остальные страницы загружаются параллельно,
+    и поиск останавливается, как только такая ссылка нашлась.
+
     :param movie_name: Название фильма.
     :param top: Количество ссылок для выбора.
-    :return: Список наиболее релевантных ссылок.
+    :param session: HTTP-сессия, по умолчанию общая сессия приложения.
+    :return: Самая релевантная ссылка или None, если ничего не нашлось.
+    :raises UpstreamError: Если ссылки нет, а часть страниц не загрузилась:
+        тогда неизвестно, есть ли ссылка на самом деле.
     """
-    all_search_urls: tp.List[str] = []
+    session = session or get_http_session()
+    ranker = LinkRanker()
+    error: tp.Optional[UpstreamError] = None
+    ranker.add(
+        0,
+        await find_all_links_on_page(
+            session, create_search_url(movie_name, 0, lang)
+        ),
+    )
+    if not ranker.found_priority_link:
+        pages = {
+            asyncio.create_task(
+                find_all_links_on_page(
+                    session, create_search_url(movie_name, page_num, lang)
+                )
+            ): page_num
+            for page_num in range(1, NUM_PAGES_TO_SCRAPE)
+        }
+        pending = set(pages)
+        try:
+            while pending and not ranker.found_priority_link:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in sorted(done, key=pages.__getitem__):
+                    try:
+                        ranker.add(pages[task], task.result())
+                    except UpstreamError as e:
+                        error = e
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+    relevant_links = ranker.best(top)
+    if relevant_links:
+        return relevant_links[0]
+    if error is not None:
+        raise error
+    return None
+
+
+class LinkCache:
+    """
+    Кеш найденных ссылок на просмотр по (название фильма, язык).
+
+    Найденная ссылка живет ttl секунд, отсутствие ссылки - negative_ttl.
+    Устаревшая запись все равно сразу отдается пользователю, а поиск
+    заново запускается в фоне.
 
-    for page_num in range(NUM_PAGES_TO_SCRAPE):
-        search_url = create_search_url(movie_name, page_num, lang)
-        all_search_urls.append(search_url)
+    :param ttl: Время жизни найденной ссылки в секундах.
+    :param negative_ttl: Время жизни записи "ссылка не найдена" в секундах.
+    """
 
-    async with aiohttp.ClientSession() as session:
-        responses = [
-            find_all_links_on_page(session, url) for url in all_search_urls
-        ]
-        links = await asyncio.gather(*responses)
-        links = list(itertools.chain(*links))[:top]
-        return select_most_relevant_link(links, top)[0]
+    def __init__(self, ttl: float = LINK_TTL, negative_ttl: float = LINK_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.negative_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        # возраст записей, отданных из кеша
+        self.ages = Histogram(LINK_AGE_BUCKETS)
+        self._revalidating: tp.Dict[tp.Tuple[str, str], asyncio.Task] = {}
+
+    def stats(self) -> tp.Dict[str, int]:
+        stats = {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "revalidating": len(self._revalidating),
+        }
+        served = 0
+        for bound, count in zip(self.ages.buckets, self.ages.counts):
+            served += count
+            stats[f"age_le_{bound}"] = served
+        stats["age_count"] = self.ages.count
+        return stats
+
+    async def stop(self) -> None:
+        """
+        Отменяет фоновые поиски ссылок и ждет их: при остановке бота это
+        нужно сделать до закрытия HTTP-сессии и базы.
+        """
+        tasks = list(self._revalidating.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
+    async def _fetch(
+        self,
+        title: str,
+        lang: str,
+        session: tp.Optional[aiohttp.ClientSession] = None,
+    ) -> tp.Optional[str]:
+        """
+        Ищет ссылку и сохраняет результат. Ошибки Google пробрасываются
+        и не сохраняются: "не нашлось" кешируется только по настоящей выдаче.
+        """
+        link = await find_movie_urls(movie_name=title, top=1, lang=lang, session=session)
+        await save_link_cache_entry(title, lang, link, time.time())
+        return link
 
-async def get_movie_info(movie_name: str, lang="ru") -> MovieInfo:
+    async def _revalidate(self, title: str, lang: str) -> None:
+        try:
+            await self._fetch(title, lang)
+        except Exception as e:
+            logging.error(f"Error revalidating link for {title}: {e}")
+        finally:
+            self._revalidating.pop((title, lang), None)
+
+    def revalidate_in_background(self, title: str, lang: str) -> None:
+        key = (title, lang)
+        if key not in self._revalidating:
+            self._revalidating[key] = asyncio.create_task(
+                self._revalidate(title, lang)
+            )
+
+    async def get_link(
+        self,
+        title: str,
+        lang: str = "ru",
+        session: tp.Optional[aiohttp.ClientSession] = None,
+    ) -> tp.Optional[str]:
+        """
+        Возвращает ссылку на фильм из кеша, а при промахе ищет ее в Google.
+        """
+        entry = await get_link_cache_entry(title, lang)
+        if entry is None:
+            self.misses += 1
+            try:
+                return await self._fetch(title, lang, session)
+            except UpstreamError as e:
+                logging.warning(f"link search failed: {e}")
+                return None
+        link, fetched_at = entry
+        age = time.time() - fetched_at
+        self.ages.observe(age)
+        ttl = self.ttl if link else self.negative_ttl
+        if age > ttl:
+            self.stale_hits += 1
+            self.revalidate_in_background(title, lang)
+        elif link:
+            self.hits += 1
+        else:
+            self.negative_hits += 1
+        return link
+
+
+link_cache = LinkCache()
+
+
+async def get_movie_info(
+    movie_name: str,
+    session: tp.Optional[aiohttp.ClientSession] = None,
+) -> MovieInfo:
     """
     Получает информацию о фильме с помощью Kinopoisk API.
 
     :param movie_name: Название фильма.
+    :param session: HTTP-сессия, по умолчанию общая сессия приложения.
     :return: Объект MovieInfo с информацией о фильме.
+    :raises UpstreamError: Если Кинопоиск не ответил.
     """
-    kinopoisk_search_id_url = (
-        "https://kinopoiskapiunofficial.tech/api/v2.1/films/search-by-keyword"
-    )
     kinopoisk_headers = {
         "X-API-KEY": KINOPOISK_API,
         "Content-Type": "application/json",
@@ -237,93 +605,165 @@ async def get_movie_info(movie_name: str, lang="ru") -> MovieInfo:
         "page": 1,
         "searchFilmsCountResult": 1,
     }
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(
-                kinopoisk_search_id_url,
-                headers=kinopoisk_headers,
-                params=kinopoisk_params,
-            ) as response:
-                if response.status == 200:
-                    movie_data = await response.json()
-                    movie_data = movie_data.get("films")[0]
-                    return give_movie_info(movie_data, lang)
-                print(
-                    f"Error: Received status {response.status, response} from kinopoisk."
-                )
-        except aiohttp.ClientError as e:
-            print(f"Error connecting to kinopoisk: {e}")
+    session = session or get_http_session()
+    movie_data = await KINOPOISK.get(
+        session,
+        KINOPOISK_SEARCH_URL,
+        headers=kinopoisk_headers,
+        params=kinopoisk_params,
+    )
+    movie_data = movie_data.get("films")[0]
+    return await give_movie_info(movie_data)
 
 
-async def get_random_movie_from_top250(
-    genre_name: str = "драма", lang="ru"
-) -> MovieInfo:
+class Top250Catalogue:
     """
-    выдает случайный фильм из топ-250 Кинопоиска с возможностью фильтрации по жанру
-    :param genre_id: ID жанра для фильтрации.
-    :return: Объект MovieInfo.
+    Топ-250 Кинопоиска, загруженный один раз и проиндексированный по жанрам.
+
+    Список хранится в таблице top250 в movie.db и в памяти в виде словаря
+    жанр -> список фильмов. Когда список старше ttl секунд, он обновляется
+    в фоне, а пользователям пока выдается старый.
+
+    :param ttl: Время жизни загруженного списка в секундах.
     """
-    kinopoisk_top250_url = (
-        "https://kinopoiskapiunofficial.tech/api/v2.2/films/top"
-    )
-    kinopoisk_headers = {
-        "X-API-KEY": KINOPOISK_API,
-        "Content-Type": "application/json",
-        "User-Agent": HEADERS["User-Agent"],
-    }
 
-    films_by_genre = []
-    async with aiohttp.ClientSession() as session:
+    def __init__(self, ttl: float = TOP250_TTL):
+        self.ttl = ttl
+        self.by_genre: tp.Dict[str, tp.List[tp.Dict[str, tp.Any]]] = {}
+        self.fetched_at: tp.Optional[float] = None
+        self._load_lock = asyncio.Lock()
+        self._refresh_task: tp.Optional[asyncio.Task] = None
+
+    @property
+    def is_stale(self) -> bool:
+        return self.fetched_at is None or time.time() - self.fetched_at > self.ttl
+
+    def _index(self, films: tp.List[tp.Dict[str, tp.Any]], fetched_at: float) -> None:
+        by_genre: tp.Dict[str, tp.List[tp.Dict[str, tp.Any]]] = {}
+        for film in films:
+            for genre in film.get("genres", []):
+                by_genre.setdefault(genre.get("genre"), []).append(film)
+        self.by_genre = by_genre
+        self.fetched_at = fetched_at
+
+    async def _fetch_page(
+        self, session: aiohttp.ClientSession, page: int
+    ) -> tp.List[tp.Dict[str, tp.Any]]:
+        kinopoisk_headers = {
+            "X-API-KEY": KINOPOISK_API,
+            "Content-Type": "application/json",
+            "User-Agent": HEADERS["User-Agent"],
+        }
+        top250_data = await KINOPOISK.get(
+            session,
+            KINOPOISK_TOP250_URL,
+            headers=kinopoisk_headers,
+            params={"type": "TOP_250_BEST_FILMS", "page": page},
+        )
+        return top250_data.get("films", [])
+
+    async def refresh(self, session: tp.Optional[aiohttp.ClientSession] = None) -> None:
+        """
+        Загружает все страницы топа параллельно и сохраняет их в базу.
+        """
+        session = session or get_http_session()
         try:
-            for page in range(1, 11):
-                async with session.get(
-                    kinopoisk_top250_url,
-                    headers=kinopoisk_headers,
-                    params={"type": "TOP_250_BEST_FILMS", "page": page},
-                ) as response:
-                    if response.status == 200:
-                        top250_data = await response.json()
-                        films = top250_data.get("films", [])
-                        new_films_by_genre = [
-                            film
-                            for film in films
-                            if any(
-                                (genre.get("genre") == genre_name)
-                                for genre in film.get("genres", [])
-                            )
-                        ]
-                        for film in new_films_by_genre:
-                            films_by_genre.append(film)
-                    else:
-                        raise Exception(
-                            f"Error: Received status {response.status} from Kinopoisk."
-                        )
-            if films_by_genre:
-                movie_data = random.choice(films_by_genre)
-                return give_movie_info(movie_data, lang)
+            pages = await asyncio.gather(
+                *[
+                    self._fetch_page(session, page)
+                    for page in range(1, TOP250_PAGES + 1)
+                ]
+            )
+        except UpstreamError as e:
+            raise Exception(f"Error loading top 250 from Kinopoisk: {e}")
+        films = list(itertools.chain(*pages))
+        fetched_at = time.time()
+        await save_top250(films, fetched_at)
+        self._index(films, fetched_at)
+
+    async def _refresh_quietly(self) -> None:
+        try:
+            await self.refresh()
+        except Exception as e:
+            logging.error(f"Error refreshing top 250: {e}")
+
+    def refresh_in_background(self) -> None:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_quietly())
+
+    async def ensure_loaded(
+        self, session: tp.Optional[aiohttp.ClientSession] = None
+    ) -> None:
+        """
+        Загружает топ из базы, а если там пусто - из API Кинопоиска.
+        """
+        if self.fetched_at is not None:
+            return
+        async with self._load_lock:
+            if self.fetched_at is not None:
+                return
+            films, fetched_at = await load_top250()
+            if films:
+                self._index(films, fetched_at)
             else:
-                raise Exception(
-                    "No films found in the top 250 with the specified genre."
-                )
-        except aiohttp.ClientError as e:
-            raise Exception(f"Error connecting to Kinopoisk: {e}")
+                await self.refresh(session)
+
+    async def random_film(
+        self,
+        genre_name: str,
+        session: tp.Optional[aiohttp.ClientSession] = None,
+    ) -> tp.Dict[str, tp.Any]:
+        await self.ensure_loaded(session)
+        if self.is_stale:
+            self.refresh_in_background()
+        films = self.by_genre.get(genre_name)
+        if not films:
+            raise Exception(
+                "No films found in the top 250 with the specified genre."
+            )
+        return random.choice(films)
+
+
+top250_catalogue = Top250Catalogue()
 
 
-def give_movie_info(movie_data, lang="ru"):
+async def get_random_movie_from_top250(
+    genre_name: str = "драма",
+    session: tp.Optional[aiohttp.ClientSession] = None,
+) -> tp.Tuple[MovieInfo, bool]:
+    """
+    выдает случайный фильм из топ-250 Кинопоиска с возможностью фильтрации по жанру.
+    Фильм ищется в базе по filmId; если его там нет, информация собирается
+    из загруженного топа, без поиска на Кинопоиске.
+    :param genre_name: Жанр для фильтрации.
+    :param session: HTTP-сессия, по умолчанию общая сессия приложения.
+    :return: Объект MovieInfo и признак того, что фильм уже есть в базе.
+    """
+    movie_data = await top250_catalogue.random_film(genre_name, session)
+    movie_info = await get_movie_info_by_film_id(movie_data.get("filmId"))
+    if movie_info is not None:
+        return movie_info, True
+    return await give_movie_info(movie_data), False
+
+
+async def give_movie_info(movie_data):
     genres_dict = (movie_data.get("genres", "неизвестный жанр")[0],)
+    description_ru = movie_data.get("description", "описания нет")
+    genres = [genre["genre"] for genre in genres_dict]
+    description_en, *genres_en = await translate_many([description_ru, *genres])
+    movie_id = movie_data.get("filmId", "неизвестный id")
+    # свежие данные с Кинопоиска могли поменяться: старые подписи не годятся
+    caption_cache.invalidate(movie_id)
     return MovieInfo(
-        movie_id=movie_data.get("filmId", "неизвестный id"),
+        movie_id=movie_id,
         title_ru=movie_data.get("nameRu", "неизвестное название"),
         title_en=movie_data.get("nameEn", "неизвестное название"),
         year=movie_data.get("year", "неизвестный год"),
         length=movie_data.get("filmLength", "неизвестная длина"),
-        description=movie_data.get("description", "описания нет"),
-        description_en=translate_text(
-            movie_data.get("description", "описания нет")
-        ),
-        genres=[genre["genre"] for genre in genres_dict],
-        genres_en=[translate_text(genre["genre"]) for genre in genres_dict],
+        description=description_ru,
+        description_en=description_en,
+        genres=tuple(genres),
+        genres_en=tuple(genres_en),
         rating=movie_data.get("rating", "неизвестный рейтинг"),
-        poster_url=movie_data.get("posterUrl", "постера нет"),
-        lang=lang,
+        poster_url=movie_data.get("posterUrl"),
     )
@@ -0,0 +1,138 @@
+"""
+Информация о фильме и кеш готовых подписей к ней. Один и тот же класс
+MovieInfo возвращают и запросы к movie_links, и Кинопоиск.
+"""
+import json
+import typing as tp
+from collections import OrderedDict
+
+from phrasebook import description
+
+CAPTION_CACHE_SIZE = 10000
+LANGUAGES = ("ru", "en")
+GENRES_SEPARATOR = ", "
+
+
+class MovieInfo(tp.NamedTuple):
+    """
+    Неизменяемая информация о фильме. Жанры хранятся кортежами, поэтому
+    объекты можно сравнивать и класть в кеши; у кортежа нет __dict__,
+    и запись дешево создается из строки базы.
+
+    :param movie_id: Идентификатор фильма.
+    :param title_ru: Название фильма на русском языке.
+    :param title_en: Название фильма на английском языке.
+    :param year: Год выпуска фильма.
+    :param length: Продолжительность фильма.
+    :param description: Описание или сюжет фильма.
+    :param genres: Кортеж жанров фильма.
+    :param rating: Рейтинг фильма.
+    :param poster_url: URL постера фильма или None, если постера нет.
+    :param poster_file_id: file_id постера, уже загруженного в Telegram.
+    :param link: Сохраненная ссылка на просмотр или None.
+    """
+
+    movie_id: tp.Any
+    title_ru: str
+    title_en: str
+    year: tp.Any
+    length: tp.Any
+    description: str
+    description_en: str
+    genres: tp.Tuple[str, ...]
+    genres_en: tp.Tuple[str, ...]
+    rating: tp.Any
+    poster_url: tp.Optional[str]
+    poster_file_id: tp.Optional[str] = None
+    link: tp.Optional[str] = None
+
+    def __repr__(self) -> str:
+        return f"MovieInfo({self.movie_id!r}, {self.title_ru!r})"
+
+    def title(self, lang: str) -> str:
+        return self.title_ru if lang == "ru" else self.title_en
+
+    def caption(self, lang: str) -> str:
+        """
+        Подпись к фильму на языке lang.
+        """
+        return caption_cache.render(self, lang)
+
+    def to_json(self) -> str:
+        """
+        JSON с полями в фиксированном порядке: одинаковые фильмы дают
+        одинаковую строку.
+        """
+        return json.dumps(self._asdict(), ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, data: str) -> "MovieInfo":
+        fields = json.loads(data)
+        fields["genres"] = tuple(fields["genres"])
+        fields["genres_en"] = tuple(fields["genres_en"])
+        return cls(**fields)
+
+
+class CaptionCache:
+    """
+    LRU-кеш готовых подписей по (id фильма, язык). Подписи фильма
+    сбрасываются, когда его запись в movie_links меняется, и когда фильм
+    заново приходит с Кинопоиска. Подпись хранится вместе с записью, по
+    которой она собрана, и отдается только для такой же записи: фильм,
+    измененный другим процессом, получит новую подпись, как только его
+    запись перечитается из базы.
+
+    :param maxsize: Максимальное количество подписей.
+    """
+
+    def __init__(self, maxsize: int = CAPTION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items: tp.OrderedDict[tp.Tuple[int, str], tp.Tuple[MovieInfo, str]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def render(self, movie: MovieInfo, lang: str) -> str:
+        key = (movie.movie_id, lang)
+        entry = self._items.get(key)
+        if entry is not None and (entry[0] is movie or entry[0] == movie):
+            self._items.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        caption = description(
+            lang,
+            movie.title(lang),
+            movie.year,
+            movie.rating,
+            movie.genres if lang == "ru" else movie.genres_en,
+            movie.description if lang == "ru" else movie.description_en,
+        )
+        # без id фильма запись нельзя будет сбросить, такие подписи не кешируются
+        if isinstance(movie.movie_id, int):
+            self._items[key] = (movie, caption)
+            self._items.move_to_end(key)
+            if len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return caption
+
+    def invalidate(self, film_id: int) -> None:
+        for lang in LANGUAGES:
+            self._items.pop((film_id, lang), None)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+    def stats(self) -> tp.Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+caption_cache = CaptionCache()
@@ -61,32 +61,32 @@ def hello_message(user_name):
     return {"ru": f"привет, {user_name}!", "en": f"hi {user_name}!"}
 
 
-def description(
-    title_ru,
-    title_en,
-    year,
-    rating,
-    genres,
-    genres_en,
-    description,
-    description_en,
-):
-    return {
-        "ru": (
-            f"🟡 Название: {title_ru}\n"
-            f"🔴 Год: {year}\n"
-            f"🟡 Рейтинг: {rating}\n"
-            f"🔴 Жанры: {', '.join([genre for genre in genres])}\n"
-            f"Краткое описание: {description}\n"
-        ),
-        "en": (
-            f"🟡 Title: {title_en}\n"
-            f"🔴 Year: {year}\n"
-            f"🟡 Rating: {rating}\n"
-            f"🔴 Genres: {', '.join([genre for genre in genres_en])}\n"
-            f"Description: {description_en}\n"
-        ),
-    }
+description_message = {
+    "ru": (
+        "🟡 Название: {title}\n"
+        "🔴 Год: {year}\n"
+        "🟡 Рейтинг: {rating}\n"
+        "🔴 Жанры: {genres}\n"
+        "Краткое описание: {description}\n"
+    ),
+    "en": (
+        "🟡 Title: {title}\n"
+        "🔴 Year: {year}\n"
+        "🟡 Rating: {rating}\n"
+        "🔴 Genres: {genres}\n"
+        "Description: {description}\n"
+    ),
+}
+
+
+def description(lang, title, year, rating, genres, description):
+    return description_message[lang].format(
+        title=title,
+        year=year,
+        rating=rating,
+        genres=", ".join(genres),
+        description=description,
+    )
 
 
 choose_genre_message = {
@@ -98,3 +98,14 @@ set_rating_message = {
     "ru": "Поставить оценку фильму",
     "en": "Rate this film"
     }
+
+commands_description = {
+    "ru": {
+        "start": "начать и выбрать язык",
+        "help": "что умеет бот",
+    },
+    "en": {
+        "start": "start and choose a language",
+        "help": "what the bot can do",
+    },
+}
@@ -0,0 +1,36 @@
+import asyncio
+import typing as tp
+
+T = tp.TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные вызовы с одинаковым ключом: пока первый вызов
+    выполняется, остальные ждут его результат, а не запускают работу заново.
+
+    Сама работа выполняется в отдельной задаче, поэтому отмена одного из
+    ожидающих не отменяет ее для остальных.
+    """
+
+    def __init__(self):
+        self._calls: tp.Dict[tp.Hashable, asyncio.Task] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(
+        self, key: tp.Hashable, func: tp.Callable[[], tp.Awaitable[T]]
+    ) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.followers += 1
+        return await asyncio.shield(task)
@@ -0,0 +1,196 @@
+import os
+import time
+import typing as tp
+from collections import OrderedDict
+
+import db_helper
+
+try:
+    from redis import asyncio as redis_asyncio
+except ImportError:
+    redis_asyncio = None
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = "cinemabot:"
+USER_PROFILE_CACHE_SIZE = 10000
+# через сколько секунд перечитывать язык из хранилища: его могли
+# поменять в другом процессе
+USER_PROFILE_TTL = 60.0
+
+
+class StateStore:
+    """
+    Состояние бота, которое должны видеть все процессы: язык пользователя.
+    """
+
+    name = ""
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return True
+
+    @property
+    def shared(self) -> bool:
+        """
+        True, если состояние видно другим процессам.
+        """
+        return True
+
+    async def open(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def get_language(self, user_id: int) -> tp.Optional[str]:
+        """
+        Язык пользователя или None, если пользователь еще не известен.
+        """
+        raise NotImplementedError
+
+    async def set_language(self, user_id: int, language: str) -> None:
+        raise NotImplementedError
+
+
+class InMemoryStateStore(StateStore):
+    """
+    Словарь в памяти процесса, ничего не сохраняет. Для локальных прогонов
+    и одного процесса.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self._languages: tp.Dict[int, str] = {}
+
+    @property
+    def shared(self) -> bool:
+        return False
+
+    async def get_language(self, user_id: int) -> tp.Optional[str]:
+        return self._languages.get(user_id)
+
+    async def set_language(self, user_id: int, language: str) -> None:
+        self._languages[user_id] = language
+
+
+class SqliteStateStore(StateStore):
+    """
+    Языки в таблице users в movie.db. Общее для всех процессов на одной машине.
+    """
+
+    name = "sqlite"
+
+    async def get_language(self, user_id: int) -> tp.Optional[str]:
+        return await db_helper.get_user_language(user_id)
+
+    async def set_language(self, user_id: int, language: str) -> None:
+        await db_helper.set_user_language(user_id, language)
+
+
+class RedisStateStore(StateStore):
+    """
+    Состояние в redis (или совместимом сервере) - для процессов на разных
+    машинах. Клиент можно передать готовым, иначе он создается по REDIS_URL.
+    """
+
+    name = "redis"
+
+    def __init__(self, client: tp.Any = None, url: str = REDIS_URL):
+        self.url = url
+        self._client = client
+        self._own_client = client is None
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return redis_asyncio is not None
+
+    async def open(self) -> None:
+        if self._client is None:
+            self._client = redis_asyncio.from_url(self.url, decode_responses=True)
+
+    async def close(self) -> None:
+        if self._own_client and self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get_language(self, user_id: int) -> tp.Optional[str]:
+        return await self._client.hget(REDIS_PREFIX + "lang", str(user_id))
+
+    async def set_language(self, user_id: int, language: str) -> None:
+        await self._client.hset(REDIS_PREFIX + "lang", str(user_id), language)
+
+
+class UserProfileCache:
+    """
+    Языки недавних пользователей поверх StateStore. Пользователь читается
+    из хранилища при первом обращении и держится в LRU на maxsize
+    пользователей не дольше ttl секунд; изменения пишутся сразу и в кеш,
+    и в хранилище.
+    """
+
+    def __init__(
+        self,
+        store: StateStore,
+        maxsize: int = USER_PROFILE_CACHE_SIZE,
+        ttl: float = USER_PROFILE_TTL,
+    ):
+        self.store = store
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _put(self, user_id: int, language: tp.Optional[str]) -> None:
+        self._entries[user_id] = (language, time.monotonic())
+        self._entries.move_to_end(user_id)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def get_language(self, user_id: int) -> tp.Optional[str]:
+        """
+        Язык пользователя или None, если пользователь еще не известен.
+        """
+        entry = self._entries.get(user_id)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        language = await self.store.get_language(user_id)
+        self._put(user_id, language)
+        return language
+
+    async def set_language(self, user_id: int, language: str) -> None:
+        await self.store.set_language(user_id, language)
+        self._put(user_id, language)
+
+    def stats(self) -> tp.Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+STATE_STORES: tp.Dict[str, tp.Type[StateStore]] = {
+    store.name: store
+    for store in (InMemoryStateStore, SqliteStateStore, RedisStateStore)
+}
+
+
+def get_state_store(name: tp.Optional[str] = None) -> StateStore:
+    """
+    Возвращает хранилище по имени (или из STATE_BACKEND), по умолчанию sqlite.
+    """
+    name = name or os.getenv("STATE_BACKEND") or "sqlite"
+    store = STATE_STORES[name]
+    if not store.is_available():
+        raise RuntimeError(f"state backend {name} is not installed")
+    return store()
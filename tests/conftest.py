@@ -0,0 +1,166 @@
+"""
+Общая обвязка тестов.
+
+Локальные заглушки Кинопоиска, Google, переводчика и Bot API из loadtest.py
+поднимаются до импорта модулей бота, поэтому тесты не ходят в сеть. Все
+тесты выполняются в одном event loop: в нем работают заглушки, общая
+HTTP-сессия и очереди ограничителей запросов.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+from aiogram.types import Update
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, "tests", "fixtures")
+sys.path.insert(0, ROOT)
+
+import loadtest  # noqa: E402
+
+# без задержек и ошибок; тесты, которым нужна задержка, задают ее сами
+STAND_IN_ARGV = [
+    "--kinopoisk-latency", "0",
+    "--google-latency", "0",
+    "--translate-latency", "0",
+    "--telegram-latency", "0",
+    "--poster-fetch-latency", "0",
+]
+
+LOOP = asyncio.new_event_loop()
+asyncio.set_event_loop(LOOP)
+STAND_INS = loadtest.StandIns(loadtest.parse_args(STAND_IN_ARGV))
+LOOP.run_until_complete(STAND_INS.start())
+os.environ.update(
+    STAND_INS.environ(os.path.join(tempfile.mkdtemp(prefix="cinemabot-test-"), "movie.db"))
+)
+
+import bot  # noqa: E402
+import db_helper  # noqa: E402
+import movie_finder  # noqa: E402
+import movie_info  # noqa: E402
+
+
+def pytest_sessionfinish(session, exitstatus):
+    LOOP.run_until_complete(bot.bot.session.close())
+    LOOP.run_until_complete(movie_finder.close_http_session())
+    LOOP.run_until_complete(STAND_INS.stop())
+
+
+@pytest.fixture
+def run():
+    """
+    Выполняет корутину в общем event loop тестов.
+    """
+    return LOOP.run_until_complete
+
+
+@pytest.fixture
+def stand_ins():
+    """
+    Заглушки внешних сервисов со сброшенными счетчиками. Параметры
+    (задержки, доля ошибок) после теста возвращаются к исходным.
+    """
+    args = vars(STAND_INS.args).copy()
+    STAND_INS.calls.clear()
+    STAND_INS.errors.clear()
+    STAND_INS.first_reply.clear()
+    yield STAND_INS
+    vars(STAND_INS.args).update(args)
+
+
+@pytest.fixture
+def db(tmp_path):
+    """
+    Пустая база во временном каталоге; кеши в памяти очищаются.
+    """
+    db_helper._pool.path = str(tmp_path / "movie.db")
+    db_helper.movie_record_cache.clear()
+    movie_info.caption_cache.clear()
+    LOOP.run_until_complete(db_helper.init_db())
+    yield db_helper
+    LOOP.run_until_complete(db_helper.close_db())
+
+
+@pytest.fixture(scope="session")
+def google_pages():
+    """
+    Сохраненные страницы выдачи Google из tests/fixtures/google по имени файла.
+    """
+    directory = os.path.join(FIXTURES, "google")
+    pages = {}
+    for filename in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, filename), encoding="utf-8") as f:
+            pages[filename] = f.read()
+    return pages
+
+
+@pytest.fixture
+def serve():
+    """
+    Поднимает на время теста локальный HTTP-сервер с заданными маршрутами
+    (или готовым aiohttp-приложением) и возвращает его адрес.
+    """
+    runners = []
+
+    def start(routes):
+        if isinstance(routes, web.Application):
+            app = routes
+        else:
+            app = web.Application()
+            app.add_routes(routes)
+        runner = web.AppRunner(app, access_log=None)
+        LOOP.run_until_complete(runner.setup())
+        LOOP.run_until_complete(web.TCPSite(runner, "127.0.0.1", 0).start())
+        runners.append(runner)
+        return f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+    yield start
+    for runner in runners:
+        LOOP.run_until_complete(runner.cleanup())
+
+
+def message_update(text, user_id=1, update_id=1):
+    """
+    Обновление Telegram с текстовым сообщением; у каждого обновления свой чат.
+    """
+    user = {"id": user_id, "is_bot": False, "first_name": "test"}
+    chat = {"id": 10 ** 9 + update_id, "type": "private"}
+    return {
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "chat": chat, "from": user, "text": text},
+    }
+
+
+def callback_update(data, user_id=1, update_id=1):
+    """
+    Обновление Telegram с нажатием на кнопку с callback_data.
+    """
+    user = {"id": user_id, "is_bot": False, "first_name": "test"}
+    message = message_update("", user_id, update_id)["message"]
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user,
+            "chat_instance": "test",
+            "message": message,
+            "data": data,
+        },
+    }
+
+
+@pytest.fixture
+def feed(db, stand_ins):
+    """
+    Передает обновления Telegram в Dispatcher из bot.py. Ответы бота уходят
+    в заглушку Bot API.
+    """
+
+    async def feed_update(update):
+        await bot.dp.feed_update(bot.bot, Update.model_validate(update, context={"bot": bot.bot}))
+
+    return feed_update
@@ -0,0 +1,174 @@
+import asyncio
+
+import pytest
+
+from movie_info import MovieInfo
+
+
+async def _start_background_flush(db):
+    """
+    Запускает сброс буфера и отдает управление, чтобы он успел забрать
+    строки из буфера, но еще не записал их.
+    """
+    flush = asyncio.create_task(db._buffer.flush())
+    await asyncio.sleep(0)
+    assert db._buffer.pending == 0
+    return flush
+
+
+def test_history_waits_for_running_flush(run, db):
+    async def scenario():
+        db._buffer.add_search(1, "матрица", "Матрица")
+        flush = await _start_background_flush(db)
+        history = await db.get_search_history(1)
+        await flush
+        return history
+
+    history = run(scenario())
+    assert [(query, movie_name) for query, movie_name, _ in history] == [
+        ("матрица", "Матрица")
+    ]
+
+
+def test_rating_waits_for_running_flush(run, db):
+    async def scenario():
+        db._buffer.add_search(1, "матрица", "Матрица")
+        flush = await _start_background_flush(db)
+        await db.save_rating_to_db(1, 9, "Матрица")
+        await flush
+        async with db._pool.reader() as conn:
+            cursor = await conn.execute(
+                "SELECT movie_name, count, rating FROM movie_stats WHERE user_id = 1"
+            )
+            return await cursor.fetchall()
+
+    assert run(scenario()) == [("Матрица", 1, 9.0)]
+
+
+def test_other_users_do_not_wait(run, db):
+    async def scenario():
+        db._buffer.add_search(1, "матрица", "Матрица")
+        flush = await _start_background_flush(db)
+        history = await db.get_search_history(2)
+        await flush
+        return history
+
+    assert run(scenario()) == []
+
+
+def save_matrix(db, link):
+    return db.save_movie_link(
+        movie_name="Матрица",
+        link=link,
+        title_ru="Матрица",
+        title_en="The Matrix",
+        description_ru="описание",
+        description_en="description",
+        genres_ru="фантастика",
+        genres_en="sci-fi",
+        rating=8.5,
+        year=1999,
+        film_id=301,
+        poster_url="https://example.com/301.jpg",
+    )
+
+
+def test_movie_without_link_is_stored(run, db):
+    async def scenario():
+        await save_matrix(db, None)
+        await db.save_poster_file_id(301, "file-301")
+        return await db.get_movie_info_by_film_id(301)
+
+    record = run(scenario())
+    assert record.title_en == "The Matrix"
+    assert record.link is None
+    assert record.poster_file_id == "file-301"
+
+
+def test_missing_link_keeps_stored_one(run, db):
+    async def scenario():
+        await save_matrix(db, "https://lordfilm.lu/film/301")
+        await save_matrix(db, None)
+        return await db.get_movie_info_by_film_id(301)
+
+    assert run(scenario()).link == "https://lordfilm.lu/film/301"
+
+
+def test_rating_matches_any_title(run, db):
+    async def scenario():
+        await db.record_search(1, "matrix", "The Matrix")
+        saved = await db.save_rating_to_db(1, 8, "Матрица", "The Matrix")
+        missing = await db.save_rating_to_db(1, 8, "Сталкер", None)
+        return saved, missing, await db.get_movie_stats(1)
+
+    saved, missing, stats = run(scenario())
+    assert saved and not missing
+    assert stats == [("The Matrix", 1)]
+
+
+def test_stored_movie_caption_follows_updates(run, db):
+    async def scenario():
+        await save_matrix(db, None)
+        first = await db.get_movie_info_by_film_id(301)
+        captions = first.caption("ru"), first.caption("en")
+        await db.save_movie_link(
+            movie_name="Матрица",
+            link=None,
+            title_ru="Матрица",
+            title_en="The Matrix",
+            description_ru="новое описание",
+            description_en="new description",
+            genres_ru="фантастика, боевик",
+            genres_en="sci-fi, action",
+            rating=8.7,
+            year=1999,
+            film_id=301,
+        )
+        second = await db.get_movie_info_by_film_id(301)
+        return captions, second, second.caption("en")
+
+    (ru, en), movie, updated = run(scenario())
+    assert "Матрица" in ru and "описание" in ru
+    assert "The Matrix" in en and "sci-fi" in en
+    assert movie.genres == ("фантастика", "боевик")
+    assert "new description" in updated and "action" in updated
+
+
+def test_stored_movie_json_round_trip(run, db):
+    run(save_matrix(db, "https://lordfilm.lu/matrix"))
+    movie = run(db.get_movie_info_by_film_id(301))
+    data = movie.to_json()
+    assert MovieInfo.from_json(data) == movie
+    assert MovieInfo.from_json(data).to_json() == data
+    assert not hasattr(movie, "__dict__")
+
+
+def test_closed_pool_is_not_reopened(run, db):
+    run(db.close_db())
+    with pytest.raises(RuntimeError):
+        run(db.save_query_alias("матрица", 301))
+    with pytest.raises(RuntimeError):
+        run(db.get_film_id_by_query("матрица"))
+    assert not db._pool.is_open
+
+
+def test_record_from_another_worker_is_seen_after_ttl(run, db, monkeypatch):
+    async def save_elsewhere():
+        # так фильм сохраняет другой процесс: мимо кеша этого процесса
+        async with db._pool.writer() as conn:
+            await conn.execute(
+                "UPDATE movie_links SET description_ru = 'новое описание' WHERE film_id = 301"
+            )
+
+    run(save_matrix(db, None))
+    first = run(db.get_movie_info_by_film_id(301))
+    caption = first.caption("ru")
+    run(save_elsewhere())
+    assert run(db.get_movie_info_by_film_id(301)) is first
+
+    monkeypatch.setattr(db.movie_record_cache, "ttl", 0.0)
+    second = run(db.get_movie_info_by_film_id(301))
+    assert second.description == "новое описание"
+    # подпись к старой записи не отдается для новой
+    assert "новое описание" in second.caption("ru")
+    assert first.caption("ru") == caption
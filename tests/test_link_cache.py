@@ -0,0 +1,149 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+
+import movie_finder
+from movie_finder import LinkCache
+
+GOOD_LINK = "/url?q=https://lordfilm.lu/film/1&sa=U"
+GOOD_PAGE = f'<a href="{GOOD_LINK}">lordfilm</a>'
+# только сайты, которые бот отбрасывает
+EMPTY_PAGE = '<a href="/url?q=https://www.kinopoisk.ru/film/1&sa=U">kinopoisk</a>'
+
+
+@pytest.fixture
+def google(serve, monkeypatch):
+    """
+    Google, который отвечает по очереди статусами и страницами из replies.
+    """
+    replies = []
+
+    async def search(request):
+        status, body = replies.pop(0) if replies else (200, EMPTY_PAGE)
+        return web.Response(status=status, text=body, content_type="text/html")
+
+    monkeypatch.setattr(movie_finder, "GOOGLE_URL", serve([web.get("/search", search)]))
+    return replies
+
+
+def test_google_error_is_not_cached(run, db, google):
+    google.extend([(403, "forbidden")] * movie_finder.NUM_PAGES_TO_SCRAPE)
+    cache = LinkCache()
+    assert run(cache.get_link("Фильм", "ru")) is None
+    assert run(db.get_link_cache_entry("Фильм", "ru")) is None
+    assert run(cache.get_link("Фильм", "ru")) is None
+    assert cache.stats()["negative_hits"] == 0
+    assert cache.stats()["misses"] == 2
+
+
+def test_partial_google_error_without_link_is_not_cached(run, db, google):
+    google.extend([(200, EMPTY_PAGE), (403, "forbidden")])
+    cache = LinkCache()
+    assert run(cache.get_link("Фильм", "ru")) is None
+    assert run(db.get_link_cache_entry("Фильм", "ru")) is None
+
+
+def test_empty_results_are_cached_negatively(run, db, google):
+    cache = LinkCache()
+    assert run(cache.get_link("Фильм", "ru")) is None
+    assert run(db.get_link_cache_entry("Фильм", "ru"))[0] is None
+    assert run(cache.get_link("Фильм", "ru")) is None
+    assert cache.stats()["negative_hits"] == 1
+
+
+def test_found_link_is_cached(run, db, google):
+    google.append((200, GOOD_PAGE))
+    cache = LinkCache()
+    assert run(cache.get_link("Фильм", "ru")) == GOOD_LINK
+    assert run(cache.get_link("Фильм", "ru")) == GOOD_LINK
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.parametrize("lang", ["ru", "en"])
+def test_stored_movie_link_goes_through_link_cache(run, db, google, lang):
+    import bot
+
+    async def scenario():
+        await db.save_movie_link(
+            "Фильм", "https://old.example/1", "Фильм", "Film", "о", "d",
+            "драма", "drama", 7.0, 2000, film_id=1,
+        )
+        title = "Фильм" if lang == "ru" else "Film"
+        expired = time.time() - bot.link_cache.ttl - 1
+        await db.save_link_cache_entry(title, lang, "https://old.example/1", expired)
+        stale_before = bot.link_cache.stale_hits
+        movie_info, link, _ = await bot.resolve_movie(title, lang)
+        stale = bot.link_cache.stale_hits - stale_before
+        for task in list(bot.link_cache._revalidating.values()):
+            await task
+        return link, stale, await db.get_link_cache_entry(title, lang)
+
+    google.append((200, GOOD_PAGE))
+    link, stale, entry = run(scenario())
+    assert link == "https://old.example/1"
+    assert stale == 1
+    assert entry[0] == GOOD_LINK
+
+
+def test_migration_seeds_link_cache_from_movie_links(run, db):
+    async def scenario():
+        async with db._pool.writer() as conn:
+            await conn.execute(
+                "INSERT INTO movie_links (movie_name, link, title_ru) VALUES (?, ?, ?)",
+                ("Фильм", "https://old.example/1", "Фильм"),
+            )
+            await conn.execute(f"PRAGMA user_version = {len(db.MIGRATIONS) - 1}")
+        async with db._pool.writer() as conn:
+            await db.migrate(conn)
+        return await db.get_link_cache_entry("Фильм", "ru")
+
+    link, fetched_at = run(scenario())
+    assert link == "https://old.example/1"
+    assert abs(fetched_at - time.time()) < 5
+
+
+def test_stop_cancels_background_revalidation(run, db, serve, monkeypatch):
+    finished = asyncio.Event()
+
+    async def slow(request):
+        # Google отвечает только в конце теста
+        await finished.wait()
+        return web.Response(text=GOOD_PAGE, content_type="text/html")
+
+    monkeypatch.setattr(movie_finder, "GOOGLE_URL", serve([web.get("/search", slow)]))
+    cache = LinkCache()
+
+    async def scenario():
+        expired = time.time() - cache.ttl - 1
+        await db.save_link_cache_entry("Фильм", "ru", GOOD_LINK, expired)
+        link = await cache.get_link("Фильм", "ru")
+        # фоновый поиск успел уйти в Google
+        await asyncio.sleep(0.05)
+        revalidating = cache.stats()["revalidating"]
+        await cache.stop()
+        finished.set()
+        return link, revalidating
+
+    link, revalidating = run(scenario())
+    assert link == GOOD_LINK
+    assert revalidating == 1
+    assert cache.stats()["revalidating"] == 0
+    # запись осталась старой: отмененный поиск ничего не записал
+    assert run(db.get_link_cache_entry("Фильм", "ru"))[0] == GOOD_LINK
+
+
+def test_stats_count_served_entry_ages(run, db, google):
+    google.append((200, GOOD_PAGE))
+    cache = LinkCache()
+    run(cache.get_link("Фильм", "ru"))
+    run(cache.get_link("Фильм", "ru"))
+    run(db.save_link_cache_entry("Старый", "ru", GOOD_LINK, time.time() - 2 * 24 * 60 * 60))
+    run(cache.get_link("Старый", "ru"))
+    stats = cache.stats()
+    # промах не считается: ссылка отдана не из кеша
+    assert stats["age_count"] == 2
+    assert stats["age_le_3600"] == 1
+    assert stats["age_le_86400"] == 1
+    assert stats[f"age_le_{movie_finder.LINK_TTL}"] == 2
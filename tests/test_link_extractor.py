@@ -0,0 +1,42 @@
+import pytest
+
+import movie_finder
+from link_extractor import EXTRACTORS, available_extractors, get_extractor
+
+BACKENDS = [name for name in available_extractors() if name != "soup"]
+
+EDGE_CASES = [
+    '<a href="/url?q=https://lordfilm.lu/film/1&amp;sa=U">x</a>',
+    "<A HREF='/url?q=https://rezka.men/films/2&sa=U'>x</A>",
+    "<a href=https://gidonline.fun/film/3/>x</a>",
+    '<a name="bottom"></a><a href="">empty</a><a>no href</a>',
+    '<!-- <a href="/commented"> --><script>var a = "<a href=/in-script>";</script>',
+    '<div><a href="/unclosed">x<div><a href="/nested">y</a></div>',
+    "",
+]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_backends_match_soup_on_saved_pages(google_pages, backend):
+    soup, extractor = EXTRACTORS["soup"](), EXTRACTORS[backend]()
+    for name, html in google_pages.items():
+        assert extractor.extract(html) == soup.extract(html), name
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("html", EDGE_CASES)
+def test_backends_match_soup_on_edge_cases(backend, html):
+    assert EXTRACTORS[backend]().extract(html) == EXTRACTORS["soup"]().extract(html)
+
+
+def test_saved_pages_give_the_same_links(google_pages):
+    """
+    Ссылки, которые бот берет со страницы, не зависят от бэкенда.
+    """
+    soup = EXTRACTORS["soup"]()
+    for name, html in google_pages.items():
+        expected = [link for link in soup.extract(html) if movie_finder.good_link(link)]
+        assert expected, name
+        for backend in BACKENDS:
+            links = [link for link in get_extractor(backend).extract(html) if movie_finder.good_link(link)]
+            assert links == expected, (backend, name)
@@ -0,0 +1,39 @@
+"""
+Скорость и память бэкендов link_extractor на сохраненных страницах выдачи.
+Нужен pytest-benchmark; без него модуль пропускается.
+
+    python -m pytest tests/test_link_extractor_benchmark.py --benchmark-only
+"""
+import tracemalloc
+
+import pytest
+
+from link_extractor import EXTRACTORS, available_extractors
+
+pytest.importorskip("pytest_benchmark")
+
+
+@pytest.mark.parametrize("backend", available_extractors())
+def test_extract_corpus(benchmark, google_pages, backend):
+    extractor = EXTRACTORS[backend]()
+    pages = list(google_pages.values())
+
+    def extract_all():
+        return [extractor.extract(html) for html in pages]
+
+    # пик памяти на разбор одной страницы
+    links, peak = [], 0
+    tracemalloc.start()
+    try:
+        for html in pages:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            links.append(extractor.extract(html))
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+
+    result = benchmark(extract_all)
+    assert result == links
+    benchmark.extra_info["pages_per_sec"] = len(pages) / benchmark.stats.stats.mean
+    benchmark.extra_info["peak_kib_per_page"] = peak / 1024
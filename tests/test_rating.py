@@ -0,0 +1,74 @@
+import gc
+import os
+import tracemalloc
+
+import bot
+from conftest import callback_update, message_update
+
+# сколько поисков делает тест на утечки; для долгого прогона
+# CINEMABOT_SOAK_SEARCHES=1000000
+SOAK_SEARCHES = int(os.getenv("CINEMABOT_SOAK_SEARCHES", "1000"))
+
+
+async def stats_rating(db, user_id):
+    async with db._pool.reader() as conn:
+        cursor = await conn.execute(
+            "SELECT movie_name, rating FROM movie_stats WHERE user_id = ?", (user_id,)
+        )
+        return await cursor.fetchall()
+
+
+def rate(film_id, rating, user_id, update_id):
+    data = bot.RatingCallback(rating=rating, film_id=film_id).pack()
+    return callback_update(data, user_id=user_id, update_id=update_id)
+
+
+def test_rating_after_language_switch(run, feed, db, stand_ins):
+    run(feed(message_update("фильм 900", user_id=5, update_id=1)))
+    run(bot.PROFILES.set_language(5, "en"))
+    run(feed(rate(900, 3, user_id=5, update_id=2)))
+    assert run(stats_rating(db, 5)) == [("Фильм 900", 3.0)]
+
+
+def test_rating_without_search_is_not_found(run, feed, db, stand_ins):
+    run(feed(message_update("фильм 901", user_id=6, update_id=1)))
+    stand_ins.first_reply.clear()
+    # другой пользователь этот фильм не искал
+    run(feed(rate(901, 3, user_id=7, update_id=2)))
+    assert run(stats_rating(db, 7)) == []
+    assert "callback_query_id:2" in stand_ins.first_reply
+
+
+def test_memory_stays_flat_under_searches_and_ratings(run, feed, stand_ins):
+    """
+    Повторные поиски и оценки не копят состояние в памяти: после разогрева
+    (каталог и кеши заполнены) память не растет вместе с числом поисков.
+    """
+    films, users = 20, 50
+
+    async def searches(start, count):
+        for n in range(start, start + count):
+            film_id = 950 + n % films
+            user_id = 100 + n % users
+            await feed(message_update(f"фильм {film_id}", user_id=user_id, update_id=n))
+            await feed(rate(film_id, 1 + n % 10, user_id=user_id, update_id=n))
+            # заглушка Bot API запоминает каждый чат, это память теста, а не бота
+            stand_ins.first_reply.clear()
+
+    def traced():
+        gc.collect()
+        return tracemalloc.get_traced_memory()[0]
+
+    warm_up = max(SOAK_SEARCHES // 5, films * users // 10)
+    run(searches(0, warm_up))
+    tracemalloc.start()
+    try:
+        run(searches(warm_up, SOAK_SEARCHES // 2))
+        middle = traced()
+        run(searches(warm_up + SOAK_SEARCHES // 2, SOAK_SEARCHES // 2))
+        end = traced()
+    finally:
+        tracemalloc.stop()
+    assert stand_ins.calls["kinopoisk"] == films
+    print(f"\n{SOAK_SEARCHES} searches: {(end - middle) / 1024:.1f} KiB growth")
+    assert end - middle < 64 * 1024, f"grew by {(end - middle) / 1024:.0f} KiB"
@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+import bot
+import loadtest
+import movie_finder
+import pytest
+
+from conftest import callback_update, message_update
+from throttle import UpstreamUnavailable
+
+OUTBOUND = ("kinopoisk", "google", "translate")
+
+
+async def stored_link(db, film_id):
+    record = await db.get_movie_info_by_film_id(film_id)
+    return record.link if record else "missing"
+
+
+@pytest.mark.parametrize("found", [True, False], ids=["with_link", "without_link"])
+def test_repeat_search_makes_no_outbound_calls(run, feed, db, stand_ins, monkeypatch, found):
+    film_id = 700 + found
+    if found:
+        stand_ins.args.link_hit = 1.0
+    else:
+        # в выдаче только сайты, которые бот отбрасывает
+        stand_ins.args.link_hit = 0.0
+        monkeypatch.setattr(loadtest, "OTHER_HOSTS", ["kinopoisk.ru", "ivi.ru"])
+    text = f"фильм {film_id}"
+
+    run(feed(message_update(text, user_id=1, update_id=1)))
+    assert stand_ins.calls["kinopoisk"] == 1
+    assert stand_ins.calls["google"] >= 1
+    assert (run(stored_link(db, film_id)) is None) is not found
+
+    stand_ins.calls.clear()
+    run(feed(message_update(text, user_id=2, update_id=2)))
+    assert {service: stand_ins.calls[service] for service in OUTBOUND} == dict.fromkeys(OUTBOUND, 0)
+    # бот ответил: описание фильма ушло в заглушку Bot API
+    assert stand_ins.calls["telegram"] >= 1
+
+
+def test_simultaneous_identical_searches_collapse(run, feed, db, stand_ins):
+    stand_ins.args.link_hit = 1.0
+    stand_ins.args.kinopoisk_latency = 0.05
+    stand_ins.args.google_latency = 0.05
+    stand_ins.args.translate_latency = 0.05
+    updates = [
+        message_update("фильм 800", user_id=1000 + n, update_id=1000 + n) for n in range(200)
+    ]
+
+    async def scenario():
+        await asyncio.gather(*[feed(update) for update in updates])
+        await db._buffer.flush()
+        async with db._pool.reader() as conn:
+            cursor = await conn.execute(
+                "SELECT user_id, query, movie_name FROM search_history WHERE user_id >= 1000"
+            )
+            history = await cursor.fetchall()
+            cursor = await conn.execute(
+                "SELECT user_id, movie_name, count FROM movie_stats WHERE user_id >= 1000"
+            )
+            stats = await cursor.fetchall()
+        return history, stats
+
+    history, stats = run(scenario())
+    assert stand_ins.calls["kinopoisk"] == 1
+    assert stand_ins.calls["google"] == 1
+    assert stand_ins.calls["translate"] <= 1
+    # каждый пользователь получил ответ в свой чат
+    assert len([key for key in stand_ins.first_reply if key.startswith("chat_id:")]) == 200
+    # поиск выполнился один раз, но история и статистика у каждого свои
+    users = range(1000, 1200)
+    assert sorted(history) == [(user_id, "фильм 800", "Фильм 800") for user_id in users]
+    assert sorted(stats) == [(user_id, "Фильм 800", 1) for user_id in users]
+
+
+def test_genre_pick_skips_keyword_search(run, feed, db, stand_ins, monkeypatch):
+    stand_ins.args.link_hit = 1.0
+    keyword_searches = []
+
+    async def get_movie_info(movie_name, session=None):
+        keyword_searches.append(movie_name)
+
+    monkeypatch.setattr(bot, "get_movie_info", get_movie_info)
+    monkeypatch.setattr(movie_finder.random, "choice", lambda films: films[0])
+    press = bot.GenreCallback(genre_name="драма").pack()
+
+    run(feed(callback_update(press, user_id=20, update_id=1)))
+    film = movie_finder.top250_catalogue.by_genre["драма"][0]
+    record = run(db.get_movie_info_by_film_id(film["filmId"]))
+    assert record is not None and record.link is not None
+    assert run(db.get_film_id_by_query(bot.normalize_query(film["nameRu"]))) == film["filmId"]
+
+    # второе нажатие берет фильм из базы и не переводит его заново
+    stand_ins.calls.clear()
+    run(feed(callback_update(press, user_id=21, update_id=2)))
+    assert stand_ins.calls["translate"] == 0
+    assert keyword_searches == []
+
+
+def test_kinopoisk_outage_falls_back_to_a_similar_stored_movie(run, feed, db, stand_ins, monkeypatch):
+    stand_ins.args.link_hit = 1.0
+    run(feed(message_update("фильм 810", user_id=30, update_id=1)))
+    monkeypatch.setattr(movie_finder.KINOPOISK.breaker, "opened_at", time.monotonic())
+    stand_ins.calls.clear()
+    stand_ins.first_reply.clear()
+
+    # "кино фильм 810" похоже на "Фильм 810" меньше, чем нужно для обычного
+    # поиска по базе, но Кинопоиск недоступен
+    run(feed(message_update("кино фильм 810", user_id=31, update_id=2)))
+    assert stand_ins.calls["kinopoisk"] == 0
+    assert bot.local_search_stats.counts["fallback"] >= 1
+    assert run(db.get_film_id_by_query("кино фильм 810")) is None
+    # бот ответил фильмом, а не сообщением об ошибке
+    assert stand_ins.calls["photo_by_url"] + stand_ins.calls["photo_by_file_id"] == 1
+
+    with pytest.raises(UpstreamUnavailable):
+        run(bot.resolve_movie("фильм 999", "ru"))
@@ -0,0 +1,95 @@
+import bot
+import pytest
+
+from movie_finder import (
+    UNKNOWN_SITE_PRIORITY,
+    get_priority,
+    good_link,
+    good_sites_with_priorities,
+    select_most_relevant_link,
+    site_classifier,
+)
+
+LORDFILM = good_sites_with_priorities["lordfilm"]
+REZKA = good_sites_with_priorities["rezka.men"]
+
+# ссылки в том виде, в каком они приходят в href выдачи Google
+GOOGLE_REDIRECTS = [
+    (
+        "/url?q=https://lordfilm.lu/filmy/1234-interstellar.html&sa=U"
+        "&ved=2ahUKEwiM4vL0&usg=AOvVaw0x",
+        "lordfilm.lu",
+        LORDFILM,
+    ),
+    (
+        "/url?esrc=s&q=&rct=j&sa=U&url=https://lordfilm.lu/filmy/1234-interstellar.html"
+        "&ved=2ahUKEwiM4vL0&usg=AOvVaw0x",
+        "lordfilm.lu",
+        LORDFILM,
+    ),
+    (
+        "/url?q=https%3A%2F%2Frezka.men%2Ffilms%2Ffiction%2F1-interstellar.html&sa=U",
+        "rezka.men",
+        REZKA,
+    ),
+    (
+        "/url?sa=t&source=web&rct=j&url=https%3A%2F%2Fwww.ivi.ru%2Fwatch%2F99"
+        "&ved=2ahUKE&usg=AOvVaw1",
+        "www.ivi.ru",
+        0,
+    ),
+    ("/url?q=https://www.kinopoisk.ru/film/258687/&sa=U", "www.kinopoisk.ru", 0),
+    (
+        "/url?q=https://ru.wikipedia.org/wiki/%25D0%2598%25D0%25BD%25D1%2582&sa=U",
+        "ru.wikipedia.org",
+        UNKNOWN_SITE_PRIORITY,
+    ),
+    # "ivi" и "prime" только в адресе страницы, а не в хосте
+    (
+        "/url?q=https://lordfilm.lu/search%3Fref%3Divi%26tag%3Dprime&sa=U",
+        "lordfilm.lu",
+        LORDFILM,
+    ),
+    ("/url?q=https%3a%2f%2fLordFilm.lu%2ffilm%2f1&sa=U", "lordfilm.lu", LORDFILM),
+    ("https://user@Rezka.Men:443/films/1", "rezka.men", REZKA),
+    ("/url?sa=U&ved=2ahUKE", None, 0),
+    ("/url?q=&url=&sa=U", None, 0),
+    ("/search?q=interstellar&start=10", None, 0),
+]
+
+
+# адрес для кнопки "смотреть": раскодированный, со всеми параметрами
+TARGET_URLS = [
+    (GOOGLE_REDIRECTS[0][0], "https://lordfilm.lu/filmy/1234-interstellar.html"),
+    (GOOGLE_REDIRECTS[1][0], "https://lordfilm.lu/filmy/1234-interstellar.html"),
+    (GOOGLE_REDIRECTS[2][0], "https://rezka.men/films/fiction/1-interstellar.html"),
+    (GOOGLE_REDIRECTS[6][0], "https://lordfilm.lu/search?ref=ivi&tag=prime"),
+    (GOOGLE_REDIRECTS[7][0], "https://LordFilm.lu/film/1"),
+    ("https://rezka.men/films/1?s=2&e=3", "https://rezka.men/films/1?s=2&e=3"),
+    ("/url?q=&url=&sa=U", None),
+]
+
+
+@pytest.mark.parametrize("link, url", TARGET_URLS)
+def test_target_url(link, url):
+    assert site_classifier.target_url(link) == url
+
+
+def test_movie_keyboard_uses_target_url():
+    keyboard = bot.get_movie_keyboard(GOOGLE_REDIRECTS[6][0], 1, "ru")
+    assert keyboard.inline_keyboard[0][0].url == "https://lordfilm.lu/search?ref=ivi&tag=prime"
+
+
+@pytest.mark.parametrize("link, host, priority", GOOGLE_REDIRECTS)
+def test_google_redirects(link, host, priority):
+    assert site_classifier.target_host(link) == host
+    assert get_priority(link) == priority
+    assert good_link(link) == (priority != 0)
+
+
+def test_select_most_relevant_link_ranks_and_drops_banned():
+    links = [link for link, _, _ in GOOGLE_REDIRECTS] * 2
+    best = select_most_relevant_link(links, 3)
+    assert [get_priority(link) for link in best] == [LORDFILM, LORDFILM, LORDFILM]
+    assert best[0] == GOOGLE_REDIRECTS[0][0]
+    assert all(get_priority(link) != 0 for link in select_most_relevant_link(links, 100))
@@ -0,0 +1,92 @@
+import pytest
+
+import state_store
+from state_store import (
+    REDIS_PREFIX,
+    InMemoryStateStore,
+    RedisStateStore,
+    SqliteStateStore,
+    UserProfileCache,
+    get_state_store,
+)
+
+
+class FakeRedis:
+    """
+    Хеши redis в словаре: ровно те команды, которыми пользуется RedisStateStore.
+    """
+
+    def __init__(self):
+        self.hashes = {}
+        self.closed = False
+
+    async def hget(self, name, key):
+        return self.hashes.get(name, {}).get(key)
+
+    async def hset(self, name, key, value):
+        self.hashes.setdefault(name, {})[key] = value
+
+    async def aclose(self):
+        self.closed = True
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def store(request, run):
+    if request.param == "sqlite":
+        request.getfixturevalue("db")
+        store = SqliteStateStore()
+    elif request.param == "redis":
+        store = RedisStateStore(client=FakeRedis())
+    else:
+        store = InMemoryStateStore()
+    run(store.open())
+    yield store
+    run(store.close())
+
+
+def test_language_round_trip(run, store):
+    assert run(store.get_language(1)) is None
+    run(store.set_language(1, "en"))
+    run(store.set_language(2, "ru"))
+    run(store.set_language(1, "ru"))
+    assert run(store.get_language(1)) == "ru"
+    assert run(store.get_language(2)) == "ru"
+    assert store.shared is not isinstance(store, InMemoryStateStore)
+
+
+def test_redis_keeps_languages_in_one_hash_and_foreign_client_open(run):
+    client = FakeRedis()
+    store = RedisStateStore(client=client)
+    run(store.set_language(42, "en"))
+    run(store.close())
+    assert client.hashes == {REDIS_PREFIX + "lang": {"42": "en"}}
+    assert not client.closed
+
+
+def test_profile_cache_rereads_after_ttl(run):
+    store = InMemoryStateStore()
+    profiles = UserProfileCache(store, ttl=60.0)
+    run(profiles.set_language(1, "ru"))
+    # язык поменял другой процесс: до истечения ttl виден старый
+    run(store.set_language(1, "en"))
+    assert run(profiles.get_language(1)) == "ru"
+    profiles.ttl = 0.0
+    assert run(profiles.get_language(1)) == "en"
+    assert profiles.stats()["hits"] == 1
+
+
+def test_profile_cache_is_bounded(run):
+    profiles = UserProfileCache(InMemoryStateStore(), maxsize=2)
+    for user_id in range(5):
+        run(profiles.get_language(user_id))
+    assert len(profiles) == 2
+    assert profiles.stats()["misses"] == 5
+
+
+def test_get_state_store(monkeypatch):
+    assert isinstance(get_state_store("memory"), InMemoryStateStore)
+    monkeypatch.setenv("STATE_BACKEND", "sqlite")
+    assert isinstance(get_state_store(), SqliteStateStore)
+    monkeypatch.setattr(state_store, "redis_asyncio", None)
+    with pytest.raises(RuntimeError):
+        get_state_store("redis")
@@ -0,0 +1,105 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from throttle import CircuitBreaker, Upstream, UpstreamError, UpstreamUnavailable
+
+
+@pytest.fixture
+def upstream_server(run):
+    """
+    Сервис, который по /fail отвечает 503, по /slow - только в конце
+    теста, по /broken - 200 с невалидным JSON, по /ok - {"ok": true}.
+    """
+    finished = asyncio.Event()
+
+    async def fail(request):
+        return web.Response(status=503)
+
+    async def slow(request):
+        await finished.wait()
+        return web.json_response({"ok": True})
+
+    async def broken(request):
+        return web.Response(text="{not json", content_type="application/json")
+
+    async def ok(request):
+        return web.json_response({"ok": True})
+
+    app = web.Application()
+    app.add_routes(
+        [web.get("/fail", fail), web.get("/slow", slow), web.get("/broken", broken), web.get("/ok", ok)]
+    )
+    runner = web.AppRunner(app, access_log=None)
+    run(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    run(site.start())
+    yield f"http://127.0.0.1:{runner.addresses[0][1]}"
+    finished.set()
+    run(runner.cleanup())
+
+
+def make_upstream() -> Upstream:
+    return Upstream(
+        "test",
+        rate=1000,
+        burst=1000,
+        concurrency=10,
+        retries=0,
+        breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.05),
+    )
+
+
+async def open_breaker(upstream: Upstream, session: aiohttp.ClientSession, url: str) -> None:
+    with pytest.raises(UpstreamError):
+        await upstream.get(session, url + "/fail")
+    assert upstream.breaker.state == "open"
+    await asyncio.sleep(0.06)
+    assert upstream.breaker.state == "half_open"
+
+
+def test_cancelled_probe_releases_breaker(run, upstream_server):
+    async def scenario():
+        upstream = make_upstream()
+        async with aiohttp.ClientSession() as session:
+            await open_breaker(upstream, session, upstream_server)
+            probe = asyncio.create_task(upstream.get(session, upstream_server + "/slow"))
+            await asyncio.sleep(0.05)
+            with pytest.raises(UpstreamUnavailable):
+                await upstream.get(session, upstream_server + "/ok")
+            probe.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await probe
+            assert await upstream.get(session, upstream_server + "/ok") == {"ok": True}
+            return upstream.breaker.state
+
+    assert run(scenario()) == "closed"
+
+
+def test_probe_with_unexpected_error_releases_breaker(run, upstream_server):
+    async def scenario():
+        upstream = make_upstream()
+        async with aiohttp.ClientSession() as session:
+            await open_breaker(upstream, session, upstream_server)
+            with pytest.raises(ValueError):
+                await upstream.get(session, upstream_server + "/broken")
+            assert await upstream.get(session, upstream_server + "/ok") == {"ok": True}
+            return upstream.breaker.state
+
+    assert run(scenario()) == "closed"
+
+
+def test_only_one_probe_at_a_time(run, upstream_server):
+    async def scenario():
+        upstream = make_upstream()
+        async with aiohttp.ClientSession() as session:
+            await open_breaker(upstream, session, upstream_server)
+            probe = asyncio.create_task(upstream.get(session, upstream_server + "/ok"))
+            await asyncio.sleep(0)
+            with pytest.raises(UpstreamUnavailable):
+                await upstream.get(session, upstream_server + "/ok")
+            return await probe
+
+    assert run(scenario()) == {"ok": True}
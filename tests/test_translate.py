@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+import translate
+
+
+async def heartbeat(ticks, stop):
+    """
+    Считает, как часто event loop успевает выполнить короткую задачу.
+    """
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(0.01)
+        now = time.perf_counter()
+        ticks.append(now - last)
+        last = now
+
+
+def test_slow_translation_does_not_block_other_handlers(run, db, stand_ins):
+    stand_ins.args.translate_latency = 0.5
+
+    async def other_handler():
+        started = time.perf_counter()
+        await db.get_search_history(1)
+        await translate.translate_many(["Драма"], timeout=0.05)
+        return time.perf_counter() - started
+
+    async def scenario():
+        ticks, stop = [], asyncio.Event()
+        beat = asyncio.create_task(heartbeat(ticks, stop))
+        slow = asyncio.create_task(
+            translate.translate_many(["Медленное описание", "фантастика"])
+        )
+        await asyncio.sleep(0.05)
+        other = await other_handler()
+        result = await slow
+        stop.set()
+        await beat
+        return result, other, ticks
+
+    result, other, ticks = run(scenario())
+    assert result == ["[en] Медленное описание", "[en] фантастика"]
+    # описание и жанр ушли переводчику одним запросом, второй - от other_handler
+    assert stand_ins.calls["translate"] == 2
+    assert other < 0.3
+    assert len(ticks) > 20
+    assert max(ticks) < 0.2
+
+
+def test_timeout_falls_back_to_original_text(run, db, stand_ins):
+    stand_ins.args.translate_latency = 1.0
+
+    started = time.perf_counter()
+    result = run(translate.translate_many(["Описание с таймаутом"], timeout=0.1))
+    assert result == ["Описание с таймаутом"]
+    assert time.perf_counter() - started < 0.5
+
+    # непереведенный текст не попадает в кеш: следующий запрос снова идет к переводчику
+    stand_ins.args.translate_latency = 0
+    result = run(translate.translate_many(["Описание с таймаутом"]))
+    assert result == ["[en] Описание с таймаутом"]
@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+import aiohttp
+import pytest
+
+import bot
+from conftest import message_update
+
+TELEGRAM_MAX_CONNECTIONS = 40
+
+
+def test_webhook_mode_requires_url(monkeypatch):
+    monkeypatch.setattr(bot, "BOT_MODE", "webhook")
+    monkeypatch.setattr(bot, "WEBHOOK_URL", None)
+    with pytest.raises(RuntimeError, match="WEBHOOK_URL"):
+        bot.check_config()
+    monkeypatch.setattr(bot, "WEBHOOK_URL", "https://bot.example")
+    bot.check_config()
+
+
+def test_startup_sets_commands(run, stand_ins):
+    run(bot.dp.emit_startup(bot=bot.bot))
+    # меню команд на русском и на английском
+    assert stand_ins.calls["telegram"] == 2
+
+
+def test_webhook_acks_updates_before_handling(run, feed, serve, stand_ins):
+    updates = 200
+    stand_ins.args.telegram_latency = 0.5
+    url = serve(bot.create_webhook_app()) + bot.WEBHOOK_PATH
+
+    async def scenario():
+        acks = []
+        # как Telegram: не больше 40 соединений к webhook (max_connections по умолчанию)
+        connector = aiohttp.TCPConnector(limit=TELEGRAM_MAX_CONNECTIONS)
+        slots = asyncio.Semaphore(TELEGRAM_MAX_CONNECTIONS)
+        async with aiohttp.ClientSession(connector=connector) as session:
+
+            async def post(n):
+                async with slots:
+                    started = time.perf_counter()
+                    async with session.post(url, json=message_update("/help", update_id=2000 + n)) as response:
+                        acks.append((response.status, time.perf_counter() - started))
+
+            began = time.perf_counter()
+            await asyncio.gather(*[post(n) for n in range(updates)])
+            acked = time.perf_counter() - began
+            # ответы бота приходят уже после подтверждений
+            while len(stand_ins.first_reply) < updates and time.perf_counter() - began < 10:
+                await asyncio.sleep(0.01)
+            handled = time.perf_counter() - began
+        return acks, acked, handled
+
+    acks, acked, handled = run(scenario())
+    latencies = sorted(latency for _, latency in acks)
+    print(
+        f"\n{updates} updates: acked at {updates / acked:.0f} updates/s,"
+        f" handled at {updates / handled:.0f} updates/s,"
+        f" ack p50 {1000 * latencies[len(latencies) // 2]:.1f} ms,"
+        f" p99 {1000 * latencies[int(0.99 * len(latencies))]:.1f} ms"
+    )
+    assert {status for status, _ in acks} == {200}
+    assert len(stand_ins.first_reply) == updates
+    # подтверждение не ждет ответа бота в Telegram
+    assert latencies[-1] < stand_ins.args.telegram_latency
+    assert acked < handled
@@ -0,0 +1,271 @@
+import asyncio
+import random
+import time
+import typing as tp
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+from metrics import REGISTRY
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    """
+    Внешний сервис не ответил успешно.
+
+    :param status: HTTP-статус ответа или None при сетевой ошибке.
+    """
+
+    def __init__(self, upstream: str, status: tp.Optional[int] = None, reason: str = ""):
+        self.upstream = upstream
+        self.status = status
+        super().__init__(f"{upstream}: status {status} {reason}".strip())
+
+
+class UpstreamUnavailable(UpstreamError):
+    """
+    Запрос не отправлялся, потому что сервис недавно много раз подряд падал.
+    """
+
+
+class TokenBucket:
+    """
+    Ограничивает частоту запросов: rate запросов в секунду, пачками до burst.
+    Ожидающие получают токены по очереди.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class CircuitBreaker:
+    """
+    После failure_threshold неудач подряд перестает пропускать запросы на
+    reset_timeout секунд, затем пропускает один пробный запрос.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: tp.Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    @property
+    def probing(self) -> bool:
+        """
+        True, пока пробный запрос в состоянии half_open не закончился.
+        """
+        return self._probing
+
+    def release_probe(self) -> None:
+        """
+        Пробный запрос прервался, не получив ответа (отмена, неожиданное
+        исключение): следующий запрос снова может стать пробным.
+        """
+        self._probing = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+
+class Upstream:
+    """
+    Ограничитель запросов к одному внешнему сервису: не больше concurrency
+    запросов одновременно и rate запросов в секунду, повтор с экспоненциальной
+    задержкой и джиттером на 429/5xx и сетевых ошибках, circuit breaker.
+
+    :param name: Имя сервиса для логов и метрик.
+    :param rate: Запросов в секунду.
+    :param burst: Размер пачки запросов сверх rate.
+    :param concurrency: Максимум одновременных запросов.
+    :param retries: Количество повторов после первой попытки.
+    :param backoff: Базовая задержка перед повтором в секундах.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: int,
+        concurrency: int,
+        retries: int = 2,
+        backoff: float = 0.5,
+        max_backoff: float = 8.0,
+        breaker: tp.Optional[CircuitBreaker] = None,
+    ):
+        self.name = name
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = breaker or CircuitBreaker()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.queued = 0
+        self.max_queued = 0
+        self.in_flight = 0
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+        self.short_circuits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def stats(self) -> tp.Dict[str, tp.Any]:
+        return {
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "retries": self.retried,
+            "failures": self.failures,
+            "short_circuits": self.short_circuits,
+            "wait_avg": self.wait_total / self.requests if self.requests else 0.0,
+            "wait_max": self.wait_max,
+            "breaker": self.breaker.state,
+            "breaker_open": self.breaker.is_open,
+        }
+
+    @asynccontextmanager
+    async def slot(self) -> tp.AsyncIterator[None]:
+        """
+        Ждет своей очереди на запрос; время ожидания попадает в метрики.
+        """
+        if not self.breaker.allow():
+            self.short_circuits += 1
+            raise UpstreamUnavailable(self.name, reason="circuit open")
+        probe = self.breaker.probing
+        try:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+            started = time.monotonic()
+            try:
+                await self._semaphore.acquire()
+                try:
+                    await self.bucket.acquire()
+                except BaseException:
+                    self._semaphore.release()
+                    raise
+            finally:
+                self.queued -= 1
+            waited = time.monotonic() - started
+            self.requests += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+                self._semaphore.release()
+        except BaseException:
+            # проба не дошла до record_success/record_failure, иначе
+            # breaker навсегда остался бы в half_open без права на пробу
+            if probe:
+                self.breaker.release_probe()
+            raise
+
+    def _observe(self, started: float, outcome: str) -> None:
+        REGISTRY.observe(
+            "cinemabot_upstream_seconds",
+            time.perf_counter() - started,
+            upstream=self.name,
+            outcome=outcome,
+        )
+
+    def _delay(self, attempt: int, retry_after: tp.Optional[str]) -> float:
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+        return random.uniform(0, delay)
+
+    async def get(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        read: str = "json",
+        **kwargs: tp.Any,
+    ) -> tp.Any:
+        """
+        GET-запрос с ограничениями и повторами.
+
+        :param read: "json" или "text" - как читать тело успешного ответа.
+        :raises UpstreamUnavailable: Если circuit breaker открыт.
+        :raises UpstreamError: Если все попытки закончились неудачей.
+        """
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            async with self.slot():
+                started = time.perf_counter()
+                try:
+                    async with session.get(url, **kwargs) as response:
+                        if response.status == 200:
+                            body = await (
+                                response.json() if read == "json" else response.text()
+                            )
+                            self.breaker.record_success()
+                            self._observe(started, "200")
+                            return body
+                        error = UpstreamError(self.name, response.status)
+                        retry_after = response.headers.get("Retry-After")
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = UpstreamError(self.name, reason=repr(e))
+                self._observe(started, str(error.status or "error"))
+            if error.status is not None and error.status not in RETRY_STATUSES:
+                self.breaker.record_success()
+                raise error
+            self.failures += 1
+            self.breaker.record_failure()
+            if attempt == self.retries or self.breaker.is_open:
+                raise error
+            self.retried += 1
+            await asyncio.sleep(self._delay(attempt, retry_after))
+        raise error
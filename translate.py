@@ -1,9 +1,106 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import typing as tp
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
 import translators as ts
 
+from db_helper import get_translations, save_translations
+from metrics import timer
+
+TRANSLATE_WORKERS = 4
+TRANSLATE_TIMEOUT = 5.0
+TRANSLATION_CACHE_SIZE = 2048
+BATCH_SEPARATOR = "\n"
+# сервер с API как у LibreTranslate (POST /translate); если не задан,
+# переводит Яндекс через translators
+TRANSLATE_API_URL = os.getenv("TRANSLATE_API_URL")
+
+# translators делает блокирующие сетевые запросы, поэтому они выполняются
+# в ограниченном пуле потоков, а не прямо в event loop
+_executor = ThreadPoolExecutor(
+    max_workers=TRANSLATE_WORKERS, thread_name_prefix="translate"
+)
+
+
+class TranslationCache:
+    """
+    Ограниченный LRU-кеш переводов в памяти. Стоит перед таблицей
+    translations в movie.db и считает попадания по обоим уровням.
+
+    :param maxsize: Максимальное количество переводов в памяти.
+    """
+
+    def __init__(self, maxsize: int = TRANSLATION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items: tp.OrderedDict[tp.Tuple[str, str, str], str] = OrderedDict()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.external_calls = 0
+        self.started_at = time.monotonic()
+
+    def get(self, key: tp.Tuple[str, str, str]) -> tp.Optional[str]:
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key: tp.Tuple[str, str, str], value: str) -> None:
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def stats(self) -> tp.Dict[str, float]:
+        """
+        Счетчики кеша и число внешних запросов на перевод,
+        которых удалось избежать, в пересчете на час.
+        """
+        hours = max(time.monotonic() - self.started_at, 1.0) / 3600
+        hits = self.memory_hits + self.db_hits
+        return {
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "external_calls": self.external_calls,
+            "size": len(self._items),
+            "avoided_calls_per_hour": hits / hours,
+        }
+
+
+_cache = TranslationCache()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def translation_cache_stats() -> tp.Dict[str, float]:
+    return _cache.stats()
+
 
 def translate_text(
     text: str, inp_language: str = "ru", target_language: str = "en"
 ) -> str:
+    if TRANSLATE_API_URL:
+        response = requests.post(
+            TRANSLATE_API_URL + "/translate",
+            json={
+                "q": text,
+                "source": inp_language,
+                "target": target_language,
+                "format": "text",
+            },
+            timeout=TRANSLATE_TIMEOUT,
+        )
+        response.raise_for_status()
+        return response.json()["translatedText"]
     new_text = ts.translate_text(
         text,
         translator="yandex",
@@ -11,3 +108,111 @@ def translate_text(
         to_language=target_language,
     )
     return new_text
+
+
+async def _translate_external(
+    text: str, inp_language: str, target_language: str, timeout: float
+) -> tp.Optional[str]:
+    """
+    Переводит текст в пуле потоков. Возвращает None при ошибке или таймауте.
+    """
+    loop = asyncio.get_running_loop()
+    _cache.external_calls += 1
+    try:
+        return await asyncio.wait_for(
+            loop.run_in_executor(
+                _executor, translate_text, text, inp_language, target_language
+            ),
+            timeout,
+        )
+    except Exception as e:
+        logging.warning(f"translation failed, using original text: {e!r}")
+        return None
+
+
+async def _translate_batch(
+    texts: tp.List[str], inp_language: str, target_language: str, timeout: float
+) -> tp.List[tp.Optional[str]]:
+    """
+    Переводит несколько строк одним запросом, склеивая их через перевод строки.
+    Если строки так склеить нельзя или перевод вернул другое число строк,
+    переводит каждую строку отдельно и параллельно.
+    """
+    if len(texts) > 1 and not any(BATCH_SEPARATOR in text for text in texts):
+        translated = await _translate_external(
+            BATCH_SEPARATOR.join(texts), inp_language, target_language, timeout
+        )
+        if translated is None:
+            return [None] * len(texts)
+        parts = translated.split(BATCH_SEPARATOR)
+        if len(parts) == len(texts):
+            return parts
+    return list(
+        await asyncio.gather(
+            *[
+                _translate_external(text, inp_language, target_language, timeout)
+                for text in texts
+            ]
+        )
+    )
+
+
+async def translate_many(
+    texts: tp.List[str],
+    inp_language: str = "ru",
+    target_language: str = "en",
+    timeout: float = TRANSLATE_TIMEOUT,
+) -> tp.List[str]:
+    """
+    Переводит список строк, сначала заглядывая в кеш в памяти, затем в
+    таблицу translations, и только оставшиеся строки отправляет переводчику.
+    Строки, которые перевести не удалось, возвращаются без перевода.
+    """
+    hashes = [text_hash(text) for text in texts]
+    unique = dict(zip(hashes, texts))
+    found: tp.Dict[str, str] = {}
+
+    for h in unique:
+        cached = _cache.get((h, inp_language, target_language))
+        if cached is not None:
+            found[h] = cached
+            _cache.memory_hits += 1
+
+    missing = [h for h in unique if h not in found]
+    if missing:
+        try:
+            from_db = await get_translations(missing, inp_language, target_language)
+        except Exception as e:
+            logging.error(f"Error reading translation cache: {e}")
+            from_db = {}
+        _cache.db_hits += len(from_db)
+        for h, translation in from_db.items():
+            found[h] = translation
+            _cache.put((h, inp_language, target_language), translation)
+
+    missing = [h for h in unique if h not in found]
+    if missing:
+        _cache.misses += len(missing)
+        with timer("cinemabot_stage", stage="translate"):
+            translated = await _translate_batch(
+                [unique[h] for h in missing], inp_language, target_language, timeout
+            )
+        fresh = {h: tr for h, tr in zip(missing, translated) if tr is not None}
+        for h, translation in fresh.items():
+            found[h] = translation
+            _cache.put((h, inp_language, target_language), translation)
+        try:
+            await save_translations(fresh, inp_language, target_language)
+        except Exception as e:
+            logging.error(f"Error saving translations: {e}")
+
+    return [found.get(h, text) for h, text in zip(hashes, texts)]
+
+
+async def warm_up_translations(
+    texts: tp.Iterable[str], inp_language: str = "ru", target_language: str = "en"
+) -> None:
+    """
+    Заранее заполняет кеш переводами часто встречающихся строк (например, жанров).
+    """
+    await translate_many(list(texts), inp_language, target_language)